@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Google discovery service and APIs, to run shoogle offline.
+
+Usage: python -m benchmarks.fakeapi [--port N] [--latency MS] [--error-rate P]
+                                    [--discovery-dir DIR]
+
+Serves the discovery directory at http://HOST:PORT/discovery/v1/apis, which shoogle
+uses when the environment variable SHOOGLE_DISCOVERY_URL points to it. Services:
+
+  * bench:v1 - Small API. All resources have the methods get, list (paginated) and
+    insert (with resumable media uploads in resource "items").
+  * benchlarge:v1 - The same methods in hundreds of resources and thousands of schemas.
+  * Recorded discovery documents (JSON files) in --discovery-dir, served as they are
+    (their API calls are not faked).
+
+API calls wait --latency milliseconds and fail with a 503 (backendError) with
+probability --error-rate. GET responses honor the partial response parameter "fields".
+HTTP batch requests (multipart/mixed) are answered at /batch/NAME/VERSION.
+"""
+import argparse
+import collections
+import email.parser
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from shoogle import lib
+from shoogle import selection
+
+SYNTHETIC_SERVICES = collections.OrderedDict([
+    # name: (resources, schemas)
+    ("bench", (3, 20)),
+    ("benchlarge", (400, 4000)),
+])
+
+def get_schemas(count, fields=8):
+    """Return count schemas that reference each other, with the Item/Items schemas first."""
+    schemas = collections.OrderedDict([
+        ("Item", {"id": "Item", "type": "object", "properties": collections.OrderedDict([
+            ("id", {"type": "string"}),
+            ("kind", {"type": "string"}),
+            ("title", {"type": "string"}),
+            ("size", {"type": "string", "format": "int64"}),
+            ("detail", {"$ref": "Schema0"}),
+        ])}),
+        ("Items", {"id": "Items", "type": "object", "properties": {
+            "items": {"type": "array", "items": {"$ref": "Item"}},
+            "nextPageToken": {"type": "string"},
+        }}),
+    ])
+    for index in range(count):
+        properties = collections.OrderedDict(
+            ("field{}".format(idx), {"type": "string", "description": "Field {}".format(idx)})
+            for idx in range(fields))
+        for ref_index in [index + 1, index * 2 + 1]:
+            if ref_index < count:
+                properties["ref{}".format(ref_index)] = \
+                    {"type": "array", "items": {"$ref": "Schema{}".format(ref_index)}}
+        name = "Schema{}".format(index)
+        schemas[name] = {"id": name, "type": "object", "properties": properties}
+    return schemas
+
+def parse_fields(fields):
+    """Return the selection tree of a partial response parameter (a/b,c(d,e))."""
+    tokens = re.findall(r"[^,/()]+|[,/()]", fields)
+
+    def parse_path(index, tree):
+        node = tree.setdefault(tokens[index].strip(), collections.OrderedDict())
+        index += 1
+        if index < len(tokens) and tokens[index] == "/":
+            return parse_path(index + 1, node)
+        elif index < len(tokens) and tokens[index] == "(":
+            index = parse_list(index + 1, node)
+            return index + 1
+        return index
+
+    def parse_list(index, tree):
+        index = parse_path(index, tree)
+        while index < len(tokens) and tokens[index] == ",":
+            index = parse_path(index + 1, tree)
+        return index
+
+    tree = collections.OrderedDict()
+    parse_list(0, tree)
+    return tree
+
+def get_resource_schemas(schema_name, fields=8):
+    """
+    Return the schemas of a resource that only reference each other (most methods
+    of real APIs use a small part of the schemas of the document).
+    """
+    properties = collections.OrderedDict(
+        ("field{}".format(idx), {"type": "string", "description": "Field {}".format(idx)})
+        for idx in range(fields))
+    properties["id"] = {"type": "string"}
+    return collections.OrderedDict([
+        (schema_name, {"id": schema_name, "type": "object", "properties": properties}),
+        (schema_name + "s", {"id": schema_name + "s", "type": "object", "properties": {
+            "items": {"type": "array", "items": {"$ref": schema_name}},
+            "nextPageToken": {"type": "string"},
+        }}),
+    ])
+
+def get_methods(name, version, resource_name, media_upload, schema_name="Item"):
+    """Return the discovery methods get, list and insert of a resource."""
+    path = "{}".format(resource_name)
+    prefix = "{}.{}".format(name, resource_name)
+    insert = {
+        "id": prefix + ".insert",
+        "httpMethod": "POST",
+        "path": path,
+        "description": "Inserts an item.",
+        "parameters": {},
+        "request": {"$ref": schema_name},
+        "response": {"$ref": schema_name},
+    }
+    if media_upload:
+        insert.update({
+            "supportsMediaUpload": True,
+            "mediaUpload": {"accept": ["*/*"], "protocols": {
+                "resumable": {"multipart": True, "path": "/upload/{}/{}/{}".format(name, version, path)},
+            }},
+        })
+    return {
+        "get": {
+            "id": prefix + ".get",
+            "httpMethod": "GET",
+            "path": path + "/{id}",
+            "description": "Returns an item.",
+            "parameters": {"id": {"type": "string", "required": True, "location": "path",
+                                  "description": "ID of the item."}},
+            "parameterOrder": ["id"],
+            "response": {"$ref": schema_name},
+        },
+        "list": {
+            "id": prefix + ".list",
+            "httpMethod": "GET",
+            "path": path,
+            "description": "Returns a page of items.",
+            "parameters": {
+                "maxResults": {"type": "integer", "location": "query",
+                               "description": "Items per page."},
+                "pageToken": {"type": "string", "location": "query",
+                              "description": "Token of the page."},
+            },
+            "response": {"$ref": schema_name + "s"},
+        },
+        "insert": insert,
+    }
+
+def get_discovery_document(name, version, root_url, resources, schemas):
+    """
+    Return a synthetic discovery document for a service. The methods of resource
+    "items" reference (transitively) all the schemas, the other resources have
+    their own schemas.
+    """
+    resource_names = ["items"] + ["resource{}".format(idx) for idx in range(resources - 1)]
+    schema_names = collections.OrderedDict(
+        (resource_name, ("Item" if resource_name == "items" else resource_name.capitalize()))
+        for resource_name in resource_names)
+    all_schemas = get_schemas(schemas)
+    for resource_name, schema_name in schema_names.items():
+        if resource_name != "items":
+            all_schemas.update(get_resource_schemas(schema_name))
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "{}:{}".format(name, version),
+        "name": name,
+        "version": version,
+        "title": "{} API".format(name.capitalize()),
+        "description": "Synthetic API to benchmark shoogle.",
+        "documentationLink": root_url,
+        "protocol": "rest",
+        "rootUrl": root_url,
+        "servicePath": "{}/{}/".format(name, version),
+        "batchPath": "batch/{}/{}".format(name, version),
+        "parameters": {
+            "fields": {"type": "string", "location": "query",
+                       "description": "Selector specifying which fields to include."},
+        },
+        "schemas": all_schemas,
+        "resources": collections.OrderedDict(
+            (resource_name, {"methods": get_methods(name, version, resource_name,
+                                                    media_upload=(resource_name == "items"),
+                                                    schema_name=schema_name)})
+            for resource_name, schema_name in schema_names.items()),
+    }
+
+class FakeApiServer(http.server.ThreadingHTTPServer):
+    """HTTP server for the fake discovery service and APIs."""
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, discovery_dir=None, items=1000):
+        http.server.ThreadingHTTPServer.__init__(self, address, RequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.items = items
+        self.url = "http://{}:{}/".format(*self.server_address[:2])
+        self.documents = collections.OrderedDict()
+        for name, (resources, schemas) in SYNTHETIC_SERVICES.items():
+            document = get_discovery_document(name, "v1", self.url, resources, schemas)
+            self.documents[document["id"]] = lib.compact_json(document).encode("utf-8")
+        for path in sorted(os.listdir(discovery_dir)) if discovery_dir else []:
+            with open(os.path.join(discovery_dir, path), "rb") as fd:
+                contents = fd.read()
+            document = json.loads(contents.decode("utf-8"))
+            self.documents[document["id"]] = contents
+        self.upload_sessions = {}
+        self.upload_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def discovery_url(self):
+        return self.url + "discovery/v1/apis"
+
+    def get_directory(self):
+        """Return the discovery directory of the served documents."""
+        items = []
+        for service_id, contents in self.documents.items():
+            name, version = service_id.split(":", 1)
+            items.append({
+                "kind": "discovery#directoryItem",
+                "id": service_id,
+                "name": name,
+                "version": version,
+                "title": "{} API".format(name),
+                "description": "Discovery document served by the fake API server.",
+                "discoveryRestUrl": "{}discovery/v1/apis/{}/{}/rest".format(self.url, name, version),
+                "preferred": True,
+            })
+        return {"kind": "discovery#directoryList", "discoveryVersion": "v1", "items": items}
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve discovery documents and fake the calls of the synthetic APIs."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, obj, status=200, headers=None):
+        self.send_bytes(lib.compact_json(obj).encode("utf-8"), status, headers)
+
+    def send_bytes(self, contents, status=200, headers=None, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(contents)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def handle_request(self, http_method):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self.read_body()
+        match = re.match(r"^/discovery/v1/apis(?:/([^/]+)/([^/]+)/rest)?$", url.path)
+        if match:
+            self.handle_discovery(*match.groups())
+            return
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            error = {"code": 503, "message": "Backend Error",
+                     "errors": [{"reason": "backendError", "message": "Backend Error"}]}
+            self.send_json({"error": error}, status=503)
+            return
+        if url.path.startswith("/upload-sessions/"):
+            self.handle_upload_chunk(url.path.rsplit("/", 1)[-1], body)
+        elif url.path.startswith("/upload/"):
+            self.handle_upload_start(query, body)
+        elif url.path.startswith("/batch/"):
+            self.handle_batch(body)
+        else:
+            self.send_json(*self.get_api_response(http_method, url.path, query, body))
+
+    def get_api_response(self, http_method, path, query, body):
+        """Return a pair (response, status) for a call of the API methods get, list or insert."""
+        match = re.match(r"^/([^/]+)/([^/]+)/([^/]+)(?:/([^/]+))?$", path)
+        if not match:
+            return {"error": {"code": 404, "message": "Not Found"}}, 404
+        resource_name, item_id = match.group(3), match.group(4)
+        if http_method == "GET" and item_id:
+            return self.select(self.get_item(resource_name, item_id), query), 200
+        elif http_method == "GET":
+            return self.select(self.get_page(resource_name, query), query), 200
+        else:
+            item = (json.loads(body.decode("utf-8")) if body else {})
+            return lib.merge(self.get_item(resource_name, "new"), item), 200
+
+    def handle_batch(self, body):
+        """Answer a multipart/mixed batch request with a response part for each Content-ID."""
+        header = "Content-Type: {}\r\n\r\n".format(self.headers["Content-Type"]).encode("utf-8")
+        message = email.parser.BytesParser().parsebytes(header + body)
+        boundary = "fakeapi_batch_boundary"
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition("\n")
+            http_method, uri = request_line.split()[:2]
+            content = re.split(r"\r?\n\r?\n", rest, 1)[-1].encode("utf-8")
+            url = urllib.parse.urlparse(uri)
+            response, status = self.get_api_response(
+                http_method, url.path, dict(urllib.parse.parse_qsl(url.query)), content)
+            content_id = "<response-{}>".format(part["Content-ID"].strip("<>"))
+            parts.append("--{}\r\nContent-Type: application/http\r\nContent-ID: {}\r\n\r\n"
+                         "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n\r\n{}\r\n".format(
+                             boundary, content_id, status, http.HTTPStatus(status).phrase,
+                             lib.compact_json(response)))
+        contents = ("".join(parts) + "--{}--\r\n".format(boundary)).encode("utf-8")
+        self.send_bytes(contents, content_type="multipart/mixed; boundary={}".format(boundary))
+
+    def handle_discovery(self, name, version):
+        if name is None:
+            self.send_json(self.server.get_directory())
+        else:
+            service_id = "{}:{}".format(name, version)
+            if service_id in self.server.documents:
+                self.send_bytes(self.server.documents[service_id])
+            else:
+                self.send_json({"error": {"code": 404, "message": "Not Found"}}, status=404)
+
+    def select(self, response, query):
+        return (selection.project(response, parse_fields(query["fields"]))
+                if query.get("fields") else response)
+
+    def get_item(self, resource_name, item_id):
+        return {"kind": "bench#" + resource_name, "id": item_id, "title": "Item " + item_id}
+
+    def get_page(self, resource_name, query):
+        start = int(query.get("pageToken", 0))
+        size = int(query.get("maxResults", 100))
+        end = min(start + size, self.server.items)
+        page = {"items": [self.get_item(resource_name, str(idx)) for idx in range(start, end)]}
+        if end < self.server.items:
+            page["nextPageToken"] = str(end)
+        return page
+
+    def handle_upload_start(self, query, body):
+        if query.get("uploadType") != "resumable":
+            self.send_json({"error": {"code": 400, "message": "Only resumable uploads"}}, status=400)
+            return
+        with self.server.lock:
+            session_id = str(next(self.server.upload_ids))
+            self.server.upload_sessions[session_id] = 0
+        location = "{}upload-sessions/{}".format(self.server.url, session_id)
+        self.send_bytes(b"", headers={"Location": location})
+
+    def handle_upload_chunk(self, session_id, body):
+        """Receive a chunk (Content-Range: bytes START-END/TOTAL, TOTAL may be *)."""
+        if session_id not in self.server.upload_sessions:
+            self.send_json({"error": {"code": 404, "message": "Upload session not found"}}, status=404)
+            return
+        match = re.match(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)", self.headers.get("Content-Range", ""))
+        received = self.server.upload_sessions[session_id]
+        if match and match.group(1) is not None and int(match.group(1)) == received:
+            received = self.server.upload_sessions[session_id] = received + len(body)
+        total = (match.group(3) if match else "*")
+        if total != "*" and received >= int(total):
+            item = lib.merge(self.get_item("items", session_id), {"size": str(received)})
+            self.send_json(item)
+        else:
+            headers = ({"Range": "bytes=0-{}".format(received - 1)} if received else {})
+            self.send_bytes(b"", status=308, headers=headers)
+
+def start_server(host="127.0.0.1", port=0, **kwargs):
+    """Start a FakeApiServer in a background thread and return it."""
+    server = FakeApiServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Fake Google discovery service and APIs")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, metavar="MS",
+                        help="Milliseconds to wait before answering API calls")
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar="P",
+                        help="Probability (0-1) of answering API calls with a 503 error")
+    parser.add_argument('--discovery-dir', metavar="DIR",
+                        help="Directory of recorded discovery documents (JSON files) to serve")
+    options = parser.parse_args(args)
+
+    server = FakeApiServer((options.host, options.port), latency=options.latency / 1000.0,
+                           error_rate=options.error_rate, discovery_dir=options.discovery_dir)
+    print("export SHOOGLE_DISCOVERY_URL={}".format(server.discovery_url))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compare the time to parse discovery documents with jsmin + json (the old
+lib.load_json) against the current lib.load_json.
+
+Usage: python -m benchmarks.load_json [DISCOVERY_JSON_FILE ...]
+
+Without files, a synthetic document similar in size to the big discovery
+documents (compute, youtube) is used.
+"""
+import json
+import os
+import sys
+import timeit
+
+import jsmin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from shoogle import lib
+
+def get_synthetic_document(resources=60, methods=20, schemas=800):
+    """Return a JSON string with the shape of a big discovery document."""
+    parameter = {
+        "type": "string",
+        "description": "Name of the resource (see https://cloud.google.com/docs) // not a comment",
+        "location": "path",
+        "required": True,
+    }
+    method = {
+        "httpMethod": "GET",
+        "description": "Retrieves the specified resource. " * 4,
+        "parameters": dict(("param{}".format(idx), parameter) for idx in range(8)),
+        "response": {"$ref": "Schema0"},
+        "scopes": ["https://www.googleapis.com/auth/cloud-platform"],
+    }
+    schema = {
+        "type": "object",
+        "properties": dict(("field{}".format(idx), {"type": "string", "description": "Field."})
+                           for idx in range(15)),
+    }
+    document = {
+        "resources": dict(
+            ("resource{}".format(idx), {"methods": dict(("method{}".format(midx), method)
+                                                        for midx in range(methods))})
+            for idx in range(resources)),
+        "schemas": dict(("Schema{}".format(idx), schema) for idx in range(schemas)),
+    }
+    return json.dumps(document, indent=1)
+
+def old_load_json(json_string):
+    return json.loads(jsmin.jsmin(json_string))
+
+def benchmark(name, json_string, repeat=3):
+    """Print the best parse time of both implementations for a JSON string."""
+    results = []
+    for load in [old_load_json, lib.load_json]:
+        seconds = min(timeit.repeat(lambda: load(json_string), number=1, repeat=repeat))
+        results.append(seconds)
+    size_mb = len(json_string) / (1024.0 * 1024.0)
+    print("{name} ({size:.1f} MB): jsmin+json={old:.3f}s load_json={new:.3f}s ({ratio:.0f}x)"
+          .format(name=name, size=size_mb, old=results[0], new=results[1],
+                  ratio=results[0] / results[1]))
+
+def main(paths):
+    if paths:
+        for path in paths:
+            with open(path) as fd:
+                benchmark(os.path.basename(path), fd.read())
+    else:
+        benchmark("synthetic", get_synthetic_document())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
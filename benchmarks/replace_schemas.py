@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Compare the time to expand the response schemas of all methods with the old
+(non-memoized) and the current common.replace_schemas, for several levels.
+
+Usage: python -m benchmarks.replace_schemas [--levels 5,10,all] [DISCOVERY_JSON_FILE ...]
+
+Without files, a synthetic document with deeply nested (and self-referential)
+schemas is used. The old implementation is skipped from the first level it takes
+longer than --timeout, and always for unlimited levels ("all"), as it does not
+terminate on recursive schemas.
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from shoogle import common
+from shoogle import lib
+
+def old_replace_schemas(schemas, params, max_level=None, level=0):
+    """common.replace_schemas before memoization and cycle detection."""
+    output = collections.OrderedDict()
+    for key, value in sorted(params.items()):
+        if max_level is not None and level >= max_level:
+            output[key] = value
+        elif key == "$ref":
+            properties = schemas[value].get("properties", schemas[value])
+            output.update(old_replace_schemas(schemas, properties, max_level, level + 1))
+        elif isinstance(value, dict):
+            output[key] = old_replace_schemas(schemas, value, max_level, level + 1)
+        else:
+            output[key] = value
+    return output
+
+def get_synthetic_document(schemas=300, fields=10, references=3):
+    """Return a discovery-like document whose schemas reference each other and themselves."""
+    def get_schema(index):
+        properties = dict(("field{}".format(idx), {"type": "string"}) for idx in range(fields))
+        properties["parent"] = {"$ref": "Schema{}".format(index)}
+        for idx in range(index + 1, min(index + references + 1, schemas)):
+            ref = "Schema{}".format(idx)
+            properties["ref{}".format(idx)] = {"type": "array", "items": {"$ref": ref}}
+        return {"type": "object", "properties": properties}
+    return {
+        "schemas": dict(("Schema{}".format(idx), get_schema(idx)) for idx in range(schemas)),
+        "resources": {"resource": {"methods": dict(
+            ("method{}".format(idx), {"response": {"$ref": "Schema{}".format(idx)}})
+            for idx in range(0, schemas, 10))}},
+    }
+
+def get_responses(resources):
+    """Yield the response of all methods of the resources (recursively)."""
+    for resource in resources.values():
+        for method in resource.get("methods", {}).values():
+            if "response" in method:
+                yield method["response"]
+        for response in get_responses(resource.get("resources", {})):
+            yield response
+
+def time_expansions(replace_schemas, document, level):
+    """Return the seconds to expand all the method responses of a document."""
+    schemas = document.get("schemas", {})
+    start = time.perf_counter()
+    for response in get_responses(document.get("resources", {})):
+        replace_schemas(schemas, response, max_level=level)
+    return time.perf_counter() - start
+
+def benchmark(name, document, levels, timeout):
+    print("{}:".format(name))
+    old_enabled = True
+    for level in levels:
+        new_seconds = time_expansions(common.replace_schemas, document, level)
+        if old_enabled and level is not None:
+            old_seconds = time_expansions(old_replace_schemas, document, level)
+            old_info = "{:.3f}s".format(old_seconds)
+            old_enabled = old_seconds < timeout
+        else:
+            old_info = "skipped"
+        level_info = ("all" if level is None else level)
+        print("  level={}: old={} new={:.3f}s".format(level_info, old_info, new_seconds))
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark common.replace_schemas")
+    parser.add_argument('--levels', default="5,10,15,20,all",
+                        help="Comma-separated levels of expansion ('all' for unlimited)")
+    parser.add_argument('--timeout', type=float, default=10.0,
+                        help="Skip the old implementation after a level takes this long")
+    parser.add_argument('paths', metavar="DISCOVERY_JSON_FILE", nargs="*")
+    options = parser.parse_args(args)
+    levels = [(None if level == "all" else int(level)) for level in options.levels.split(",")]
+
+    if options.paths:
+        for path in options.paths:
+            with open(path) as fd:
+                document = lib.load_json(fd.read())
+            benchmark(os.path.basename(path), document, levels, options.timeout)
+    else:
+        benchmark("synthetic", get_synthetic_document(), levels, options.timeout)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
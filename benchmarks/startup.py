@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Measure the startup time of shoogle: the cumulative import time of the package
+(from python -X importtime) and the wall time of `shoogle -v`.
+
+Usage: python -m benchmarks.startup [--repeat N] [--max-import-ms MS]
+
+With --max-import-ms, exit with status 1 if the import time exceeds the threshold.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+HEAVY_MODULES = ["googleapiclient", "oauth2client", "httplib2", "jsmin"]
+
+def run_python(code, *options):
+    """Run python code in a new interpreter with shoogle in the path and return the process."""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    return subprocess.run([sys.executable] + list(options) + ["-c", code], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+def get_import_time_ms():
+    """Return the cumulative import time of the shoogle package in milliseconds."""
+    process = run_python("import shoogle", "-X", "importtime")
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s*\d+ \|\s*(\d+) \| shoogle$", line)
+        if match:
+            return int(match.group(1)) / 1000.0
+    raise RuntimeError("Cannot find the import time of shoogle:\n" + process.stderr)
+
+def get_version_time_ms():
+    """Return the wall time of running `shoogle -v` in milliseconds."""
+    start = time.perf_counter()
+    run_python("import sys, shoogle; sys.exit(shoogle.main(['-v']))")
+    return (time.perf_counter() - start) * 1000.0
+
+def get_heavy_modules():
+    """Return the heavy modules imported by `shoogle -v`."""
+    code = "import sys, shoogle; shoogle.main(['-v']); print(' '.join(sys.modules))"
+    modules = run_python(code).stdout.split()
+    return sorted(set(module for module in modules if module.split(".")[0] in HEAVY_MODULES))
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Measure the startup time of shoogle")
+    parser.add_argument('--repeat', type=int, default=5, metavar="N",
+                        help="Runs of each measure (the best one is reported)")
+    parser.add_argument('--max-import-ms', type=float, metavar="MS",
+                        help="Fail if the import time of shoogle exceeds this threshold")
+    options = parser.parse_args(args)
+
+    import_ms = min(get_import_time_ms() for _ in range(options.repeat))
+    version_ms = min(get_version_time_ms() for _ in range(options.repeat))
+    heavy_modules = get_heavy_modules()
+    print("import shoogle: {:.1f} ms".format(import_ms))
+    print("shoogle -v: {:.1f} ms (wall time, includes interpreter startup)".format(version_ms))
+    print("heavy modules loaded by shoogle -v: {}".format(", ".join(heavy_modules) or "none"))
+
+    if options.max_import_ms is not None and import_ms > options.max_import_ms:
+        print("FAIL: import time exceeds {} ms".format(options.max_import_ms))
+        return 1
+    elif heavy_modules:
+        print("FAIL: heavy modules are imported eagerly")
+        return 1
+    else:
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite: run shoogle commands against a local fake discovery service
+and API (benchmarks/fakeapi.py) and measure startup, `show` at each level (cold and
+warm cache), single `execute` latency, batch throughput (one call per request and
+HTTP batch requests), pagination and uploads.
+
+Usage: python -m benchmarks.suite [--repeat N] [--latency MS] [--error-rate P]
+                                  [--discovery-dir DIR] [--save PATH]
+                                  [--compare PATH [--max-regression RATIO]]
+
+Results can be saved as JSON (--save) and compared with a previous run (--compare):
+with --max-regression, exit with status 1 if a metric is worse than the old value by
+more than the given ratio (0.2 = 20%). Every command runs in a new interpreter with a
+temporary HOME, so the real ~/.shoogle is never used.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import fakeapi
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MAIN_CODE = "import sys, shoogle; sys.exit(shoogle.main(sys.argv[1:]))"
+
+# Metrics where a higher value is better (the rest are times: lower is better)
+THROUGHPUT_UNITS = {"req/s", "items/s", "MB/s"}
+
+# (service name, level, API path) of the show measures
+SHOW_API_PATHS = [
+    ("bench", "service", "bench:v1"),
+    ("bench", "resource", "bench:v1.items"),
+    ("bench", "method", "bench:v1.items.get"),
+    ("benchlarge", "service", "benchlarge:v1"),
+    ("benchlarge", "resource", "benchlarge:v1.resource0"),
+    ("benchlarge", "method", "benchlarge:v1.resource0.get"),
+    # A method that references all the schemas of the document
+    ("benchlarge", "method_all_schemas", "benchlarge:v1.items.get"),
+]
+
+class Runner(object):
+    """Run shoogle commands in new interpreters against a fake server."""
+
+    def __init__(self, server, home_dir):
+        self.server = server
+        self.home_dir = home_dir
+        self.env = dict(os.environ, HOME=home_dir, PYTHONPATH=ROOT_DIR,
+                        SHOOGLE_DISCOVERY_URL=server.discovery_url)
+
+    def run(self, args, stdin=None):
+        """Run shoogle with args and return the wall time in seconds."""
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", MAIN_CODE] + list(args),
+                                 env=self.env, input=stdin,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            msg = "shoogle {} failed:\n{}".format(" ".join(args), process.stderr.decode())
+            raise RuntimeError(msg)
+        return elapsed
+
+    def clear_cache(self):
+        """Remove the cache (discovery documents and indexes) of the temporary HOME."""
+        shutil.rmtree(os.path.join(self.home_dir, ".shoogle", "cache"), ignore_errors=True)
+
+def median_ms(func, repeat):
+    """Return the median of repeat calls to func (seconds) in milliseconds."""
+    return statistics.median(func() for _ in range(repeat)) * 1000.0
+
+def get_requests(count):
+    """Return the JSON lines of count get requests for --batch."""
+    lines = (json.dumps({"id": str(index)}) for index in range(count))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def measure(runner, options):
+    """Yield (name, value, unit) for each metric of the suite."""
+    repeat = options.repeat
+
+    yield "startup", median_ms(lambda: runner.run(["-v"]), repeat), "ms"
+
+    for name, level, api_path in SHOW_API_PATHS:
+        def show_cold():
+            runner.clear_cache()
+            return runner.run(["show", api_path])
+        name = "show.{}.{}".format(name, level)
+        yield name + ".cold", median_ms(show_cold, repeat), "ms"
+        yield name + ".warm", median_ms(lambda: runner.run(["show", api_path]), repeat), "ms"
+    yield "show.services", median_ms(lambda: runner.run(["show"]), repeat), "ms"
+
+    execute = ["execute", "--no-daemon", "--retries", str(options.retries)]
+    single_request = json.dumps({"id": "1"}).encode("utf-8")
+    yield "execute.single", median_ms(lambda: runner.run(
+        execute + ["bench:v1.items.get", "-"], stdin=single_request), repeat), "ms"
+
+    count = options.batch_requests
+    elapsed = runner.run(execute + ["--batch", "--workers", str(options.workers),
+                                    "bench:v1.items.get", "-"], stdin=get_requests(count))
+    yield "execute.batch", count / elapsed, "req/s"
+
+    elapsed = runner.run(execute + ["--batch", "--workers", str(options.workers),
+                                    "--http-batch-size", str(options.http_batch_size),
+                                    "bench:v1.items.get", "-"], stdin=get_requests(count))
+    yield "execute.http_batch", count / elapsed, "req/s"
+
+    pages_request = json.dumps({"maxResults": 100}).encode("utf-8")
+    elapsed = runner.run(execute + ["--all-pages", "--items", "bench:v1.items.list", "-"],
+                         stdin=pages_request)
+    yield "execute.pages", runner.server.items / elapsed, "items/s"
+
+    elapsed = runner.run(execute + ["--all-pages", "--items", "--select", "items.id",
+                                    "bench:v1.items.list", "-"], stdin=pages_request)
+    yield "execute.pages.select", runner.server.items / elapsed, "items/s"
+
+    media_path = os.path.join(runner.home_dir, "media.bin")
+    with open(media_path, "wb") as fd:
+        fd.write(os.urandom(options.upload_size * 1024 * 1024))
+    upload_request = json.dumps({"body": {"title": "benchmark"}}).encode("utf-8")
+    elapsed = runner.run(execute + ["--chunk-size", "1M", "-f", media_path,
+                                    "bench:v1.items.insert", "-"], stdin=upload_request)
+    yield "execute.upload", options.upload_size / elapsed, "MB/s"
+
+def get_git_version():
+    """Return the git description of the current commit (None if not available)."""
+    try:
+        process = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT_DIR,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 universal_newlines=True, check=True)
+        return process.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_results, results, max_regression):
+    """Print the ratio of the metrics to the old ones and return the regressed metrics."""
+    old_metrics = old_results["metrics"]
+    regressions = []
+    print("\nComparison with {}:".format(old_results.get("git") or "previous run"))
+    if old_results.get("options") != results["options"]:
+        print("  (warning: the runs used different options)")
+    for name, metric in results["metrics"].items():
+        if name not in old_metrics or not old_metrics[name]["value"]:
+            continue
+        value, old_value, unit = metric["value"], old_metrics[name]["value"], metric["unit"]
+        # A ratio > 1 is always worse (slower time or lower throughput)
+        ratio = (old_value / value if unit in THROUGHPUT_UNITS else value / old_value)
+        regressed = max_regression is not None and ratio > 1 + max_regression
+        print("  {:<40} {:>10.2f} -> {:>10.2f} {:<7} x{:.2f}{}".format(
+            name, old_value, value, unit, ratio, " REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Offline benchmark suite of shoogle")
+    parser.add_argument('--repeat', type=int, default=5, metavar="N",
+                        help="Runs of each latency measure (the median is reported)")
+    parser.add_argument('--latency', type=float, default=0.0, metavar="MS",
+                        help="Milliseconds the fake API waits before answering a call")
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar="P",
+                        help="Probability (0-1) of the fake API answering a 503 error")
+    parser.add_argument('--retries', type=int, default=5, metavar="N",
+                        help="Retries of execute (to recover from the injected errors)")
+    parser.add_argument('--discovery-dir', metavar="DIR",
+                        help="Directory of recorded discovery documents to serve too")
+    parser.add_argument('--batch-requests', type=int, default=500, metavar="N",
+                        help="Requests of the batch throughput measure")
+    parser.add_argument('--workers', type=int, default=4, metavar="N",
+                        help="Workers of the batch throughput measure")
+    parser.add_argument('--http-batch-size', type=int, default=50, metavar="N",
+                        help="Requests per HTTP batch request of the HTTP batch throughput measure")
+    parser.add_argument('--upload-size', type=int, default=8, metavar="MB",
+                        help="Size of the uploaded file")
+    parser.add_argument('--save', metavar="PATH", help="Save the results as JSON")
+    parser.add_argument('--compare', metavar="PATH", help="Compare with saved results")
+    parser.add_argument('--max-regression', type=float, metavar="RATIO",
+                        help="Fail if a metric is worse than the compared one by this ratio")
+    options = parser.parse_args(args)
+
+    server = fakeapi.start_server(latency=options.latency / 1000.0,
+                                  error_rate=options.error_rate,
+                                  discovery_dir=options.discovery_dir)
+    home_dir = tempfile.mkdtemp(prefix="shoogle-benchmark-")
+    try:
+        runner = Runner(server, home_dir)
+        metrics = {}
+        for name, value, unit in measure(runner, options):
+            print("{:<40} {:>10.2f} {}".format(name, value, unit))
+            sys.stdout.flush()
+            metrics[name] = {"value": value, "unit": unit}
+    finally:
+        server.shutdown()
+        shutil.rmtree(home_dir, ignore_errors=True)
+
+    results = {
+        "version": 1,
+        "git": get_git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "options": {key: value for key, value in vars(options).items()
+                    if key not in ["save", "compare", "max_regression"]},
+        "metrics": metrics,
+    }
+    if options.save:
+        with open(options.save, "w") as fd:
+            json.dump(results, fd, indent=2)
+    if options.compare:
+        with open(options.compare) as fd:
+            old_results = json.load(fd)
+        regressions = compare(old_results, results, options.max_regression)
+        if regressions:
+            print("FAIL: regressions in {}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
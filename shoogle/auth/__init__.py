@@ -1,2 +1,2 @@
 """Auth to Google API using console, browser or custom user interaction."""
-from .auth import get_credentials
+from .auth import get_credentials, refresh_credentials
@@ -1,7 +1,12 @@
 """Wrapper for Google OAuth2 API."""
+import datetime
+
 import oauth2client.client
 from oauth2client.file import Storage
 
+from .. import lib
+from .. import timings
+from .. import transport
 from . import console
 
 def _get_credentials_interactively(flow, storage, get_code_callback):
@@ -10,19 +15,57 @@ def _get_credentials_interactively(flow, storage, get_code_callback):
     authorize_url = flow.step1_get_authorize_url()
     code = get_code_callback(authorize_url)
     if code:
-        credential = flow.step2_exchange(code, http=None)
+        credential = flow.step2_exchange(code, http=transport.get_http())
         storage.put(credential)
         credential.set_store(storage)
         return credential
 
+def _expires_soon(credentials, margin):
+    """Return True if the access token is missing or expires within margin seconds."""
+    if not credentials.access_token:
+        return True
+    elif credentials.token_expiry is None:
+        return False
+    else:
+        remaining = credentials.token_expiry - datetime.datetime.utcnow()
+        return remaining < datetime.timedelta(seconds=margin)
+
+def refresh_credentials(credentials, credentials_file, margin):
+    """
+    Refresh the access token of the credentials if it expires within margin seconds.
+
+    A lock file makes sure that only one process refreshes the token, the others
+    wait and then use the token stored in the credentials file.
+    """
+    if not _expires_soon(credentials, margin):
+        return credentials
+    with lib.file_lock(credentials_file + ".lock"):
+        stored_credentials = Storage(credentials_file).get()
+        if stored_credentials and not stored_credentials.invalid and \
+                not _expires_soon(stored_credentials, margin):
+            credentials.access_token = stored_credentials.access_token
+            credentials.token_expiry = stored_credentials.token_expiry
+        else:
+            try:
+                with timings.phase("credentials.refresh"):
+                    credentials.refresh(transport.get_http())
+            except oauth2client.client.AccessTokenRefreshError:
+                # Invalid credentials are marked as such, otherwise retry on the API request
+                pass
+    return credentials
+
 def get_credentials(client_secrets_file, credentials_file,
-                    scope, get_code_callback=console.get_code):
-    """Return the user credentials from the file or run the interactive flow."""
+                    scope, get_code_callback=console.get_code, refresh_margin=300):
+    """
+    Return the user credentials from the file or run the interactive flow. Stored
+    credentials are refreshed if they expire within refresh_margin seconds.
+    """
     get_flow = oauth2client.client.flow_from_clientsecrets
     flow = get_flow(client_secrets_file, scope=scope)
     storage = Storage(credentials_file)
     existing_credentials = storage.get()
     if existing_credentials and not existing_credentials.invalid:
-        return existing_credentials
-    else:
-        return _get_credentials_interactively(flow, storage, get_code_callback)
+        credentials = refresh_credentials(existing_credentials, credentials_file, refresh_margin)
+        if not credentials.invalid:
+            return credentials
+    return _get_credentials_interactively(flow, storage, get_code_callback)
@@ -0,0 +1,45 @@
+"""Persistent cache of parsed discovery documents."""
+import collections
+import os
+import pickle
+import time
+import urllib.parse
+
+from . import config
+from . import lib
+from . import timings
+
+Entry = collections.namedtuple("Entry", ["data", "etag", "timestamp"])
+
+def get_path(key):
+    """Return the path of the cache file for a key."""
+    filename = urllib.parse.quote(key, safe="") + ".pickle"
+    return os.path.join(config.discovery_cache_dir, filename)
+
+def load(key):
+    """Return the cached Entry for a key, None if missing or unreadable."""
+    try:
+        with timings.phase("discovery.cache.load"), open(get_path(key), "rb") as fd:
+            return Entry(*pickle.load(fd))
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+
+def save(key, data, etag=None):
+    """Store data (and its ETag) for a key atomically and return the new Entry."""
+    entry = Entry(data=data, etag=etag, timestamp=time.time())
+    try:
+        with timings.phase("discovery.cache.save"):
+            lib.mkdir_p(config.discovery_cache_dir)
+            contents = pickle.dumps(tuple(entry), pickle.HIGHEST_PROTOCOL)
+            lib.write_atomically(get_path(key), contents)
+    except OSError as error:
+        config.logger.warning("Cannot write discovery cache ({}): {}".format(key, error))
+    return entry
+
+def revalidate(key, entry):
+    """Mark a cached entry as fresh (its document was not modified) and return the new Entry."""
+    return save(key, entry.data, entry.etag)
+
+def is_fresh(entry, ttl):
+    """Return True if the entry is younger than ttl seconds."""
+    return time.time() - entry.timestamp < ttl
@@ -1,2 +1,4 @@
 from . import show
 from . import execute 
+from . import daemon
+from . import completion
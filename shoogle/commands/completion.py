@@ -0,0 +1,250 @@
+"""Completion command: print a shell script that completes commands, API paths and parameters."""
+import shlex
+
+from .. import common
+from .. import config
+from .. import index
+from .. import lib
+
+# The scripts read the completion index with awk (no Python involved while completing).
+# Placeholders: @INDEX@, @ARG@, @COMMANDS@, @VALUE_OPTIONS@ and @OPTIONS@ (shell specific).
+
+AWK_PATHS = r"""awk -F '\t' -v cur="@ARG@" '
+        index($2, cur) == 1 && (n == 0 || $1 < level) { level = $1; n = 0 }
+        index($2, cur) == 1 && $1 == level { paths[n++] = $2 ($1 < 2 ? "." : "") }
+        END { for (i = 0; i < n; i++) print paths[i] }' @INDEX@ 2>/dev/null"""
+
+AWK_PARAMETERS = r"""awk -F '\t' -v api_path="@ARG@" '
+        $1 == 2 && $2 == api_path { gsub(/ /, "\n", $3); print $3; exit }' @INDEX@ 2>/dev/null"""
+
+BASH_SCRIPT = r"""# shoogle completion for bash. Usage: eval "$(shoogle completion bash)"
+_shoogle_paths() {
+    """ + AWK_PATHS + r"""
+}
+
+_shoogle_parameters() {
+    """ + AWK_PARAMETERS + r"""
+}
+
+_shoogle() {
+    local line=${COMP_LINE:0:$COMP_POINT} words api_path i
+    read -ra words <<< "$line"
+    [[ -z $line || $line == *[[:space:]] ]] && words+=("")
+    local count=${#words[@]}
+    local cur=${words[count-1]} prev=${words[count-2]} command=${words[1]}
+    COMPREPLY=()
+    if [ "$count" -le 2 ]; then
+        COMPREPLY=($(compgen -W "@COMMANDS@" -- "$cur"))
+        return
+    fi
+    for ((i = 2; i < count - 1; i++)); do
+        case ${words[i]} in
+            @VALUE_OPTIONS@) ((i++)) ;;
+            -*) ;;
+            *) api_path=${words[i]}; break ;;
+        esac
+    done
+    case $prev in
+        @VALUE_OPTIONS@) compopt -o default; return ;;
+    esac
+    local options
+    case $command in
+@OPTIONS@
+        completion) COMPREPLY=($(compgen -W "bash zsh fish" -- "$cur")); return ;;
+        *) return ;;
+    esac
+    if [[ $cur == -* ]]; then
+        COMPREPLY=($(compgen -W "$options" -- "$cur"))
+    elif [ -z "$api_path" ]; then
+        COMPREPLY=($(_shoogle_paths "$cur"))
+        [[ ${COMPREPLY[0]} == *. ]] && compopt -o nospace
+        # Words are split at colons, only the text after the last one is replaced
+        if [[ $cur == *:* && $COMP_WORDBREAKS == *:* ]]; then
+            COMPREPLY=("${COMPREPLY[@]#"${cur%"${cur##*:}"}"}")
+        fi
+    elif [ "$command" = execute ]; then
+        local word=${COMP_WORDS[COMP_CWORD]} IFS=$'\n'
+        local name=${word##*[\"\'\{, ]}
+        COMPREPLY=($(compgen -P "${word%"$name"}" -W "$(_shoogle_parameters "$api_path")" -- "$name"))
+        compopt -o nospace
+    fi
+}
+
+complete -F _shoogle shoogle
+"""
+
+ZSH_SCRIPT = r"""#compdef shoogle
+# shoogle completion for zsh. Usage: eval "$(shoogle completion zsh)"
+_shoogle_paths() {
+    """ + AWK_PATHS + r"""
+}
+
+_shoogle_parameters() {
+    """ + AWK_PARAMETERS + r"""
+}
+
+_shoogle() {
+    local command=${words[2]} api_path i
+    local -a options paths
+    if (( CURRENT == 2 )); then
+        compadd -- @COMMANDS@
+        return
+    fi
+    for ((i = 3; i < CURRENT; i++)); do
+        case ${words[i]} in
+            (@VALUE_OPTIONS@) ((i++)) ;;
+            (-*) ;;
+            (*) api_path=${words[i]}; break ;;
+        esac
+    done
+    case ${words[CURRENT-1]} in
+        (@VALUE_OPTIONS@) _files; return ;;
+    esac
+    case $command in
+@OPTIONS@
+        (completion) compadd -- bash zsh fish; return ;;
+        (*) return ;;
+    esac
+    if [[ $PREFIX == -* ]]; then
+        compadd -- $options
+    elif [[ -z $api_path ]]; then
+        paths=(${(f)"$(_shoogle_paths "$PREFIX")"})
+        compadd -S '' -- ${(M)paths:#*.}
+        compadd -- ${paths:#*.}
+    elif [[ $command == execute ]]; then
+        compset -P "*[\"'{, ]"
+        compadd -S '' -- ${(f)"$(_shoogle_parameters "$api_path")"}
+    fi
+}
+
+compdef _shoogle shoogle
+"""
+
+FISH_SCRIPT = r"""# shoogle completion for fish. Usage: shoogle completion fish | source
+function __shoogle_paths
+    """ + AWK_PATHS + r"""
+end
+
+function __shoogle_parameters
+    """ + AWK_PARAMETERS + r"""
+end
+
+function __shoogle_complete
+    set -l tokens (commandline -opc)
+    set -l cur (commandline -ct)
+    set -l api_path
+    set -l skip 0
+    for token in $tokens[3..-1]
+        if test $skip -eq 1
+            set skip 0
+        else if contains -- $token @VALUE_OPTIONS@
+            set skip 1
+        else if not string match -q -- '-*' $token
+            set api_path $token
+            break
+        end
+    end
+    if test -z "$api_path"
+        __shoogle_paths $cur
+    else if test "$tokens[2]" = execute
+        set -l prefix (string replace -r '[^"\'{, ]*$' '' -- $cur)
+        for name in (__shoogle_parameters $api_path)
+            echo $prefix$name
+        end
+    end
+end
+
+complete -c shoogle -f
+complete -c shoogle -n __fish_use_subcommand -a "@COMMANDS@"
+complete -c shoogle -n '__fish_seen_subcommand_from completion' -a "bash zsh fish"
+complete -c shoogle -n '__fish_seen_subcommand_from show execute' -a '(__shoogle_complete)'
+@OPTIONS@
+"""
+
+def add_parser(subparsers, name):
+    """Add specific completion command parser."""
+    parser = subparsers.add_parser(name)
+    parser.add_argument('shell', choices=["bash", "zsh", "fish"],
+                        help="Shell to print the completion script for")
+
+def get_command_options(parser):
+    """
+    Return a dictionary {command: [(option_strings, takes_value), ...]} of the
+    subcommands of the main parser.
+    """
+    # argparse has no public API to list the actions of a parser
+    subparsers_action = next(action for action in parser._actions if action.choices and
+                             isinstance(action.choices, dict))
+    return dict(
+        (command, [(action.option_strings, action.nargs != 0)
+                   for action in subparser._actions if action.option_strings])
+        for (command, subparser) in subparsers_action.choices.items()
+    )
+
+def get_script(shell, command_options):
+    """Return the completion script for a shell."""
+    completed_commands = ["show", "execute"]
+    value_options = sorted(set(
+        option_string
+        for command in completed_commands
+        for (option_strings, takes_value) in command_options[command] if takes_value
+        for option_string in option_strings
+    ))
+
+    if shell == "bash":
+        script, arg = BASH_SCRIPT, "$1"
+        options = "\n".join('        {}) options="{}" ;;'.format(command, " ".join(
+            option_string for (option_strings, _) in command_options[command]
+            for option_string in option_strings)) for command in completed_commands)
+        value_options = "|".join(value_options)
+    elif shell == "zsh":
+        script, arg = ZSH_SCRIPT, "$1"
+        options = "\n".join('        ({}) options=({}) ;;'.format(command, " ".join(
+            option_string for (option_strings, _) in command_options[command]
+            for option_string in option_strings)) for command in completed_commands)
+        value_options = "|".join(value_options)
+    else:
+        script, arg = FISH_SCRIPT, "$argv[1]"
+        options = "\n".join(get_fish_option(command, option_strings, takes_value)
+                            for command in completed_commands
+                            for (option_strings, takes_value) in command_options[command])
+        value_options = " ".join(value_options)
+
+    return (script
+            .replace("@INDEX@", quote(shell, config.completion_index_path))
+            .replace("@ARG@", arg)
+            .replace("@COMMANDS@", " ".join(sorted(command_options)))
+            .replace("@VALUE_OPTIONS@", value_options)
+            .replace("@OPTIONS@", options))
+
+def quote(shell, value):
+    """Return a string quoted as a single word of a shell."""
+    if shell == "fish":
+        # fish has no POSIX quoting, but backslash escapes within single quotes
+        return "'{}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+    else:
+        return shlex.quote(value)
+
+def get_fish_option(command, option_strings, takes_value):
+    """Return the fish complete line for an option of a command."""
+    args = ["complete -c shoogle -n '__fish_seen_subcommand_from {}'".format(command)]
+    for option_string in option_strings:
+        if option_string.startswith("--"):
+            args.append("-l " + option_string[2:])
+        else:
+            args.append("-s " + option_string[1:])
+    if takes_value:
+        args.append("-r -F")
+    return " ".join(args)
+
+def run(options):
+    """Run command completion."""
+    from .. import shoogle
+    # Generating the script must not wait for the network, update only from the cache
+    config.discovery_cache_mode = "offline"
+    try:
+        index.update()
+    except common.ShoogleException as error:
+        config.logger.warning("Cannot update the completion index: {}".format(error))
+    parser = shoogle.get_parser("")
+    lib.output(get_script(options.shell, get_command_options(parser)).rstrip("\n"))
@@ -0,0 +1,211 @@
+"""Daemon command: keep services and credentials in memory and serve execute requests."""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import time
+
+from .. import common
+from .. import config
+from .. import lib
+from .. import ratelimit
+from .. import selection
+
+# Settings of the client (discovery and HTTP options) that the daemon must share to
+# process its requests, otherwise the client sends them itself
+CLIENT_SETTINGS = ["discovery_cache_mode", "discovery_ttl", "http_timeout", "http_proxy",
+                   "retry_all_methods"]
+
+class Unavailable(Exception):
+    """The daemon is not running or cannot process the request."""
+    pass
+
+class DiscoveryTypeError(TypeError):
+    """TypeError raised by googleapiclient.discovery in the daemon (i.e. a wrong parameter)."""
+    pass
+
+def add_parser(subparsers, name):
+    """Add specific daemon command parser."""
+    parser = subparsers.add_parser(name)
+    common.add_discovery_arguments(parser)
+    common.add_http_arguments(parser)
+
+def run(options):
+    """Run command daemon."""
+    common.configure_discovery(options)
+    common.configure_http(options)
+    if not hasattr(socket, "AF_UNIX"):
+        raise common.ShoogleException("Daemon mode requires Unix sockets")
+    path = config.daemon_socket_path
+    if os.path.exists(path):
+        if is_running(path):
+            raise common.ShoogleException("Daemon already running: {}".format(path))
+        os.remove(path)
+    lib.mkdir_p(os.path.dirname(path))
+    server = DaemonServer(path, RequestHandler)
+    os.chmod(path, 0o600)
+    config.logger.info("Listening on {}".format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def is_running(path):
+    """Return True if a daemon is listening on the socket path."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+def forward_request(api_path, method_options, options):
+    """
+    Send a request to the daemon and return the API response. Raise Unavailable if
+    the daemon is not running or the request must be processed by the client.
+    """
+    path = config.daemon_socket_path
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        raise Unavailable("not running")
+    payload = {
+        "api_path": api_path,
+        "request": method_options,
+        "options": {
+            "client_secret_file": get_absolute_path(options.client_secret_file),
+            "credentials_file": get_absolute_path(options.credentials_file),
+            "credentials_profile": options.credentials_profile,
+            "minimal_scopes": options.minimal_scopes,
+            "retries": options.retries,
+            "validate": options.validate,
+            "select": options.select,
+        },
+        "settings": dict((name, getattr(config, name)) for name in CLIENT_SETTINGS),
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            with sock.makefile("rw", encoding="utf-8") as sock_fd:
+                sock_fd.write(lib.compact_json(payload) + "\n")
+                sock_fd.flush()
+                reply = json.loads(sock_fd.readline())
+    except (OSError, ValueError) as error:
+        raise Unavailable(str(error))
+
+    error = reply.get("error")
+    if not error:
+        return reply["response"]
+    elif error["type"] == "fallback":
+        raise Unavailable(error["message"])
+    elif error["type"] == "http":
+        raise common.ServerError(error["status"], error["content"].encode("utf-8"))
+    elif error["type"] == "discovery":
+        raise DiscoveryTypeError(error["message"])
+    else:
+        raise common.ShoogleException(error["message"])
+
+def get_absolute_path(path):
+    """Return the absolute path of a path (None if path is None)."""
+    return (os.path.abspath(path) if path else None)
+
+def get_code_unavailable(authorize_url):
+    """Callback for the OAuth2 flow: the daemon cannot ask the user."""
+    raise Unavailable("credentials require user authorization")
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Unix socket server that keeps discovery documents and service objects in memory.
+
+    Requests are processed one at a time, so each service object (and its
+    httplib2.Http, which is not thread-safe) is used by a single thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        socketserver.UnixStreamServer.__init__(self, *args, **kwargs)
+        self.services = {}
+        self.service_objs = {}
+
+    def get_service(self, service_id):
+        """Return the discovery document of a service, reloaded after the discovery TTL."""
+        timestamp, service = self.services.get(service_id, (None, None))
+        if not service or time.time() - timestamp >= config.discovery_ttl:
+            service = common.get_service(service_id)
+            self.services[service_id] = (time.time(), service)
+            # Service objects built from the previous document are discarded
+            self.service_objs = dict((key, value) for (key, value) in self.service_objs.items()
+                                     if key[0] != service_id)
+        return service
+
+    def get_service_obj(self, service_id, service, scopes, options):
+        """
+        Return an authorized service object, reused for the same service and credentials.
+        The access token is refreshed before it expires.
+        """
+        from . import execute
+        from .. import auth
+        key = (service_id, tuple(sorted(scopes)), options.client_secret_file,
+               options.credentials_file, options.credentials_profile, options.minimal_scopes)
+        if key not in self.service_objs:
+            credentials = execute.get_credentials(scopes, options, get_code_unavailable)
+            credentials_path = \
+                (execute.get_credentials_path(scopes, options) if credentials else None)
+            service_obj = execute.build_service(service, credentials)
+            self.service_objs[key] = (credentials, credentials_path, service_obj)
+        credentials, credentials_path, service_obj = self.service_objs[key]
+        if credentials:
+            auth.refresh_credentials(credentials, credentials_path, config.token_refresh_margin)
+        return service_obj
+
+    def process(self, payload):
+        """Send the request of a client and return the API response."""
+        from . import execute
+        different_settings = [name for (name, value) in sorted(payload.get("settings", {}).items())
+                              if getattr(config, name) != value]
+        if different_settings:
+            raise Unavailable("settings differ: {}".format(", ".join(different_settings)))
+        api_path = payload["api_path"]
+        service_id, resource_name, method_name = lib.pad_list(api_path.split(".", 2), 3)
+        method_options = payload["request"]
+        options = argparse.Namespace(media_file=None, browser_auth=False,
+                                     **dict({"validate": True, "select": None}, **payload["options"]))
+        service = self.get_service(service_id)
+        method = common.get_method(service, resource_name, method_name)
+        execute.check_method_options(service, method, method_options, options)
+        tree = execute.get_selection(service, method, options)
+        scopes = method.get("scopes", [])
+        service_obj = self.get_service_obj(service_id, service, scopes, options)
+        method_func = execute.get_method_func(service_obj, resource_name, method_name)
+        limiter = ratelimit.get_limiter(service_id, method["id"])
+        response = execute.call_method(method_func, execute.add_fields(method_options, tree),
+                                       options, limiter)
+        return selection.project(response, tree)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Process a JSON line request of a client and write a JSON line reply."""
+
+    def handle(self):
+        from . import execute
+        try:
+            payload = json.loads(self.rfile.readline().decode("utf-8"))
+            reply = {"response": self.server.process(payload)}
+        except Unavailable as error:
+            reply = {"error": {"type": "fallback", "message": str(error)}}
+        except common.ShoogleException as error:
+            reply = {"error": {"type": "shoogle", "message": str(error)}}
+        except TypeError as error:
+            if execute.is_discovery_error():
+                reply = {"error": {"type": "discovery", "message": str(error)}}
+            else:
+                config.logger.exception("Unexpected error")
+                reply = {"error": {"type": "shoogle", "message": "Daemon error: {}".format(error)}}
+        except Exception as error:
+            if lib.is_instance(error, "googleapiclient.errors.HttpError"):
+                content = bytes.decode(error.content)
+                reply = {"error": {"type": "http", "status": error.resp["status"],
+                                   "content": content}}
+            else:
+                config.logger.exception("Unexpected error")
+                reply = {"error": {"type": "shoogle", "message": "Daemon error: {}".format(error)}}
+        self.wfile.write((lib.compact_json(reply) + "\n").encode("utf-8"))
@@ -1,16 +1,21 @@
 """Execute command: send request to service."""
+import concurrent.futures
+import contextlib
 import inspect
 import os
 import sys
+import threading
 
-import apiclient
-import googleapiclient
-import httplib2
-
-from .. import auth
 from .. import common
 from .. import config
 from .. import lib
+from .. import ratelimit
+from .. import retry
+from .. import selection
+from .. import timings
+from .. import transport
+from .. import validate
+from . import daemon
 
 def add_parser(main_parser, name):
     """Add specific execute command parser."""
@@ -19,13 +24,58 @@ def add_parser(main_parser, name):
     parser.add_argument('-c', '--client-secret-file', metavar="PATH",
                         help="Use a client secret JSON file")
     parser.add_argument('-f', '--media-file', metavar="PATH",
-                        help='File to use for media-related methods')
+                        help="File to use for media-related methods (use '-' to read from STDIN)")
+    parser.add_argument('-d', '--download', metavar="PATH",
+                        help="Download the media of the method to a file (use '-' for STDOUT)")
+    parser.add_argument('--resume', action="store_true",
+                        help="Complete a partially downloaded file (with --download)")
+    parser.add_argument('--chunk-size', type=lib.parse_size, metavar="SIZE",
+                        default=config.upload_chunk_size,
+                        help="Size of the media chunks (i.e. 8M), a multiple of 256K for uploads")
+    parser.add_argument('--retries', type=int, default=config.retries, metavar="N",
+                        help="Times to retry requests on rate limits, 5XX and connection errors. "
+                             "Requests of non-idempotent methods (i.e. POST) are retried only on "
+                             "rate limits and refused connections")
+    parser.add_argument('--retry-all-methods', action="store_true",
+                        help="Retry requests of non-idempotent methods on all transient errors "
+                             "(they may be processed more than once)")
+    parser.add_argument('--progress', action="store_true",
+                        help="Show progress of media transfers on STDERR")
     parser.add_argument('--browser-auth', action="store_true",
                         help="Use a browser to authentify")
     parser.add_argument('--credentials-file',
                         metavar="PATH", help="Select credentials file to use")
     parser.add_argument('--credentials-profile', default="default",
                         metavar="NAME", help="Select credentials profile to use")
+    parser.add_argument('--minimal-scopes', action="store_true",
+                        help="Use the matching credentials with fewer scopes")
+    parser.add_argument('-b', '--batch', action="store_true",
+                        help="Read one JSON request per line and output one JSON response per line")
+    parser.add_argument('-w', '--workers', type=int, default=1, metavar="N",
+                        help="Number of requests to send concurrently (with --batch)")
+    parser.add_argument('--max-rate', type=float, metavar="QPS",
+                        help="Maximum number of requests per second (with --batch)")
+    parser.add_argument('--http-batch-size', type=int, metavar="N",
+                        help="Send requests in HTTP batches of up to N calls (with --batch, "
+                             "at most {}; most APIs accept up to 100)".format(config.http_batch_max_size))
+    parser.add_argument('--all-pages', action="store_true",
+                        help="Follow nextPageToken and output every page as a JSON line")
+    parser.add_argument('--items', action="store_true",
+                        help="Output the items of the pages instead of the pages (with --all-pages)")
+    parser.add_argument('--prefetch', action="store_true",
+                        help="Request the next page while the current one is written (with --all-pages)")
+    parser.add_argument('-s', '--select', metavar="FIELDS",
+                        help="Request and output only these fields of the response (comma-separated "
+                             "paths, i.e. items.id,items.snippet.title,nextPageToken)")
+    parser.add_argument('-o', '--output', choices=["pretty", "compact", "ndjson"],
+                        help="Output format: indented JSON (default for single requests), single-line "
+                             "JSON (default for batches and pages) or a JSON line per item of lists")
+    parser.add_argument('--no-validate', dest="validate", action="store_false",
+                        help="Do not check the request against the discovery document before sending it")
+    parser.add_argument('--no-daemon', dest="use_daemon", action="store_false",
+                        help="Do not send the request through a running shoogle daemon")
+    common.add_discovery_arguments(parser)
+    common.add_http_arguments(parser)
     parser.add_argument('api_path', metavar="API_PATH",
                         help="SERVICE:VERSION.RESOURCE.METHOD")
     parser.add_argument('json_request', metavar="JSON_FILE",
@@ -33,93 +83,428 @@ def add_parser(main_parser, name):
 
 def run(options):
     """Run command execute."""
+    common.configure_discovery(options)
+    common.configure_http(options)
     service_id, resource_name, method_name = lib.pad_list(options.api_path.split(".", 2), 3)
+    check_media_options(options)
+    config.retries = options.retries
+    config.retry_all_methods = options.retry_all_methods
     request_fd = (sys.stdin if options.json_request == "-" else open(options.json_request))
+    if options.batch:
+        if options.all_pages or options.download:
+            msg = "Options --all-pages and --download cannot be used with --batch"
+            raise common.ShoogleException(msg)
+        if options.output in ("pretty", "ndjson"):
+            # Batches output exactly one JSON line per request
+            msg = "Option --output {} cannot be used with --batch".format(options.output)
+            raise common.ShoogleException(msg)
+        run_batch(service_id, resource_name, method_name, request_fd, options)
+        return
+    elif options.workers != 1 or options.max_rate is not None:
+        raise common.ShoogleException("Options --workers and --max-rate require --batch")
+    elif options.http_batch_size is not None:
+        raise common.ShoogleException("Option --http-batch-size requires --batch")
     method_options = lib.load_json(request_fd.read())
     try:
-        response = do_request(service_id, resource_name, method_name, method_options, options)
-        lib.output(lib.pretty_json(response))
+        if options.all_pages:
+            run_pages(service_id, resource_name, method_name, method_options, options)
+        elif options.download:
+            run_download(service_id, resource_name, method_name, method_options, options)
+        else:
+            response = send_request(service_id, resource_name, method_name, method_options, options)
+            write_response(response, options.output or "pretty")
     except TypeError as error:
-        frm = inspect.trace()[-1]
-        mod = inspect.getmodule(frm[0])
-        if mod.__name__ == 'googleapiclient.discovery':
+        if isinstance(error, daemon.DiscoveryTypeError) or is_discovery_error():
             config.logger.error("googleapiclient.discovery: {}".format(error))
         else:
             raise
 
-def execute_media_request(request):
-    """Process a request containing a MediaFileUpload."""
-    while 1:
-        status, response = request.next_chunk()
-        if status:
-            config.logger.debug("MediaFileUpload status: {}".format(status))
-        if response:
-            return response
-
-def build_service(service_id, credentials):
-    """Return service object from ID and credentials."""
-    base_http = httplib2.Http()
-    http = (credentials.authorize(base_http) if credentials else base_http)
-    service_name, version = service_id.split(":", 1)
-    return googleapiclient.discovery.build(service_name, version, http=http)
-
-def get_credentials(scopes, options):
-    """Return path of the reusable credentials JSON file for given scopes."""
-    if scopes and options.client_secret_file:
-        if options.credentials_file:
-            if os.path.exists(options.credentials_file):
-                credentials_path = options.credentials_file
+def run_pages(service_id, resource_name, method_name, method_options, options):
+    """Send requests following the pagination of a list method and output a JSON line per page."""
+    if options.media_file:
+        raise common.ShoogleException("Option --media-file cannot be used with --all-pages")
+    service = common.get_method_service(service_id, resource_name, method_name)
+    method = common.get_method(service, resource_name, method_name)
+    check_method_options(service, method, method_options, options)
+    schema = common.get_response_schema(service, method)
+    if "nextPageToken" not in schema.get("properties", {}) or \
+            "pageToken" not in method.get("parameters", {}):
+        raise common.ShoogleException("Method has no pagination: {}".format(method["id"]))
+    items_field = common.get_items_property(schema)
+    if options.items and not items_field:
+        raise common.ShoogleException("Cannot find the items of the response: {}".format(method["id"]))
+    tree = get_selection(service, method, options)
+    if options.items and tree is not None and items_field not in tree:
+        raise common.ShoogleException("Option --select must include {} with --items".format(items_field))
+    # The pages are followed with their nextPageToken, even if it's not selected
+    method_options = add_fields(method_options, tree, ["nextPageToken"])
+
+    credentials = get_credentials(method.get("scopes", []), options)
+    service_obj = build_service(service, credentials)
+    method_func = get_method_func(service_obj, resource_name, method_name)
+    limiter = ratelimit.get_limiter(service_id, method["id"])
+    pages = get_pages(method_func, method_options, options.prefetch, options.retries, limiter)
+    output = ("ndjson" if options.items else (options.output or "compact"))
+    for page in pages:
+        write_response(selection.project(page, tree), output, items_field)
+
+def run_download(service_id, resource_name, method_name, method_options, options):
+    """Send a request for the media of a method and write it to the download path."""
+    from .. import media
+    if options.media_file:
+        raise common.ShoogleException("Option --media-file cannot be used with --download")
+    elif options.select:
+        raise common.ShoogleException("Option --select cannot be used with --download")
+    service = common.get_method_service(service_id, resource_name, method_name)
+    method = common.get_method(service, resource_name, method_name)
+    check_method_options(service, method, method_options, options)
+    if not method.get("supportsMediaDownload"):
+        raise common.ShoogleException("Method has no media download: {}".format(method["id"]))
+    credentials = get_credentials(method.get("scopes", []), options)
+    service_obj = build_service(service, credentials)
+    method_func = get_method_func(service_obj, resource_name, method_name + "_media")
+    config.logger.debug("Request: " + lib.pretty_json(method_options))
+    request = method_func(**method_options)
+    limiter = ratelimit.get_limiter(service_id, method["id"])
+    if limiter:
+        limiter.wait()
+    with timings.phase("api.download"):
+        media.execute_download(request, options.download, options.chunk_size,
+                               options.resume, options.retries, options.progress)
+
+def get_items_field(response):
+    """Return the name of the list of items of a response (None if not found)."""
+    if isinstance(response.get("items"), list):
+        return "items"
+    else:
+        fields = [key for (key, value) in response.items() if isinstance(value, list)]
+        return (fields[0] if len(fields) == 1 else None)
+
+def write_response(response, output, items_field=None):
+    """
+    Write a response to STDOUT in an output format: "pretty", "compact" or "ndjson"
+    (a line per item of the list items_field, or a single line if it has none).
+    """
+    if output == "ndjson" and isinstance(response, dict):
+        items_field = (items_field or get_items_field(response))
+        with timings.phase("output"):
+            for item in (response.get(items_field, []) if items_field else [response]):
+                lib.write_json(item)
+    else:
+        with timings.phase("output"):
+            lib.write_json(response, pretty=(output == "pretty"))
+
+def get_pages(method_func, method_options, prefetch=False, retries=0, limiter=None):
+    """
+    Yield the response pages of a list method, following nextPageToken. With
+    prefetch, the next page is requested while the current one is processed.
+    """
+    def get_page(page_token):
+        page_options = lib.merge(method_options, {"pageToken": page_token} if page_token else {})
+        config.logger.debug("Request: " + lib.pretty_json(page_options))
+        return execute_request(method_func(**page_options), retries, limiter, "page request")
+
+    page = get_page(method_options.get("pageToken"))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        while page is not None:
+            page_token = page.get("nextPageToken")
+            next_page = (executor.submit(get_page, page_token) if page_token and prefetch else None)
+            yield page
+            if next_page:
+                page = next_page.result()
             else:
-                msg = "Credentials file not found: {}".format(options.credentials_file)
-                raise common.ShoogleException(msg)
+                page = (get_page(page_token) if page_token else None)
+
+def run_batch(service_id, resource_name, method_name, request_fd, options):
+    """Send a request for each JSON line in request_fd and output a JSON line per response."""
+    if options.media_file:
+        raise common.ShoogleException("Option --media-file cannot be used with --batch")
+    elif options.workers < 1:
+        raise common.ShoogleException("Option --workers must be a positive number")
+    elif options.max_rate is not None and options.max_rate <= 0:
+        raise common.ShoogleException("Option --max-rate must be a positive number")
+    elif options.http_batch_size is not None and \
+            not 1 <= options.http_batch_size <= config.http_batch_max_size:
+        msg = "Option --http-batch-size must be between 1 and {}".format(config.http_batch_max_size)
+        raise common.ShoogleException(msg)
+    service = common.get_method_service(service_id, resource_name, method_name)
+    method = common.get_method(service, resource_name, method_name)
+    get_thread_service = get_thread_service_getter(service, method, options)
+    limiter = ratelimit.get_limiter(service_id, method["id"], options.max_rate)
+    tree = get_selection(service, method, options)
+
+    def get_request(line):
+        method_options = lib.load_json(line)
+        check_method_options(service, method, method_options, options)
+        method_options = add_fields(method_options, tree)
+        method_func = get_method_func(get_thread_service(), resource_name, method_name)
+        config.logger.debug("Request: " + lib.pretty_json(method_options))
+        return method_func(**method_options)
+
+    def get_response(line):
+        with batch_errors_as_responses() as result:
+            request = get_request(line)
+            result.append(selection.project(execute_request(request, options.retries, limiter), tree))
+        return result[-1]
+
+    def get_http_batch_responses(lines):
+        responses = [None] * len(lines)
+
+        def callback(request_id, response, exception):
+            responses[int(request_id)] = \
+                (get_error_response(exception) if exception else selection.project(response, tree))
+        batch = get_thread_service().new_batch_http_request(callback=callback)
+        batch_size = 0
+        for index, line in enumerate(lines):
+            with batch_errors_as_responses() as result:
+                batch.add(get_request(line), request_id=str(index))
+                batch_size += 1
+            if result:
+                responses[index] = result[-1]
+        if batch_size > 0:
+            # The calls of a batch count as separate requests for the rate limits
+            batch_limiter = (ratelimit.RateLimiters([limiter] * batch_size) if limiter else None)
+            with batch_errors_as_responses() as result:
+                execute_request(batch, options.retries, batch_limiter, "HTTP batch request",
+                                retry.is_idempotent(method["httpMethod"]))
+            if result:
+                responses = [(result[-1] if response is None else response) for response in responses]
+        return responses
+
+    lines = (line for line in request_fd if line.strip())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as executor:
+        if options.http_batch_size:
+            groups = lib.grouper(lines, options.http_batch_size)
+            for responses in lib.ordered_map(executor, get_http_batch_responses, groups,
+                                             2 * options.workers):
+                for response in responses:
+                    lib.write_json(response)
         else:
-            credentials_path = common.get_credentials_path(scopes, options.credentials_profile)
-        if options.browser_auth:
+            for response in lib.ordered_map(executor, get_response, lines, 2 * options.workers):
+                lib.write_json(response)
+
+@contextlib.contextmanager
+def batch_errors_as_responses():
+    """
+    Context manager that yields a list. If a request error is raised within the
+    block, it's captured and its error response appended to the list.
+    """
+    result = []
+    try:
+        yield result
+    except TypeError as error:
+        if is_discovery_error():
+            result.append(get_error_response(error))
+        else:
+            raise
+    except (common.ShoogleException, ValueError) as error:
+        result.append(get_error_response(error))
+    except Exception as error:
+        if lib.is_instance(error, "googleapiclient.errors.HttpError") or \
+                transport.is_transport_error(error):
+            result.append(get_error_response(error))
+        else:
+            raise
+
+def get_thread_service_getter(service, method, options):
+    """
+    Return a function that returns the service object for the current thread.
+
+    Credentials are requested once, on the first call, but every thread builds
+    its own service object, as the underlying httplib2.Http is not thread-safe.
+    """
+    local = threading.local()
+    lock = threading.Lock()
+    credentials_holder = []
+
+    def get_thread_service():
+        if not hasattr(local, "service_obj"):
+            with lock:
+                if not credentials_holder:
+                    scopes = method.get("scopes", [])
+                    credentials_holder.append(get_credentials(scopes, options))
+            local.service_obj = build_service(service, credentials_holder[0])
+        return local.service_obj
+    return get_thread_service
+
+def is_discovery_error():
+    """Return True if the exception being handled was raised by googleapiclient.discovery."""
+    frm = inspect.trace()[-1]
+    mod = inspect.getmodule(frm[0])
+    return mod.__name__ == 'googleapiclient.discovery'
+
+def get_error_response(error):
+    """Return the JSON object to output on batch mode for a failed request."""
+    if lib.is_instance(error, "googleapiclient.errors.HttpError"):
+        content = bytes.decode(error.content).strip()
+        try:
+            return lib.load_json(content)
+        except ValueError:
+            return {"error": {"code": int(error.resp["status"]), "message": content}}
+    elif transport.is_transport_error(error):
+        return {"error": {"message": "{}: {}".format(type(error).__name__, error)}}
+    else:
+        return {"error": {"message": str(error)}}
+
+def execute_media_request(request, method_options, options):
+    """Process a request containing a media upload."""
+    from .. import media
+    if options.media_file == "-":
+        session_path = None
+    else:
+        session_path = media.get_session_path(options.api_path, method_options, options.media_file)
+    with timings.phase("api.upload"):
+        return media.execute_upload(request, session_path, options.retries, options.progress)
+
+def build_service(service, credentials):
+    """Return service object from its discovery document and credentials."""
+    with timings.phase("import.googleapiclient"):
+        import googleapiclient.discovery
+    with timings.phase("build_service"):
+        base_http = transport.get_http()
+        http = (credentials.authorize(base_http) if credentials else base_http)
+        return googleapiclient.discovery.build_from_document(service, http=http)
+
+def get_credentials_path(scopes, options):
+    """Return path of the reusable credentials JSON file for given scopes."""
+    if options.credentials_file:
+        if os.path.exists(options.credentials_file):
+            return options.credentials_file
+        else:
+            msg = "Credentials file not found: {}".format(options.credentials_file)
+            raise common.ShoogleException(msg)
+    else:
+        return common.get_credentials_path(
+            scopes, options.credentials_profile, options.minimal_scopes)
+
+def get_credentials(scopes, options, get_code=None):
+    """Return the credentials for given scopes (None if no client secret is used)."""
+    with timings.phase("import.oauth2client"):
+        from .. import auth
+    if scopes and options.client_secret_file:
+        with timings.phase("credentials.lookup"):
+            credentials_path = get_credentials_path(scopes, options)
+        if get_code is None and options.browser_auth:
             from shoogle.auth import browser
             get_code = auth.browser.get_code
-        else:
+        elif get_code is None:
             from shoogle.auth import console
             get_code = auth.console.get_code
         client_secret = options.client_secret_file
-        return auth.get_credentials(client_secret, credentials_path, scopes, get_code)
+        is_new = not os.path.exists(credentials_path)
+        with timings.phase("credentials"):
+            credentials = auth.get_credentials(client_secret, credentials_path, scopes,
+                                               get_code, config.token_refresh_margin)
+        if credentials and is_new and not options.credentials_file:
+            common.add_to_credentials_index(credentials_path, credentials.scopes or scopes)
+        return credentials
     else:
         return None
 
-def get_method_options_with_media(method_options, media_file):
+def get_method_options_with_media(method_options, media_file, chunk_size):
     """Return options to send the method caller from base options and media file."""
-    media_body = apiclient.http.MediaFileUpload(
-        media_file,
-        chunksize=-1,
-        resumable=True,
-        mimetype="application/octet-stream",
-    )
-    media_file_field = "MediaFileUpload({})".format(media_file)
+    from .. import media
+    media_body = media.get_media_upload(media_file, chunk_size)
+    media_file_field = "{}({})".format(type(media_body).__name__, media_file)
     printable_request = lib.merge(method_options, {"media_body": media_file_field})
     config.logger.debug("Request: " + lib.pretty_json(printable_request))
     return lib.merge(method_options, {"media_body": media_body})
 
-def do_request(service_id, resource_name, method_name, method_options, options):
-    """Send request to API and return JSON response."""
-    service = common.get_service(service_id)
-    method = common.get_method(service, resource_name, method_name)
+def check_media_options(options):
+    """Raise ShoogleException if the media options are not valid."""
+    if options.media_file == "-" and options.json_request == "-":
+        raise common.ShoogleException("Request and media file cannot both be read from STDIN")
+    elif options.resume and options.download in (None, "-"):
+        raise common.ShoogleException("Option --resume requires a download file")
+    elif options.chunk_size <= 0:
+        raise common.ShoogleException("Option --chunk-size must be a positive size")
+    elif options.media_file and options.chunk_size % config.upload_chunk_size_unit != 0:
+        msg = "Upload chunk size must be a multiple of {} bytes".format(config.upload_chunk_size_unit)
+        raise common.ShoogleException(msg)
 
+def check_method_options(service, method, method_options, options):
+    """Raise ShoogleException if the request is not valid for the method."""
     if method.get("request") and "body" not in method_options:
         raise common.ShoogleException("This method need a body property in the request")
     elif method.get("supportsMediaUpload") and not options.media_file:
         raise common.ShoogleException("This method requires a media file (--media-file=PATH)")
-    else:
-        scopes = method.get("scopes", [])
-        credentials = get_credentials(scopes, options)
-        service_obj = build_service(service_id, credentials)
-        resource_func = getattr(service_obj, resource_name)
-        method_func = getattr(resource_func(), method_name)
-
-        if options.media_file:
-            method_options_with_media = \
-                get_method_options_with_media(method_options, options.media_file)
-            request = method_func(**method_options_with_media)
-            return execute_media_request(request)
-        else:
-            config.logger.debug("Request: " + lib.pretty_json(method_options))
-            request = method_func(**method_options)
+    elif options.validate:
+        with timings.phase("validate"):
+            validate.validate_request(service, method, method_options)
+
+def get_selection(service, method, options):
+    """Return the tree of option --select, checked against the method response (None if not used)."""
+    if not options.select:
+        return None
+    tree = selection.parse(options.select)
+    selection.check(service, method, tree)
+    return tree
+
+def add_fields(method_options, tree, required_fields=()):
+    """Return the method options with the partial response parameter (fields) of a selection tree."""
+    if tree is None:
+        return method_options
+    elif "fields" in method_options:
+        raise common.ShoogleException("Option --select cannot be used with a fields parameter")
+    fields_tree = selection.merge(tree, selection.parse(",".join(required_fields))) \
+        if required_fields else tree
+    return dict(method_options, fields=selection.get_fields(fields_tree))
+
+def get_method_func(service_obj, resource_name, method_name):
+    """Return the callable that builds requests for a method of a service object."""
+    resource_func = getattr(service_obj, resource_name)
+    return getattr(resource_func(), method_name)
+
+def execute_request(request, retries, limiter=None, description="request", idempotent=None):
+    """
+    Execute a request and return the response. Transient errors are retried (see
+    retry.call, idempotent defaults to the HTTP method of the request) and the
+    limiter (if given) is waited before each attempt.
+    """
+    if idempotent is None:
+        idempotent = retry.is_idempotent(getattr(request, "method", "POST"))
+    def send():
+        if limiter:
+            with timings.phase("ratelimit.wait"):
+                limiter.wait()
+        with timings.phase("api.call"):
             return request.execute()
+    return retry.call(send, retries, description, idempotent)
+
+def call_method(method_func, method_options, options, limiter=None):
+    """Send request to API using a method callable and return JSON response."""
+    if options.media_file:
+        method_options_with_media = get_method_options_with_media(
+            method_options, options.media_file, options.chunk_size)
+        request = method_func(**method_options_with_media)
+        if limiter:
+            limiter.wait()
+        return execute_media_request(request, method_options, options)
+    else:
+        config.logger.debug("Request: " + lib.pretty_json(method_options))
+        request = method_func(**method_options)
+        return execute_request(request, options.retries, limiter)
+
+def send_request(service_id, resource_name, method_name, method_options, options):
+    """Send request through the daemon if it's running (otherwise directly) and return JSON response."""
+    if options.use_daemon and not options.media_file and \
+            config.discovery_cache_mode != "refresh":
+        try:
+            with timings.phase("daemon.forward"):
+                return daemon.forward_request(options.api_path, method_options, options)
+        except daemon.Unavailable as error:
+            config.logger.debug("Daemon not used: {}".format(error))
+    return do_request(service_id, resource_name, method_name, method_options, options)
+
+def do_request(service_id, resource_name, method_name, method_options, options):
+    """Send request to API and return JSON response."""
+    service = common.get_method_service(service_id, resource_name, method_name)
+    method = common.get_method(service, resource_name, method_name)
+    check_method_options(service, method, method_options, options)
+    tree = get_selection(service, method, options)
+    credentials = get_credentials(method.get("scopes", []), options)
+    service_obj = build_service(service, credentials)
+    method_func = get_method_func(service_obj, resource_name, method_name)
+    limiter = ratelimit.get_limiter(service_id, method["id"])
+    response = call_method(method_func, add_fields(method_options, tree), options, limiter)
+    return selection.project(response, tree)
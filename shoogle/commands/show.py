@@ -3,6 +3,8 @@ import re
 
 from .. import lib
 from .. import common
+from .. import index
+from .. import config
 from ..config import logger
 
 def add_parser(subparsers, name):
@@ -12,10 +14,26 @@ def add_parser(subparsers, name):
         help='Levels to show of the example request body')
     parser.add_argument('--debug-response-level', type=int, default=0,
         help='Levels to show of the response schema on debug messages')
+    parser.add_argument('-s', '--search', metavar="QUERY",
+        help='Search services, resources and methods (terms or a method ID prefix)')
+    parser.add_argument('--build-index', action="store_true",
+        help='Download the discovery documents of all services to build the search index')
+    common.add_discovery_arguments(parser)
+    common.add_http_arguments(parser)
     parser.add_argument('api_path', metavar="API_PATH", nargs='?', default="",
         help="SERVICE:VERSION.RESOURCE.METHOD")
 
 def run(options):
+    common.configure_discovery(options)
+    common.configure_http(options)
+    if options.build_index:
+        index.build()
+        logger.info("Search index built: {}".format(config.search_index_path))
+        if options.search is None:
+            return
+    if options.search is not None:
+        show_search(options.search, index.update())
+        return
     parts = options.api_path.split(".", 2)
     service_id, resource_name, method_name = lib.pad_list(parts, 3)
     if resource_name is None:
@@ -25,6 +43,13 @@ def run(options):
     else:
         show_methods(service_id, resource_name, method_name, options)
 
+def show_search(query, search_index):
+    results = index.search(search_index, query)
+    if not results:
+        logger.info("Nothing found in the search index: {}".format(query))
+    for api_path, method_id, description in results:
+        lib.output(" - ".join(filter(None, [api_path, description])))
+
 def show_services(search_service_id, options):
     services = common.get_services()
     filtered_services = [(service_id, item) for (service_id, item) in services.items() 
@@ -40,28 +65,31 @@ def show_services(search_service_id, options):
                 lib.output("{id} - {title}".format(id=service_id, title=item["title"]))
 
 def show_resources(service_id, search_resource_name, options):
-    resources = common.get_service(service_id)["resources"]
+    resource_names = common.get_service_document(service_id).get_resource_names()
     filtered_resources = [
-        (resource_name, resource) 
-        for (resource_name, resource) in resources.items() 
+        resource_name
+        for resource_name in resource_names
         if re.search(search_resource_name, resource_name)
     ]
 
     if len(filtered_resources) == 0:
         logger.info("Resource not found in service {}: {}".format(service_id, search_resource_name))
-    elif len(filtered_resources) == 1 and search_resource_name in resources:
+    elif len(filtered_resources) == 1 and search_resource_name in resource_names:
         show_methods(service_id, search_resource_name, "", options)
     else:    
-        for resource_name, resource in sorted(filtered_resources):
+        for resource_name in sorted(filtered_resources):
             lib.output("{service}.{name}".format(
                 service=service_id, 
                 name=resource_name,
             ))
 
 def show_methods(service_id, resource_name, search_method_name, options):
-    service = common.get_service(service_id)
-    logger.info("Service documentation: {}".format(service["documentationLink"]))
-    methods = service["resources"][resource_name]["methods"]
+    document = common.get_service_document(service_id)
+    logger.info("Service documentation: {}".format(document.get_document()["documentationLink"]))
+    resource = document.get_resource(resource_name)
+    if resource is None:
+        raise common.ShoogleException("Resource not found: {}".format(resource_name))
+    methods = resource.get("methods", {})
 
     filtered_methods = [
         (method_name, method) 
@@ -76,6 +104,7 @@ def show_methods(service_id, resource_name, search_method_name, options):
             method=search_method_name,
         ))
     elif len(filtered_methods) == 1 and search_method_name in methods:
+        service = common.get_method_service(service_id, resource_name, search_method_name)
         show_method(service, methods[search_method_name], options)
     else:    
         for method_name, method in sorted(filtered_methods):
@@ -6,63 +6,241 @@ import glob
 import os
 import re
 
-import httplib2
-
+from . import cache
 from . import lib
 from . import config
+from . import retry
+from . import store
+from . import timings
+from . import transport
 from .config import logger
 
 class ShoogleException(Exception):
     """Used for controlled exceptions of the app."""
     pass
 
+class ServerError(Exception):
+    """Error response of the API received through the daemon (same interface as HttpError)."""
+    def __init__(self, status, content):
+        Exception.__init__(self, status, content)
+        self.resp = {"status": status}
+        self.content = content
+
+class FetchError(ShoogleException):
+    """Error response of a GET request (same interface as HttpError)."""
+    def __init__(self, message, resp, content):
+        ShoogleException.__init__(self, message)
+        self.resp = resp
+        self.content = content
+
+def add_discovery_arguments(parser):
+    """Add options that control how discovery documents are cached."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--refresh', dest="discovery_cache_mode", action="store_const",
+                       const="refresh", default="default",
+                       help="Download discovery documents even if they are cached")
+    group.add_argument('--offline', dest="discovery_cache_mode", action="store_const",
+                       const="offline", help="Use only cached discovery documents")
+    parser.add_argument('--cache-ttl', type=int, metavar="SECONDS", default=None,
+                        help="Seconds to use cached discovery documents before revalidating")
+
+def configure_discovery(options):
+    """Set the discovery cache configuration from command-line options."""
+    config.discovery_cache_mode = options.discovery_cache_mode
+    if options.cache_ttl is not None:
+        config.discovery_ttl = options.cache_ttl
+
+def add_http_arguments(parser):
+    """Add options for the HTTP connections."""
+    parser.add_argument('--timeout', type=float, metavar="SECONDS", default=None,
+                        help="Seconds to wait for HTTP responses")
+    parser.add_argument('--proxy', metavar="URL", default=None,
+                        help="Proxy for HTTP requests (default: $https_proxy)")
+
+def configure_http(options):
+    """Set the HTTP configuration from command-line options."""
+    if options.timeout is not None:
+        config.http_timeout = options.timeout
+    if options.proxy is not None:
+        config.http_proxy = options.proxy
+
+def fetch(url, headers=None):
+    """
+    Return a pair (response, content) for a GET request if the HTTP_STATUS
+    is 2XX or 304, otherwise raise a FetchError. Transient errors are retried.
+    """
+    def get():
+        logger.info("GET {}".format(url))
+        response, content = transport.get_http().request(url, "GET", headers=headers)
+        if re.match("2..|304", str(response.status)):
+            return response, content
+        else:
+            raise FetchError("GET {} ({})".format(url, response.status), response, content)
+    return retry.call(get, config.retries, "GET {}".format(url))
+
 def download(url):
     """
     Return the content of a URL if the HTTP_STATUS is 2XX, otherwise raise
     a ShoogleException with a description of the problem.
     """
-    logger.info("GET {}".format(url))
-    http = httplib2.Http(cache=config.cache_dir)
-    headers, content = http.request(url, "GET")
-    if re.match("2..", str(headers.status)):
-        return content.decode('utf-8')
+    response, content = fetch(url)
+    return content.decode('utf-8')
+
+def get_discovery_document(key, get_url, storage=cache):
+    """
+    Return a parsed discovery document, from the cache if it's fresh, otherwise
+    downloading (or revalidating the cached one) from the URL returned by get_url().
+    The storage module (cache or store) defines the type of the returned object.
+    """
+    mode = config.discovery_cache_mode
+    entry = (storage.load(key) if mode != "refresh" else None)
+    if entry and (mode == "offline" or cache.is_fresh(entry, config.discovery_ttl)):
+        logger.debug("Discovery cache hit: {}".format(key))
+        timings.count("discovery.cache.hit")
+        return entry.data
+    url = get_url()
+    if mode == "offline":
+        raise ShoogleException("Discovery document not cached (offline mode): {}".format(url))
+    headers = ({"If-None-Match": entry.etag} if entry and entry.etag else {})
+    with timings.phase("discovery.download") as transferred:
+        response, content = fetch(url, headers)
+        transferred.append(len(content))
+    if response.status == 304:
+        logger.debug("Discovery cache revalidated: {}".format(key))
+        timings.count("discovery.cache.revalidated")
+        return storage.revalidate(key, entry).data
     else:
-        raise ShoogleException("GET {} ({})".format(url, headers.status))
+        timings.count("discovery.cache.miss")
+        with timings.phase("discovery.load_json"):
+            data = lib.load_json(content.decode('utf-8'))
+        return storage.save(key, data, response.get("etag")).data
 
 def get_services():
     """Return a dictionary {service_id, service}."""
-    apis = download("https://www.googleapis.com/discovery/v1/apis")
-    services = lib.load_json(apis)["items"]
-    return dict((service["id"], service) for service in services)
+    with timings.phase("discovery.get_services"):
+        apis = get_discovery_document("apis", lambda: config.discovery_url)
+        return dict((service["id"], service) for service in apis["items"])
+
+def get_credentials_index_path(credentials_dir):
+    """Return the path of the index file of a credentials directory."""
+    return os.path.join(credentials_dir, config.credentials_index_filename)
+
+def load_credentials_index(credentials_dir):
+    """Return the list of entries {file, scopes} of the credentials index (None if missing)."""
+    try:
+        with open(get_credentials_index_path(credentials_dir)) as fd:
+            return json.load(fd)["credentials"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_credentials_index(credentials_dir, entries):
+    """Write the credentials index of a directory."""
+    data = json.dumps({"credentials": entries}, indent=2).encode("utf-8")
+    lib.write_atomically(get_credentials_index_path(credentials_dir), data)
+
+def build_credentials_index(credentials_dir):
+    """Build the credentials index from the JSON files of the directory, save and return it."""
+    logger.debug("Building credentials index: " + credentials_dir)
+    entries = []
+    for path in sorted(glob.glob(os.path.join(credentials_dir, "*.json"))):
+        if os.path.basename(path) == config.credentials_index_filename:
+            continue
+        with open(path) as fd:
+            credentials = json.load(fd)
+        filename = os.path.basename(path)
+        entries.append({"file": filename, "scopes": sorted(credentials.get("scopes", []))})
+    save_credentials_index(credentials_dir, entries)
+    return entries
+
+def add_to_credentials_index(credentials_path, scopes):
+    """Add (or update) the entry of a credentials file in the index of its directory."""
+    credentials_dir, filename = os.path.split(credentials_path)
+    entries = load_credentials_index(credentials_dir)
+    if entries is None:
+        build_credentials_index(credentials_dir)
+    else:
+        entry = {"file": filename, "scopes": sorted(scopes)}
+        other_entries = [entry for entry in entries if entry["file"] != filename]
+        save_credentials_index(credentials_dir, other_entries + [entry])
+
+def find_credentials(entries, required_scopes, minimal=False):
+    """
+    Return the entry of the index whose scopes are a superset of the required scopes
+    (None if not found). An entry with exactly the same scopes is preferred, then the
+    first entry in the index or, if minimal is True, the one with fewer scopes.
+    """
+    required_scopes = set(required_scopes)
+    matching = [entry for entry in entries if required_scopes.issubset(entry["scopes"])]
+    exact = [entry for entry in matching if required_scopes == set(entry["scopes"])]
+    if exact:
+        return exact[0]
+    elif matching and minimal:
+        return min(matching, key=lambda entry: (len(entry["scopes"]), entry["file"]))
+    else:
+        return (matching[0] if matching else None)
 
-def get_credentials_path(required_scopes, credentials_profile):
-    """Return the path of the credentials file."""
+def get_credentials_path(required_scopes, credentials_profile, minimal=False):
+    """
+    Return the path of the credentials file. Credentials files are looked up in the
+    index of the profile directory, which is rebuilt if missing or out of date.
+    """
     logger.debug("Searching credentials with scopes: " + str(required_scopes))
     basedir = config.credentials_base_dir
     credentials_dir = os.path.join(basedir, credentials_profile)
     lib.mkdir_p(credentials_dir)
 
-    for path in glob.glob(os.path.join(credentials_dir, "*.json")):
-        credentials = json.load(open(path))
-        credentials_scope = set(credentials.get("scopes", []))
-        if credentials_scope.issuperset(required_scopes):
-            logger.info("Using credentials: {}".format(path))
-            return path
+    entries = load_credentials_index(credentials_dir)
+    entry = (find_credentials(entries, required_scopes, minimal) if entries is not None else None)
+    if not entry or not os.path.exists(os.path.join(credentials_dir, entry["file"])):
+        timings.count("credentials.index.rebuild")
+        entries = build_credentials_index(credentials_dir)
+        entry = find_credentials(entries, required_scopes, minimal)
+    else:
+        timings.count("credentials.index.hit")
+    if entry:
+        path = os.path.join(credentials_dir, entry["file"])
+        logger.info("Using credentials: {}".format(path))
+        return path
     uuid_value = str(uuid.uuid1())
     filename = "credentials-{uuid}.json".format(uuid=uuid_value)
     new_path = os.path.join(credentials_dir, filename)
     logger.debug("No credentials for scopes, create new file: " + new_path)
     return new_path
 
+def get_service_document(service_id):
+    """
+    Return the stored discovery document of a service (a store.Document, whose parts
+    are read on demand). Raise ShoogleException if not found.
+    """
+    def get_url():
+        services = get_services()
+        if service_id not in services:
+            raise ShoogleException("Service API not found: {}".format(service_id))
+        else:
+            return services[service_id]["discoveryRestUrl"]
+    return get_discovery_document(service_id, get_url, store)
+
 def get_service(service_id):
-    """Return the service from its ID. Raise ShoogleException if not found."""
-    services = get_services()
-    if service_id not in services:
-        raise ShoogleException("Service API not found: {}".format(service_id))
-    else:
-        service = services[service_id]
-        service_json = download(service["discoveryRestUrl"])
-        return lib.load_json(service_json)
+    """Return the whole discovery document of a service. Raise ShoogleException if not found."""
+    return get_service_document(service_id).load()
+
+def get_method_service(service_id, resource_name, method_name):
+    """
+    Return the discovery document of a service pruned to a method and the schemas it
+    references (transitively). Only these parts are read from the store. Raise
+    ShoogleException if not found.
+    """
+    document = get_service_document(service_id)
+    resource = document.get_resource(resource_name)
+    if resource is None:
+        raise ShoogleException("Resource not found: {}".format(resource_name))
+    elif method_name not in resource.get("methods", {}):
+        raise ShoogleException("Method not found: {}".format(method_name))
+    method = resource["methods"][method_name]
+    return lib.merge(document.get_document(), {
+        "resources": {resource_name: {"methods": {method_name: method}}},
+        "schemas": document.get_referenced_schemas(method),
+    })
 
 def get_method(service, resource_name, method_name):
     """Return the method for a service/resource. Raise ShoogleException if not found."""
@@ -73,17 +251,101 @@ def get_method(service, resource_name, method_name):
     else:
         return service["resources"][resource_name]["methods"][method_name]
 
+def get_response_schema(service, method):
+    """Return the schema of the response of a method ({} if it has none)."""
+    schema_name = method.get("response", {}).get("$ref")
+    return (service["schemas"].get(schema_name, {}) if schema_name else {})
+
+def get_items_property(schema):
+    """Return the name of the array property of a list response schema (None if not found)."""
+    arrays = [name for (name, value) in sorted(schema.get("properties", {}).items())
+              if value.get("type") == "array"]
+    if "items" in arrays:
+        return "items"
+    else:
+        return (arrays[0] if len(arrays) == 1 else None)
+
+def get_schema_components(schemas, value):
+    """
+    Return a dictionary {schema_name: component} for the schemas referenced by value,
+    where schemas that reference each other (directly or not) share the same
+    component (Tarjan's algorithm).
+    """
+    def get_references(value):
+        if isinstance(value, dict):
+            if value.get("$ref") in schemas:
+                yield value["$ref"]
+            for child in value.values():
+                yield from get_references(child)
+        elif isinstance(value, list):
+            for child in value:
+                yield from get_references(child)
+
+    indexes, lowlinks, components = {}, {}, {}
+    stack = []
+    for root in get_references(value):
+        if root in indexes:
+            continue
+        indexes[root] = lowlinks[root] = len(indexes)
+        stack.append(root)
+        pending = [(root, get_references(schemas[root]))]
+        while pending:
+            name, references = pending[-1]
+            ref = next(references, None)
+            if ref is None:
+                pending.pop()
+                if pending:
+                    parent = pending[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[name])
+                if lowlinks[name] == indexes[name]:
+                    while True:
+                        member = stack.pop()
+                        components[member] = indexes[name]
+                        if member == name:
+                            break
+            elif ref not in indexes:
+                indexes[ref] = lowlinks[ref] = len(indexes)
+                stack.append(ref)
+                pending.append((ref, get_references(schemas[ref])))
+            elif ref not in components:
+                lowlinks[name] = min(lowlinks[name], indexes[ref])
+    return components
+
 def replace_schemas(schemas, params, max_level=None, level=0):
-    """Replace JSON references (key=$ref) for properties."""
-    output = collections.OrderedDict()
-    for key, value in sorted(params.items()):
-        if max_level is not None and level >= max_level:
-            output[key] = value
-        elif key == "$ref":
-            properties = schemas[value].get("properties", schemas[value])
-            output.update(replace_schemas(schemas, properties, max_level, level + 1))
-        elif isinstance(value, dict):
-            output[key] = replace_schemas(schemas, value, max_level, level + 1)
-        else:
-            output[key] = value
-    return output
+    """
+    Replace JSON references (key=$ref) for properties.
+
+    A schema referenced within its own expansion is not expanded again, its $ref is
+    kept and marked with "$recursive": true. Expansions that do not depend on the
+    parent schemas are computed once for each (schema, remaining levels) and shared.
+    """
+    expansions = {}
+    components = get_schema_components(schemas, params)
+
+    def expand(params, level, parent_refs):
+        output = collections.OrderedDict()
+        for key, value in sorted(params.items()):
+            if max_level is not None and level >= max_level:
+                output[key] = value
+            elif key == "$ref" and value in parent_refs:
+                output[key] = value
+                output["$recursive"] = True
+            elif key == "$ref":
+                expansion_key = (value, None if max_level is None else max_level - level)
+                # Within a cycle, the expansion depends on the parents it cuts
+                shareable = all(components[ref] != components[value] for ref in parent_refs)
+                if shareable and expansion_key in expansions:
+                    output.update(expansions[expansion_key])
+                else:
+                    properties = schemas[value].get("properties", schemas[value])
+                    expansion = expand(properties, level + 1, parent_refs | {value})
+                    if shareable:
+                        expansions[expansion_key] = expansion
+                    output.update(expansion)
+            elif isinstance(value, dict):
+                output[key] = expand(value, level + 1, parent_refs)
+            else:
+                output[key] = value
+        return output
+
+    return expand(params, level, frozenset())
@@ -7,4 +7,42 @@ from . import lib
 logger = lib.get_logger("shoogle", level=logging.ERROR, channel=sys.stderr)
 config_dir = os.path.join(os.path.expanduser("~"), ".shoogle")
 cache_dir = os.path.join(config_dir, "cache")
+discovery_cache_dir = os.path.join(cache_dir, "discovery")
+search_index_path = os.path.join(cache_dir, "search-index.pickle")
+completion_index_path = os.path.join(cache_dir, "completion-index.txt")
 credentials_base_dir = os.path.join(config_dir, "credentials")
+credentials_index_filename = "index.json"
+daemon_socket_path = os.path.join(config_dir, "daemon.sock")
+uploads_dir = os.path.join(config_dir, "uploads")
+rate_limits_path = os.path.join(config_dir, "ratelimits.json")
+rate_limits_state_dir = os.path.join(config_dir, "ratelimits")
+
+# The environment variable allows using another discovery service (i.e. benchmarks/fakeapi.py)
+discovery_url = os.environ.get("SHOOGLE_DISCOVERY_URL", "https://www.googleapis.com/discovery/v1/apis")
+# Seconds a cached discovery document is used before being revalidated
+discovery_ttl = 24 * 60 * 60
+# One of "default" (use cache if fresh), "refresh" (always download) or "offline" (only cache)
+discovery_cache_mode = "default"
+
+# Seconds to wait for HTTP responses (None: no timeout)
+http_timeout = None
+# Proxy URL for HTTP requests (None: use the environment, i.e. $https_proxy)
+http_proxy = None
+
+# Maximum number of calls the Google API accepts in a single HTTP batch request
+# (the global batch endpoint; most APIs limit their batches to 100 calls)
+http_batch_max_size = 1000
+
+# Refresh OAuth2 access tokens that expire within this number of seconds
+token_refresh_margin = 5 * 60
+
+# Resumable uploads are sent in chunks, whose size must be a multiple of the unit
+upload_chunk_size_unit = 256 * 1024
+upload_chunk_size = 32 * upload_chunk_size_unit
+# Times to retry a failed request (rate limits, 5XX and connection errors)
+retries = 5
+# Retry requests of non-idempotent methods (i.e. POST) on errors where they may have been processed
+retry_all_methods = False
+# Seconds to wait before the first retry, doubled on each one up to the maximum
+retry_base_delay = 1.0
+retry_max_delay = 64.0
@@ -0,0 +1,134 @@
+"""Search index of services, resources and methods, built from cached discovery documents."""
+import concurrent.futures
+import os
+import pickle
+
+from . import common
+from . import config
+from . import lib
+from . import store
+
+# Increase when the structure of the entries changes, so old index files are rebuilt
+version = 2
+
+def get_service_entries(service_id, service):
+    """Return the list of entries (api_path, id, description) of a discovery document."""
+    entries = []
+    for resource_name, resource in sorted(service.get("resources", {}).items()):
+        resource_path = "{}.{}".format(service_id, resource_name)
+        entries.append((resource_path, resource_path, ""))
+        for method_name, method in sorted(resource.get("methods", {}).items()):
+            description = method.get("description", "").strip()
+            entries.append(("{}.{}".format(resource_path, method_name), method.get("id", ""),
+                            (description.splitlines()[0] if description else "")))
+    return entries
+
+def get_service_parameters(service_id, service):
+    """Return a dictionary {api_path: [parameter_name, ...]} of the methods of a service."""
+    parameters = {}
+    for resource_name, resource in service.get("resources", {}).items():
+        for method_name, method in resource.get("methods", {}).items():
+            api_path = "{}.{}.{}".format(service_id, resource_name, method_name)
+            names = sorted(method.get("parameters", {}))
+            parameters[api_path] = names + (["body"] if method.get("request") else [])
+    return parameters
+
+def get_completion_lines(index):
+    """
+    Yield the lines LEVEL<TAB>API_PATH<TAB>PARAMETERS of the completion index, where
+    LEVEL is 0 for services, 1 for resources and 2 for methods.
+    """
+    for service_id, service in sorted(index["services"].items()):
+        yield "0\t{}\t".format(service_id)
+        for api_path, method_id, description in service["entries"][1:]:
+            parameters = service["parameters"].get(api_path)
+            level = (1 if parameters is None else 2)
+            yield "{}\t{}\t{}".format(level, api_path, " ".join(parameters or []))
+
+def load():
+    """Return the index {"version", "services"} stored in the cache directory."""
+    try:
+        with open(config.search_index_path, "rb") as fd:
+            index = pickle.load(fd)
+        if index.get("version") == version:
+            return index
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
+        pass
+    return {"version": version, "services": {}}
+
+def save(index):
+    """Write the index (and the plain-text index used by shell completion) to the cache directory."""
+    try:
+        lib.mkdir_p(os.path.dirname(config.search_index_path))
+        lib.write_atomically(config.search_index_path,
+                             pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        completion_index = "".join(line + "\n" for line in get_completion_lines(index))
+        lib.write_atomically(config.completion_index_path, completion_index.encode("utf-8"))
+    except OSError as error:
+        config.logger.warning("Cannot write search index: {}".format(error))
+
+def update():
+    """
+    Return the index updated with the cached discovery documents. Only services
+    whose cache file changed since the last update are read again.
+    """
+    index = load()
+    services = common.get_services()
+    indexed_services = {}
+    changed = (set(index["services"]) != set(services))
+    for service_id, item in services.items():
+        path = store.get_path(service_id)
+        mtime = (os.path.getmtime(path) if os.path.exists(path) else None)
+        indexed = index["services"].get(service_id)
+        if indexed and indexed["mtime"] == mtime:
+            indexed_services[service_id] = indexed
+            continue
+        description = " - ".join(filter(None, [item.get("title"), item.get("description")]))
+        entries = [(service_id, service_id, description)]
+        parameters = {}
+        entry = (store.load(service_id) if mtime is not None else None)
+        if entry:
+            service = entry.data.load()
+            entries.extend(get_service_entries(service_id, service))
+            parameters = get_service_parameters(service_id, service)
+        config.logger.debug("Search index updated: {}".format(service_id))
+        indexed_services[service_id] = {"mtime": mtime, "entries": entries,
+                                        "parameters": parameters}
+        changed = True
+    index["services"] = indexed_services
+    if changed:
+        save(index)
+    return index
+
+def build(workers=8):
+    """Download the discovery documents of all services and return the updated index."""
+    def get_service(service_id):
+        try:
+            common.get_service_document(service_id)
+        except common.ShoogleException as error:
+            config.logger.warning("Cannot get discovery document: {}".format(error))
+
+    service_ids = sorted(common.get_services())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(get_service, service_ids))
+    return update()
+
+def search(index, query):
+    """
+    Return the entries (api_path, id, description) that contain all the terms of
+    the query. Entries whose path or ID starts with the query come first, then
+    those with more terms matched in the path or ID.
+    """
+    query = query.strip().lower()
+    terms = query.split()
+    results = []
+    for service in index["services"].values():
+        for api_path, method_id, description in service["entries"]:
+            ids = "{} {}".format(api_path, method_id).lower()
+            text = "{} {}".format(ids, description.lower())
+            if all(term in text for term in terms):
+                is_prefix = api_path.lower().startswith(query) or method_id.lower().startswith(query)
+                terms_not_in_ids = sum(1 for term in terms if term not in ids)
+                rank = (not is_prefix, terms_not_in_ids, api_path)
+                results.append((rank, (api_path, method_id, description)))
+    return [entry for (rank, entry) in sorted(results)]
@@ -1,11 +1,17 @@
 """Miscellanious helper utils."""
+import collections
+import contextlib
 import errno
 import os
 import logging
 import sys
 import json
+import tempfile
 
-import jsmin
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 def get_logger(name, level=logging.INFO, channel=sys.stderr):
     """Return a Logger object."""
@@ -19,6 +25,21 @@ def get_logger(name, level=logging.INFO, channel=sys.stderr):
     logger.addHandler(handler)
     return logger
 
+def set_log_level(logger, level):
+    """Set the level of a logger and its handlers."""
+    logger.setLevel(level)
+    for handler in logger.handlers:
+        handler.setLevel(level)
+
+def is_instance(obj, class_path):
+    """
+    Return True if obj is an instance of the class "module.Class". The module
+    is not imported: if it was not imported yet, obj cannot be an instance.
+    """
+    module_name, class_name = class_path.rsplit(".", 1)
+    module = sys.modules.get(module_name)
+    return module is not None and isinstance(obj, getattr(module, class_name))
+
 def merge(dict1, dict2):
     """Return merged dictionaries (repeated keys are set to dict2 values)."""
     dict3 = dict1.copy()
@@ -29,6 +50,39 @@ def pad_list(lst, size):
     """Return list with exactly <size> elements."""
     return lst[:size] + [None] * (size - len(lst))
 
+def grouper(iterable, size):
+    """Yield lists of <size> consecutive elements of iterable (the last one may be shorter)."""
+    group = []
+    for item in iterable:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def ordered_map(executor, func, iterable, max_pending):
+    """
+    Yield func(item) for each item in iterable, in order, running the calls in a
+    concurrent.futures executor with at most max_pending submitted calls at once.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def parse_size(string):
+    """Return the number of bytes of a size string with an optional suffix (K, M, G)."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    suffix = string[-1:].upper()
+    if suffix in units:
+        return int(string[:-1]) * units[suffix]
+    else:
+        return int(string)
+
 def output(obj):
     """Print to stdout."""
     print(str(obj))
@@ -43,10 +97,85 @@ def mkdir_p(path):
         else:
             raise
 
+def write_atomically(path, data):
+    """Write data (bytes) to a file, replacing it atomically if it exists."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as output_fd:
+            output_fd.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Context manager that holds an exclusive lock on a file, shared by all processes.
+    On systems without fcntl (Windows), no lock is taken.
+    """
+    with open(path, "a") as fd:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
 def pretty_json(obj):
     """Return pretty JSON string representation of a Python object."""
     return json.dumps(obj, indent=2)
 
+def compact_json(obj):
+    """Return single-line JSON string representation of a Python object."""
+    return json.dumps(obj, separators=(",", ":"))
+
+def iter_compact_json(obj, levels=2, list_chunk_size=1000):
+    """
+    Yield the chunks of the single-line JSON of a Python object. The first levels
+    of containers are iterated (lists in slices of list_chunk_size elements), the
+    rest is encoded by the (much faster) C encoder.
+    """
+    if levels > 0 and isinstance(obj, dict):
+        yield "{"
+        for index, (key, value) in enumerate(obj.items()):
+            yield ("," if index else "") + json.dumps(str(key)) + ":"
+            yield from iter_compact_json(value, levels - 1, list_chunk_size)
+        yield "}"
+    elif levels > 0 and isinstance(obj, list):
+        yield "["
+        for start in range(0, len(obj), list_chunk_size):
+            # Encode a slice as a list and strip its brackets
+            yield ("," if start else "") + compact_json(obj[start:start + list_chunk_size])[1:-1]
+        yield "]"
+    else:
+        yield compact_json(obj)
+
+def write_json(obj, pretty=False, fd=None, buffer_size=64 * 1024):
+    """
+    Write the JSON of a Python object and a newline to fd (STDOUT by default),
+    in blocks of about buffer_size characters, without building the whole string.
+    """
+    fd = (fd or sys.stdout)
+    chunks = (json.JSONEncoder(indent=2).iterencode(obj) if pretty else iter_compact_json(obj))
+    buffer, buffered = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= buffer_size:
+            fd.write("".join(buffer))
+            buffer, buffered = [], 0
+    buffer.append("\n")
+    fd.write("".join(buffer))
+
 def load_json(json_string):
-    """Return Python object from JSON string."""
-    return json.loads(jsmin.jsmin(json_string))
+    """
+    Return Python object from JSON string. JS comments are allowed, but the
+    (slow) jsmin minifier is only run if the string is not plain JSON.
+    """
+    try:
+        return json.loads(json_string)
+    except ValueError:
+        import jsmin
+        return json.loads(jsmin.jsmin(json_string))
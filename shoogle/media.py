@@ -0,0 +1,198 @@
+"""Media transfers: resumable uploads (with persisted sessions) and streamed downloads."""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import googleapiclient.errors
+import googleapiclient.http
+
+from . import config
+from . import lib
+
+class StreamUpload(googleapiclient.http.MediaUpload):
+    """
+    Resumable upload of a non-seekable stream (i.e. a pipe) of unknown size. Only the
+    current chunk is kept in memory, so it can be sent again if a request fails.
+    """
+
+    def __init__(self, fd, chunksize, mimetype="application/octet-stream"):
+        super(StreamUpload, self).__init__()
+        self._fd = fd
+        self._chunksize = chunksize
+        self._mimetype = mimetype
+        self._buffer_start = 0
+        self._buffer = b""
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return None
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        """
+        Return the bytes [begin, begin + length) of the stream, read sequentially. begin
+        may be within the current chunk, when the server acknowledged only part of it.
+        """
+        offset = begin - self._buffer_start
+        if not 0 <= offset <= len(self._buffer):
+            raise IOError("Cannot seek to byte {} of a stream".format(begin))
+        data = self._buffer[offset:offset + length]
+        if len(data) < length:
+            data += self._fd.read(length - len(data))
+        self._buffer_start, self._buffer = begin, data
+        return data
+
+    def bytes_read(self):
+        """Return the number of bytes read from the stream."""
+        return self._buffer_start + len(self._buffer)
+
+def get_upload_size(upload):
+    """Return the size of a MediaUpload (for streams, the bytes read so far)."""
+    size = upload.size()
+    return (upload.bytes_read() if size is None else size)
+
+def get_media_upload(media_file, chunk_size):
+    """Return the MediaUpload object for a file path (or '-' for STDIN)."""
+    if media_file == "-":
+        return StreamUpload(sys.stdin.buffer, chunk_size)
+    else:
+        return googleapiclient.http.MediaFileUpload(
+            media_file,
+            chunksize=chunk_size,
+            resumable=True,
+            mimetype="application/octet-stream",
+        )
+
+def get_session_path(api_path, method_options, media_file):
+    """Return the path of the file that stores the upload session URI of a media upload."""
+    stat = os.stat(media_file)
+    key = json.dumps([api_path, method_options, os.path.abspath(media_file),
+                      stat.st_size, stat.st_mtime], sort_keys=True)
+    filename = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+    return os.path.join(config.uploads_dir, filename)
+
+def load_session_uri(session_path):
+    """Return the upload session URI stored in session_path (None if missing)."""
+    try:
+        with open(session_path) as fd:
+            return json.load(fd)["uri"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_session_uri(session_path, uri):
+    """Store the upload session URI in session_path."""
+    lib.mkdir_p(os.path.dirname(session_path))
+    lib.write_atomically(session_path, json.dumps({"uri": uri}).encode("utf-8"))
+
+def format_size(size):
+    """Return a human readable string of a size in bytes."""
+    return "{:.1f} MiB".format(size / (1024.0 * 1024.0))
+
+def report_progress(action, transferred, total, rate):
+    """Write the progress and throughput (bytes/second) of a transfer to STDERR."""
+    total_info = ("/ {} ({:.0f}%) ".format(format_size(total), 100.0 * transferred / total)
+                  if total else "")
+    sys.stderr.write("\r{} {} {}at {}/s ".format(
+        action, format_size(transferred), total_info, format_size(rate)))
+    sys.stderr.flush()
+
+def execute_upload(request, session_path=None, num_retries=0, progress=False):
+    """
+    Send the chunks of a resumable upload request and return the response.
+
+    If session_path is given, the upload session URI is stored there, so an
+    interrupted upload is resumed from the last byte received by the server.
+    Each chunk is retried num_retries times (with exponential backoff).
+    """
+    session_uri = (load_session_uri(session_path) if session_path else None)
+    if session_uri:
+        config.logger.info("Resuming upload session: {}".format(session_uri))
+        # Same state googleapiclient uses after a failed chunk: the next call
+        # asks the server how many bytes it has received and continues from there.
+        request.resumable_uri = session_uri
+        request._in_error_state = True
+    # Throughput of a resumed upload is measured from its first chunk, as it starts midway
+    start_time = time.time()
+    previous_progress = (None if session_uri else 0)
+    sent = 0
+
+    while True:
+        try:
+            status, response = request.next_chunk(num_retries=num_retries)
+        except googleapiclient.errors.HttpError as error:
+            if session_uri and error.resp.status in (404, 410):
+                config.logger.info("Upload session expired, starting a new one")
+                session_uri = request.resumable_uri = None
+                request._in_error_state = False
+                request.resumable_progress = 0
+                continue
+            raise
+        if session_path and request.resumable_uri and request.resumable_uri != session_uri:
+            session_uri = request.resumable_uri
+            save_session_uri(session_path, session_uri)
+        if status:
+            config.logger.debug("MediaUpload status: {}".format(status.progress()))
+            if previous_progress is None:
+                start_time = time.time()
+            else:
+                sent += status.resumable_progress - previous_progress
+            previous_progress = status.resumable_progress
+            if progress:
+                rate = sent / max(time.time() - start_time, 1e-6)
+                report_progress("Uploaded", status.resumable_progress, status.total_size, rate)
+        if response:
+            if progress:
+                # The last chunk returns the response without a status
+                total_size = get_upload_size(request.resumable)
+                if previous_progress is not None:
+                    sent += total_size - previous_progress
+                rate = sent / max(time.time() - start_time, 1e-6)
+                report_progress("Uploaded", total_size, total_size, rate)
+                sys.stderr.write("\n")
+            if session_path and os.path.exists(session_path):
+                os.remove(session_path)
+            return response
+
+def execute_download(request, path, chunk_size, resume=False, num_retries=0, progress=False):
+    """
+    Download the media of a request in chunks and write them to path (or to STDOUT if
+    path is '-'). With resume, an existing file is completed from its current size.
+    """
+    if path == "-":
+        fd, offset = sys.stdout.buffer, 0
+    else:
+        offset = (os.path.getsize(path) if resume and os.path.exists(path) else 0)
+        fd = open(path, "ab" if offset else "wb")
+    downloader = googleapiclient.http.MediaIoBaseDownload(fd, request, chunksize=chunk_size)
+    # Start the Range requests after the bytes already downloaded
+    downloader._progress = offset
+    start_time = time.time()
+    try:
+        done = False
+        while not done:
+            try:
+                status, done = downloader.next_chunk(num_retries=num_retries)
+            except googleapiclient.errors.HttpError as error:
+                if offset and error.resp.status == 416:
+                    config.logger.info("File already downloaded: {}".format(path))
+                    break
+                raise
+            fd.flush()
+            config.logger.debug("MediaDownload status: {}".format(status.progress()))
+            if progress:
+                rate = (status.resumable_progress - offset) / max(time.time() - start_time, 1e-6)
+                report_progress("Downloaded", status.resumable_progress, status.total_size, rate)
+        if progress:
+            sys.stderr.write("\n")
+    finally:
+        if fd is not sys.stdout.buffer:
+            fd.close()
@@ -0,0 +1,120 @@
+"""Limit the rate of requests sent to the API."""
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+from . import common
+from . import config
+from . import lib
+
+class RateLimiter(object):
+    """Limit the calls to wait() to a maximum rate (per second) for all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        """Block until a new call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+class SharedRateLimiter(object):
+    """
+    Token bucket shared by all the processes (and threads) that use the same name.
+    Its state is kept in a file under ~/.shoogle, updated under a file lock.
+
+    Every call takes a token, even if the bucket is empty (the count goes negative),
+    and waits until its token is refilled. So callers are served in order and the
+    lock is only held to update the state.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, name, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        filename = urllib.parse.quote(name, safe="") + ".json"
+        self.path = os.path.join(config.rate_limits_state_dir, filename)
+
+    def take_token(self):
+        """Take a token from the bucket and return the seconds to wait for it."""
+        lib.mkdir_p(config.rate_limits_state_dir)
+        with self.lock, lib.file_lock(self.path + ".lock"):
+            now = time.time()
+            try:
+                with open(self.path) as fd:
+                    state = json.load(fd)
+                elapsed = max(now - state["timestamp"], 0.0)
+                tokens = min(state["tokens"] + elapsed * self.rate, self.burst)
+            except (OSError, ValueError, KeyError, TypeError):
+                tokens = self.burst
+            tokens -= 1
+            state = {"tokens": tokens, "timestamp": now}
+            lib.write_atomically(self.path, json.dumps(state).encode("utf-8"))
+        return max(-tokens / self.rate, 0.0)
+
+    def wait(self):
+        """Block until a new call is allowed."""
+        delay = self.take_token()
+        if delay > 0:
+            config.logger.debug("Rate limit: waiting {:.3f}s".format(delay))
+            time.sleep(delay)
+
+class RateLimiters(object):
+    """Wait on several rate limiters."""
+
+    def __init__(self, limiters):
+        self.limiters = limiters
+
+    def wait(self):
+        """Block until a new call is allowed by all the limiters."""
+        for limiter in self.limiters:
+            limiter.wait()
+
+def load_rate_limits():
+    """
+    Return the rate limits configured in ~/.shoogle/ratelimits.json, a dictionary
+    {service_id or method_id: rate or {"rate": rate, "burst": burst}}.
+    """
+    try:
+        with open(config.rate_limits_path) as fd:
+            contents = fd.read()
+    except FileNotFoundError:
+        return {}
+    try:
+        return lib.load_json(contents)
+    except ValueError as error:
+        msg = "Invalid rate limits file {}: {}".format(config.rate_limits_path, error)
+        raise common.ShoogleException(msg)
+
+def get_shared_limiter(service_id, method_id):
+    """Return the SharedRateLimiter configured for a method or its service (None if none)."""
+    rate_limits = load_rate_limits()
+    name = next((key for key in [method_id, service_id] if key in rate_limits), None)
+    if name is None:
+        return None
+    limit = rate_limits[name]
+    rate, burst = ((limit.get("rate"), limit.get("burst", 1)) if isinstance(limit, dict)
+                   else (limit, 1))
+    if not isinstance(rate, (int, float)) or rate <= 0 or \
+            not isinstance(burst, (int, float)) or burst < 1:
+        raise common.ShoogleException("Invalid rate limit for {}: {}".format(name, limit))
+    return SharedRateLimiter(name, rate, burst)
+
+def get_limiter(service_id, method_id, max_rate=None):
+    """
+    Return the limiter for the requests of a method: the limit of the rate limits
+    file (shared by all processes) and max_rate (this process). None if not limited.
+    """
+    limiters = list(filter(None, [
+        get_shared_limiter(service_id, method_id),
+        (RateLimiter(max_rate) if max_rate is not None else None),
+    ]))
+    return (RateLimiters(limiters) if len(limiters) > 1 else (limiters or [None])[0])
@@ -0,0 +1,104 @@
+"""Retry of transient HTTP errors with exponential backoff, jitter and Retry-After."""
+import email.utils
+import json
+import random
+import socket
+import time
+
+from . import config
+from . import lib
+from . import timings
+
+# Reasons of 403 responses that mean "slow down", not "forbidden"
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+# Requests of these HTTP methods can be sent again without side effects
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+def is_idempotent(http_method):
+    """Return True if failed requests of an HTTP method can be retried (or all can be)."""
+    return config.retry_all_methods or http_method.upper() in IDEMPOTENT_METHODS
+
+def get_error_reason(content):
+    """Return the reason of a Google API error response body (None if not found)."""
+    try:
+        error = json.loads(bytes.decode(content))["error"]
+        errors = error.get("errors") or [{}]
+        return errors[0].get("reason") or error.get("status")
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError):
+        return None
+
+def is_http_error(error):
+    """Return True if error is an HTTP error response (it has resp and content attributes)."""
+    from . import common
+    return isinstance(error, (common.ServerError, common.FetchError)) or \
+        lib.is_instance(error, "googleapiclient.errors.HttpError")
+
+def get_retry_info(error, idempotent=True):
+    """
+    Return a pair (description, retry_after) if the error is transient, None otherwise.
+    retry_after is the delay in seconds requested by the server (None if not given).
+
+    For non-idempotent requests, only errors that guarantee the request was not
+    processed are transient: rate limits and refused connections.
+    """
+    if is_http_error(error):
+        status = int(error.resp["status"])
+        reason = get_error_reason(error.content)
+        rejected = status == 429 or (status == 403 and reason in RATE_LIMIT_REASONS)
+        if rejected or (idempotent and status >= 500):
+            description = " ".join(filter(None, [str(status), reason]))
+            return description, get_retry_after(error.resp.get("retry-after"))
+    elif isinstance(error, ConnectionRefusedError) or \
+            (idempotent and isinstance(error, (ConnectionError, socket.timeout))):
+        return type(error).__name__, None
+    return None
+
+def get_retry_after(value):
+    """Return the seconds of a Retry-After header (delay in seconds or HTTP date)."""
+    if not value:
+        return None
+    elif value.strip().isdigit():
+        return float(value)
+    else:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+            return max(date.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError, IndexError):
+            return None
+
+def get_delay(attempt):
+    """Return the seconds to wait before a retry: exponential backoff with jitter."""
+    delay = min(config.retry_base_delay * (2 ** attempt), config.retry_max_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def call(func, retries, description="request", idempotent=True):
+    """
+    Return func(), retrying up to retries times if it raises a transient error:
+    HTTP 429, 5XX, 403 with a rate limit reason, or a connection error. If the
+    request is not idempotent, 5XX and errors after it was sent are not retried.
+    """
+    attempt = 0
+    while True:
+        try:
+            result = func()
+        except Exception as error:
+            retry_info = get_retry_info(error, idempotent)
+            if retry_info is None and retries and not idempotent and get_retry_info(error):
+                config.logger.warning("Not retrying {} ({}), its method is not idempotent "
+                                      "(see --retry-all-methods)".format(description, error))
+            if retry_info is None or attempt >= retries:
+                if retry_info and retries:
+                    config.logger.warning("Giving up {} after {} retries".format(description, attempt))
+                raise
+            reason, retry_after = retry_info
+            delay = (retry_after if retry_after is not None else get_delay(attempt))
+            attempt += 1
+            timings.count("retries")
+            config.logger.warning("Retry {}/{} of {} in {:.1f}s ({})".format(
+                attempt, retries, description, delay, reason))
+            time.sleep(delay)
+        else:
+            if attempt:
+                config.logger.info("Succeeded {} after {} retries".format(description, attempt))
+            return result
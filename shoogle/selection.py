@@ -0,0 +1,97 @@
+"""
+Output selectors (execute --select): comma-separated paths of fields, with dots for
+nested fields (items.id,items.snippet.title,nextPageToken). A selector is checked
+against the response schema of the method, sent as the partial response parameter
+"fields" and applied to the response.
+"""
+import collections
+
+from . import common
+
+def parse(selector):
+    """Return the tree of a selector as nested OrderedDicts (leaves are empty)."""
+    tree = collections.OrderedDict()
+    for path in selector.split(","):
+        names = path.strip().split(".")
+        if not all(name.strip() for name in names):
+            raise common.ShoogleException("Invalid selector: {}".format(selector))
+        node = tree
+        for index, name in enumerate(name.strip() for name in names):
+            if name in node and not node[name]:
+                # The whole field is already selected
+                break
+            elif index == len(names) - 1:
+                node[name] = collections.OrderedDict()
+            else:
+                node = node.setdefault(name, collections.OrderedDict())
+    return tree
+
+def merge(tree, other):
+    """Return the tree that selects the fields of both trees."""
+    output = collections.OrderedDict(tree)
+    for name, children in other.items():
+        if name not in output:
+            output[name] = children
+        elif output[name] and children:
+            output[name] = merge(output[name], children)
+        else:
+            output[name] = collections.OrderedDict()
+    return output
+
+def get_fields(tree):
+    """Return the value of the "fields" parameter of a tree."""
+    fields = []
+    for name, children in tree.items():
+        if not children:
+            fields.append(name)
+        elif len(children) == 1:
+            fields.append("{}/{}".format(name, get_fields(children)))
+        else:
+            fields.append("{}({})".format(name, get_fields(children)))
+    return ",".join(fields)
+
+def get_field_schemas(schemas, schema):
+    """
+    Return a pair (properties, additional) with the schemas of the fields of the values
+    of a schema (arrays are traversed) and the schema of fields not in properties.
+    """
+    expanded = common.replace_schemas(schemas, schema, max_level=1)
+    while expanded.get("type") == "array":
+        expanded = common.replace_schemas(schemas, expanded.get("items", {}), max_level=1)
+    if isinstance(expanded.get("type"), str):
+        # A schema (the expansion of a reference is the dictionary of its properties)
+        additional = expanded.get("additionalProperties")
+        return (expanded.get("properties", {}), (additional if isinstance(additional, dict) else None))
+    else:
+        return (expanded, None)
+
+def check(service, method, tree):
+    """Raise ShoogleException if the fields of a tree are not in the response schema of the method."""
+    schemas = service.get("schemas", {})
+    if not method.get("response"):
+        raise common.ShoogleException("Method has no response to select from: {}".format(method["id"]))
+
+    def check_fields(schema, tree, parents):
+        properties, additional = get_field_schemas(schemas, schema)
+        for name, children in tree.items():
+            field_schema = properties.get(name, additional)
+            if field_schema is None:
+                msg = "Field not found in the response of {}: {} (fields: {})".format(
+                    method["id"], ".".join(parents + [name]), ", ".join(sorted(properties)))
+                raise common.ShoogleException(msg)
+            elif children:
+                check_fields(field_schema, children, parents + [name])
+    check_fields(method["response"], tree, [])
+
+def project(value, tree):
+    """Return the fields of a tree of a JSON value (items of arrays are projected, None selects all)."""
+    if tree is None:
+        return value
+    elif isinstance(value, list):
+        return [project(item, tree) for item in value]
+    elif isinstance(value, dict):
+        return collections.OrderedDict(
+            (key, (project(child, tree[key]) if tree[key] else child))
+            for (key, child) in value.items() if key in tree)
+    else:
+        return value
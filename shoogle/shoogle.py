@@ -2,26 +2,35 @@
 import argparse
 import json
 import logging
+import os
 import sys
 
-import oauth2client.client
-import googleapiclient.errors
-import googleapiclient.discovery
-
 from . import __version__
 from . import lib
 from . import common
 from . import commands
 from . import config
+from . import timings
 
 def get_parser(description):
     """Return an ArgumentParser for the command-line app."""
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument('-v', '--version', action="store_true", help="Show version and exit")
+    parser.add_argument('--log-level', choices=["debug", "info", "warning", "error"],
+                        default="error",
+                        help="Messages to write to STDERR (warning: retries, info: also requests)")
+    parser.add_argument('--timings', action="store_true",
+                        help="Write the time spent in each phase of the run to STDERR")
+    parser.add_argument('--timings-file', metavar="PATH",
+                        help="Write the timings (and a trace of the phases) as JSON to a file")
+    parser.add_argument('--profile', metavar="PATH",
+                        help="Write cProfile stats of the run to a file (see pstats)")
     subparsers = parser.add_subparsers(help='Commands', dest="command")
     subparsers.required = False
     commands.show.add_parser(subparsers, "show")
     commands.execute.add_parser(subparsers, "execute")
+    commands.daemon.add_parser(subparsers, "daemon")
+    commands.completion.add_parser(subparsers, "completion")
     return parser
 
 def run(args):
@@ -32,6 +41,26 @@ def run(args):
     except SystemExit:
         return 2
 
+    lib.set_log_level(config.logger, getattr(logging, options.log_level.upper()))
+    if options.timings or options.timings_file:
+        timings.enable()
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with timings.phase("command"):
+            return run_command(parser, options)
+    finally:
+        if options.profile:
+            profiler.disable()
+            profiler.dump_stats(options.profile)
+        if timings.enabled:
+            timings.disable()
+            timings.report(options.timings, options.timings_file)
+
+def run_command(parser, options):
+    """Run the command of the parsed options. Return status code."""
     if options.version:
         lib.output(__version__)
         return 0
@@ -41,6 +70,12 @@ def run(args):
     elif options.command == "execute":
         commands.execute.run(options)
         return 0
+    elif options.command == "daemon":
+        commands.daemon.run(options)
+        return 0
+    elif options.command == "completion":
+        commands.completion.run(options)
+        return 0
     else:
         parser.print_help(sys.stderr)
         return 2
@@ -50,19 +85,31 @@ def main(args):
     logger = config.logger
     try:
         return run(args)
+    except BrokenPipeError:
+        # The reader of STDOUT exited (i.e. `| head`). Point STDOUT to devnull, so the
+        # flush at shutdown does not fail again, and exit without a traceback.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
     except common.ShoogleException as error:
         logger.error(error)
         return 1
-    except googleapiclient.errors.HttpError as error:
-        status = error.resp["status"]
-        data = bytes.decode(error.content).strip()
-        logger.error("Server error response ({0}): {1}".format(status, data))
-        return 3
-    except oauth2client.client.FlowExchangeError as error:
-        logger.error("OAuth 2 error: {}".format(error))
     except json.decoder.JSONDecodeError as error:
         logger.error("JSONDecodeError({}): {}".format(str(error), error.doc))
         return 4
+    except Exception as error:
+        # The Google client libraries are imported only if needed, so check their
+        # exceptions without importing them.
+        if isinstance(error, common.ServerError) or \
+                lib.is_instance(error, "googleapiclient.errors.HttpError"):
+            status = error.resp["status"]
+            data = bytes.decode(error.content).strip()
+            logger.error("Server error response ({0}): {1}".format(status, data))
+            return 3
+        elif lib.is_instance(error, "oauth2client.client.FlowExchangeError"):
+            logger.error("OAuth 2 error: {}".format(error))
+        else:
+            raise
 
 if __name__ == '__main__':
     sys.exit(run(sys.argv[:1]))
@@ -0,0 +1,210 @@
+"""
+Split storage of discovery documents: an SQLite file per service with a row for
+each resource and each schema (and the references between schemas), so a method
+and the schemas it needs can be loaded without parsing the rest of the document.
+"""
+import contextlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+import urllib.parse
+
+from . import config
+from . import lib
+from . import timings
+from .cache import Entry
+
+# Increment when the layout of the files changes (older files are ignored)
+version = 1
+
+# Keys of the document stored in their own tables
+PARTS = ["resources", "schemas"]
+
+def get_path(key):
+    """Return the path of the store file for a key."""
+    filename = urllib.parse.quote(key, safe="") + ".sqlite"
+    return os.path.join(config.discovery_cache_dir, filename)
+
+def dumps(obj):
+    """Return the BLOB of a Python object."""
+    return sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+@contextlib.contextmanager
+def connect(path):
+    """Context manager that yields a read-only connection to a store file."""
+    connection = sqlite3.connect("file:{}?mode=ro".format(urllib.parse.quote(path)), uri=True)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def get_references(value):
+    """Return the schema names referenced (directly) by a value of a discovery document."""
+    references = []
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            if "$ref" in value:
+                references.append(value["$ref"])
+            pending.extend(child for child in value.values() if isinstance(child, (dict, list)))
+        elif isinstance(value, list):
+            pending.extend(value)
+    return references
+
+class Document(object):
+    """A discovery document in a store file, its parts are read on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        self.document = None
+
+    def query(self, sql, params=()):
+        with timings.phase("discovery.store.read"), connect(self.path) as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def get_document(self):
+        """Return the document without resources and schemas."""
+        if self.document is None:
+            rows = self.query("SELECT value FROM meta WHERE name = 'document'")
+            self.document = pickle.loads(rows[0][0])
+        return self.document
+
+    def get_resource_names(self):
+        """Return the sorted names of the resources."""
+        return [name for (name,) in self.query("SELECT name FROM resources ORDER BY name")]
+
+    def get_resource(self, name):
+        """Return a resource (None if not found)."""
+        rows = self.query("SELECT data FROM resources WHERE name = ?", (name,))
+        return (pickle.loads(rows[0][0]) if rows else None)
+
+    def get_referenced_schemas(self, value):
+        """Return a dictionary {name: schema} with the schemas referenced (transitively) by value."""
+        names = sorted(set(get_references(value)))
+        if not names:
+            return {}
+        # The closure is computed by SQLite from the references stored for each schema
+        sql = """
+            WITH RECURSIVE closure(name) AS (
+                VALUES {}
+                UNION SELECT refs.ref FROM refs JOIN closure ON refs.name = closure.name
+            )
+            SELECT schemas.name, schemas.data FROM schemas JOIN closure USING (name)
+        """.format(", ".join(["(?)"] * len(names)))
+        return dict((name, pickle.loads(data)) for (name, data) in self.query(sql, names))
+
+    def load(self):
+        """Return the whole document."""
+        with timings.phase("discovery.store.load"), connect(self.path) as connection:
+            parts = dict((table, dict((name, pickle.loads(data)) for (name, data) in
+                                      connection.execute("SELECT name, data FROM " + table)))
+                         for table in PARTS)
+        return lib.merge(self.get_document(), parts)
+
+class MemoryDocument(object):
+    """A discovery document in memory, with the same interface as Document."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_document(self):
+        return dict((key, value) for (key, value) in self.data.items() if key not in PARTS)
+
+    def get_resource_names(self):
+        return sorted(self.data.get("resources", {}))
+
+    def get_resource(self, name):
+        return self.data.get("resources", {}).get(name)
+
+    def get_referenced_schemas(self, value):
+        schemas = self.data.get("schemas", {})
+        referenced = {}
+        pending = list(get_references(value))
+        while pending:
+            name = pending.pop()
+            if name in schemas and name not in referenced:
+                referenced[name] = schemas[name]
+                pending.extend(get_references(schemas[name]))
+        return referenced
+
+    def load(self):
+        return self.data
+
+def load(key):
+    """Return the stored Entry for a key (its data is a Document), None if missing or unreadable."""
+    path = get_path(key)
+    try:
+        with connect(path) as connection:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != version:
+                return None
+            meta = dict(connection.execute(
+                "SELECT name, value FROM meta WHERE name IN ('etag', 'timestamp')"))
+        return Entry(data=Document(path), etag=pickle.loads(meta["etag"]),
+                     timestamp=pickle.loads(meta["timestamp"]))
+    except (sqlite3.Error, KeyError, pickle.UnpicklingError):
+        return None
+
+def save(key, data, etag=None):
+    """Store a whole document (and its ETag) for a key atomically and return the new Entry."""
+    path = get_path(key)
+    timestamp = time.time()
+    document = MemoryDocument(data)
+    try:
+        with timings.phase("discovery.store.save"):
+            lib.mkdir_p(config.discovery_cache_dir)
+            fd, temp_path = tempfile.mkstemp(dir=config.discovery_cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                write(temp_path, document, etag, timestamp)
+                os.replace(temp_path, path)
+            except (OSError, sqlite3.Error):
+                os.remove(temp_path)
+                raise
+    except (OSError, sqlite3.Error) as error:
+        config.logger.warning("Cannot write discovery store ({}): {}".format(key, error))
+        return Entry(data=document, etag=etag, timestamp=timestamp)
+    return Entry(data=Document(path), etag=etag, timestamp=timestamp)
+
+def write(path, document, etag, timestamp):
+    """Write the tables of a document to an (empty) SQLite file."""
+    connection = sqlite3.connect(path)
+    try:
+        # The file is a temporary one until it's complete, no journal is needed
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        with connection:
+            connection.execute("PRAGMA user_version = {:d}".format(version))
+            connection.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value BLOB)")
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("document", dumps(document.get_document())),
+                ("etag", dumps(etag)),
+                ("timestamp", dumps(timestamp)),
+            ])
+            for table in PARTS:
+                connection.execute("CREATE TABLE {} (name TEXT PRIMARY KEY, data BLOB)".format(table))
+                connection.executemany("INSERT INTO {} VALUES (?, ?)".format(table), (
+                    (name, dumps(value)) for (name, value) in document.data.get(table, {}).items()))
+            connection.execute("CREATE TABLE refs (name TEXT, ref TEXT, PRIMARY KEY (name, ref))")
+            connection.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?)", (
+                (name, ref) for (name, schema) in document.data.get("schemas", {}).items()
+                for ref in get_references(schema)))
+    finally:
+        connection.close()
+
+def revalidate(key, entry):
+    """Mark a stored entry as fresh (its document was not modified) and return the new Entry."""
+    timestamp = time.time()
+    try:
+        connection = sqlite3.connect(get_path(key))
+        try:
+            with connection:
+                connection.execute("UPDATE meta SET value = ? WHERE name = 'timestamp'",
+                                   (dumps(timestamp),))
+        finally:
+            connection.close()
+    except sqlite3.Error as error:
+        config.logger.warning("Cannot write discovery store ({}): {}".format(key, error))
+    return entry._replace(timestamp=timestamp)
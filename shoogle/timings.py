@@ -0,0 +1,110 @@
+"""
+Instrumentation of a run: wall time per phase, bytes transferred and counters
+(cache hits/misses, retries). Nothing is recorded unless enable() is called.
+"""
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+
+Phase = collections.namedtuple("Phase", ["calls", "seconds", "bytes"])
+
+enabled = False
+lock = threading.Lock()
+start_time = time.perf_counter()
+phases = collections.OrderedDict()
+counters = collections.OrderedDict()
+events = []
+
+def enable():
+    """Start recording (previous records are discarded)."""
+    global enabled, start_time
+    with lock:
+        enabled = True
+        start_time = time.perf_counter()
+        phases.clear()
+        counters.clear()
+        del events[:]
+
+def disable():
+    """Stop recording."""
+    global enabled
+    enabled = False
+
+def record(name, start, seconds, nbytes=0):
+    """Record a call of a phase that started at start (perf_counter) and took seconds."""
+    with lock:
+        calls, total_seconds, total_bytes = phases.get(name, Phase(0, 0.0, 0))
+        phases[name] = Phase(calls + 1, total_seconds + seconds, total_bytes + nbytes)
+        events.append((name, start - start_time, seconds, nbytes, threading.get_ident()))
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Context manager that records the wall time of its block as a call of the phase.
+    It yields a list where the block can append the bytes it transferred.
+    """
+    if not enabled:
+        yield []
+        return
+    with lock:
+        # Phases are listed in the order they start
+        phases.setdefault(name, Phase(0, 0.0, 0))
+    transferred = []
+    start = time.perf_counter()
+    try:
+        yield transferred
+    finally:
+        record(name, start, time.perf_counter() - start, sum(transferred))
+
+def count(name, value=1):
+    """Increment a counter."""
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + value
+
+def get_elapsed():
+    """Return the seconds since recording started."""
+    return time.perf_counter() - start_time
+
+def get_summary():
+    """Return the lines of a human-readable summary of the records."""
+    lines = ["Timings (wall time {:.3f}s, phases of concurrent threads are summed):".format(
+        get_elapsed())]
+    lines.append("  {:<32} {:>7} {:>10} {:>12}".format("phase", "calls", "seconds", "bytes"))
+    with lock:
+        for name, (calls, seconds, nbytes) in phases.items():
+            lines.append("  {:<32} {:>7} {:>10.3f} {:>12}".format(
+                name, calls, seconds, nbytes or ""))
+        for name, value in counters.items():
+            lines.append("  {:<32} {:>7}".format(name, value))
+    return lines
+
+def get_trace():
+    """
+    Return the records as a JSON-serializable object. Events use the Trace Event
+    Format, so the file can be opened with chrome://tracing or Perfetto.
+    """
+    with lock:
+        trace_events = [{
+            "name": name, "ph": "X", "pid": 0, "tid": thread_id,
+            "ts": int(start * 1e6), "dur": int(seconds * 1e6),
+            "args": ({"bytes": nbytes} if nbytes else {}),
+        } for (name, start, seconds, nbytes, thread_id) in events]
+        return {
+            "wallTime": get_elapsed(),
+            "phases": collections.OrderedDict((name, phase._asdict())
+                                              for (name, phase) in phases.items()),
+            "counters": collections.OrderedDict(counters),
+            "traceEvents": trace_events,
+        }
+
+def report(summary=True, trace_path=None):
+    """Write the summary to STDERR and/or the JSON trace to a file."""
+    if summary:
+        sys.stderr.write("\n".join(get_summary()) + "\n")
+    if trace_path:
+        with open(trace_path, "w") as fd:
+            json.dump(get_trace(), fd, indent=2)
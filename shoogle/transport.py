@@ -0,0 +1,55 @@
+"""HTTP transport: httplib2 objects that share keep-alive connections within a thread."""
+import http.client
+import socket
+import threading
+
+from . import config
+from . import lib
+from . import timings
+
+local = threading.local()
+
+def get_proxy_info():
+    """Return the proxy settings for httplib2.Http (the environment is used by default)."""
+    import httplib2
+    if config.http_proxy:
+        return httplib2.proxy_info_from_url(config.http_proxy)
+    else:
+        return httplib2.proxy_info_from_environment
+
+def get_http():
+    """
+    Return a new httplib2.Http that reuses the open connections of the current thread.
+
+    Each user (discovery fetches, token refreshes, service objects) gets its own Http,
+    as credentials wrap its request method, but they share the connection pool. Pools
+    are per thread, as httplib2 connections are not thread-safe.
+    """
+    import httplib2
+    if not hasattr(local, "connections"):
+        local.connections = {}
+    http = httplib2.Http(timeout=config.http_timeout, proxy_info=get_proxy_info())
+    http.connections = local.connections
+    # Resumable uploads answer 308 (without Location) for incomplete uploads, which is not
+    # a redirect (same as googleapiclient.http.build_http). Service objects must use this
+    # Http, or httplib2 raises RedirectMissingLocation on uploads of more than one chunk.
+    http.redirect_codes = http.redirect_codes - {308}
+    if timings.enabled:
+        http.request = get_timed_request(http.request)
+    return http
+
+def is_transport_error(error):
+    """Return True if error was raised by the transport (connection, timeout or HTTP protocol)."""
+    return isinstance(error, (ConnectionError, socket.timeout, http.client.HTTPException)) or \
+        lib.is_instance(error, "httplib2.HttpLib2Error")
+
+def get_timed_request(request):
+    """Return a wrapper of Http.request that records its time and the bytes transferred."""
+    def timed_request(uri, method="GET", body=None, *args, **kwargs):
+        with timings.phase("http.request") as transferred:
+            response, content = request(uri, method, body, *args, **kwargs)
+            transferred.append(len(content or b""))
+            if isinstance(body, (bytes, str)):
+                transferred.append(len(body))
+        return response, content
+    return timed_request
@@ -0,0 +1,209 @@
+"""
+Validation of requests against the parameters and schemas of a discovery document,
+so invalid requests are rejected before credentials, service objects or API calls.
+"""
+import json
+import re
+
+from . import common
+
+# Parameters that googleapiclient accepts for all methods (not in discovery documents)
+LIBRARY_PARAMETERS = ["trace", "pp", "userip", "strict"]
+
+# Parameters of methods with media upload
+MEDIA_PARAMETERS = ["media_body", "media_mime_type"]
+
+# Required page tokens are not enforced (same workaround as googleapiclient)
+PAGE_TOKEN_PARAMETERS = ["pageToken", "nextPageToken"]
+
+# Maximum number of errors included in the message of a ValidationError
+MAX_ERRORS = 10
+
+# Compiled validators, by (service ID, service revision, method ID)
+validators = {}
+
+JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+}
+
+class ValidationError(common.ShoogleException):
+    """The request is not valid for the method, errors is a list of "path: message" strings."""
+    def __init__(self, method_id, errors):
+        shown_errors = errors[:MAX_ERRORS] + (
+            ["and {} more errors".format(len(errors) - MAX_ERRORS)] if len(errors) > MAX_ERRORS else [])
+        msg = "Invalid request for {}: {}".format(method_id, "; ".join(shown_errors))
+        common.ShoogleException.__init__(self, msg)
+        self.errors = errors
+
+def key2param(key):
+    """Return the argument name of a parameter (same as googleapiclient.discovery.key2param)."""
+    prefix = ("" if key[:1].isalpha() else "x")
+    return prefix + "".join((char if char.isalnum() else "_") for char in key)
+
+def get_type_name(value):
+    """Return the JSON type name of a Python value."""
+    if isinstance(value, bool):
+        return "boolean"
+    for type_name in ["integer", "number", "string", "array", "object"]:
+        if isinstance(value, JSON_TYPES[type_name]):
+            return type_name
+    return ("null" if value is None else type(value).__name__)
+
+def is_type(value, type_name, value_format=None):
+    """Return True if a JSON value is of a discovery type (int64 strings accept integers)."""
+    if isinstance(value, bool):
+        return type_name == "boolean"
+    elif type_name == "string" and value_format in ("int64", "uint64"):
+        return isinstance(value, (str, int))
+    else:
+        return isinstance(value, JSON_TYPES.get(type_name, object))
+
+def is_parameter_type(value, type_name):
+    """
+    Return True if a value can be used for a parameter of a type. Parameters are sent
+    as strings, so strings with the representation of the type are accepted too.
+    """
+    if type_name == "integer":
+        return is_type(value, "integer") or \
+            (isinstance(value, str) and re.match(r"^-?\d+$", value) is not None)
+    elif type_name == "number":
+        return is_type(value, "number") or \
+            (isinstance(value, str) and re.match(r"^-?\d+(\.\d+)?([eE][-+]?\d+)?$", value) is not None)
+    elif type_name == "boolean":
+        return isinstance(value, bool) or value in ("true", "false")
+    else:
+        return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+def get_enum_error(value, enum):
+    """Return the error message of a value not in an enum (None if it's valid)."""
+    if value not in enum:
+        return "{} is not one of: {}".format(json.dumps(value), ", ".join(enum))
+
+def compile_parameter(name, parameter):
+    """Return a function (value, errors) that checks the value of a parameter."""
+    type_name = parameter.get("type", "string")
+    enum = parameter.get("enum")
+    pattern = (re.compile(parameter["pattern"]) if parameter.get("pattern") else None)
+
+    def check_value(value, path, errors):
+        if not is_parameter_type(value, type_name):
+            errors.append("{}: expected {}, got {}".format(path, type_name, get_type_name(value)))
+        elif enum and get_enum_error(value, enum):
+            errors.append("{}: {}".format(path, get_enum_error(value, enum)))
+        elif pattern and isinstance(value, str) and not pattern.match(value):
+            errors.append("{}: {} does not match pattern {}".format(
+                path, json.dumps(value), pattern.pattern))
+
+    def check(value, errors):
+        if parameter.get("repeated") and isinstance(value, list):
+            for index, item in enumerate(value):
+                check_value(item, "{}[{}]".format(name, index), errors)
+        else:
+            check_value(value, name, errors)
+    return check
+
+def compile_schema(schema, schemas, compiled, method_id):
+    """
+    Return a function (value, path, errors) that checks a value against a schema.
+    Referenced schemas are compiled once into the dictionary compiled.
+    """
+    if "$ref" in schema:
+        name = schema["$ref"]
+        if name not in schemas:
+            return lambda value, path, errors: None
+        elif name not in compiled:
+            # Recursive references find the key while the schema is being compiled
+            compiled[name] = None
+            compiled[name] = compile_schema(schemas[name], schemas, compiled, method_id)
+        return lambda value, path, errors: compiled[name](value, path, errors)
+
+    type_name = schema.get("type", "any")
+    value_format = schema.get("format")
+    enum = schema.get("enum")
+    properties = dict((key, compile_schema(value, schemas, compiled, method_id))
+                      for (key, value) in schema.get("properties", {}).items())
+    required = sorted(key for (key, value) in schema.get("properties", {}).items()
+                      if method_id in value.get("annotations", {}).get("required", []))
+    additional = schema.get("additionalProperties")
+    check_additional = (compile_schema(additional, schemas, compiled, method_id)
+                        if isinstance(additional, dict) else None)
+    check_item = (compile_schema(schema["items"], schemas, compiled, method_id)
+                  if "items" in schema else None)
+
+    def check(value, path, errors):
+        if value is None:
+            return
+        elif type_name != "any" and not is_type(value, type_name, value_format):
+            errors.append("{}: expected {}, got {}".format(path, type_name, get_type_name(value)))
+        elif enum and get_enum_error(value, enum):
+            errors.append("{}: {}".format(path, get_enum_error(value, enum)))
+        elif isinstance(value, dict):
+            for key in required:
+                if key not in value:
+                    errors.append("{}.{}: missing required property".format(path, key))
+            for key, child in value.items():
+                child_path = "{}.{}".format(path, key)
+                if key in properties:
+                    properties[key](child, child_path, errors)
+                elif check_additional:
+                    check_additional(child, child_path, errors)
+                elif properties and additional is None:
+                    errors.append("{}: unknown property".format(child_path))
+        elif isinstance(value, list) and check_item:
+            for index, item in enumerate(value):
+                check_item(item, "{}[{}]".format(path, index), errors)
+    return check
+
+def compile_method(service, method):
+    """Return a function (method_options, errors) that checks a request for a method."""
+    parameters = dict(service.get("parameters", {}), **method.get("parameters", {}))
+    # googleapiclient adds a "body" parameter to the methods of the service objects it builds
+    parameters.pop("body", None)
+    checks = dict((key2param(name), compile_parameter(key2param(name), parameter))
+                  for (name, parameter) in parameters.items())
+    required = sorted(key2param(name) for (name, parameter) in parameters.items()
+                      if parameter.get("required") and name not in PAGE_TOKEN_PARAMETERS)
+    allowed = set(checks).union(LIBRARY_PARAMETERS)
+    if method.get("supportsMediaUpload"):
+        allowed.update(MEDIA_PARAMETERS)
+    check_body = None
+    if method.get("request"):
+        allowed.add("body")
+        check_body = compile_schema(method["request"], service.get("schemas", {}), {}, method["id"])
+
+    def check(method_options, errors):
+        if not isinstance(method_options, dict):
+            errors.append("request: expected object, got {}".format(get_type_name(method_options)))
+            return
+        for name in required:
+            if method_options.get(name) is None:
+                errors.append("{}: missing required parameter".format(name))
+        for name, value in sorted(method_options.items()):
+            if name not in allowed:
+                errors.append("{}: unknown parameter".format(name))
+            elif value is None:
+                continue
+            elif name == "body":
+                check_body(value, "body", errors)
+            elif name in checks:
+                checks[name](value, errors)
+    return check
+
+def get_validator(service, method):
+    """Return the validator of a method, compiled on the first call."""
+    key = (service.get("id"), service.get("revision"), method["id"])
+    if key not in validators:
+        validators[key] = compile_method(service, method)
+    return validators[key]
+
+def validate_request(service, method, method_options):
+    """Raise ValidationError if the request is not valid for the method."""
+    errors = []
+    get_validator(service, method)(method_options, errors)
+    if errors:
+        raise ValidationError(method["id"], errors)
@@ -7,19 +7,34 @@ test_shoogle
 Tests for `shoogle` module.
 """
 
+import argparse
 import collections
 from contextlib import contextmanager
+import copy
+import datetime
+import http.client
+import http.server
 import json
+import io
 from io import StringIO
 import logging
+import os
 import re
+import shlex
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
 import shoogle
+from shoogle import auth
+from shoogle import common
 from shoogle import lib
 from shoogle import config
+from shoogle import ratelimit
 
 import jsmin
 
@@ -53,7 +68,7 @@ class TestShoogle(unittest.TestCase):
         self.assertEqual(2, e.status)
         self.assertIn("usage: ", e.err)
         self.assertIn("positional arguments:", e.err)
-        self.assertIn("{show,execute}", e.err)
+        self.assertIn("{show,execute,daemon,completion}", e.err)
         self.assertIn("optional arguments:", e.err)
 
     def test_main_with_option_shows_usage_and_help_messages(self):
@@ -62,7 +77,7 @@ class TestShoogle(unittest.TestCase):
         self.assertEqual(2, e.status)
         self.assertIn("usage: ", e.out)
         self.assertIn("positional arguments:", e.out)
-        self.assertIn("{show,execute}", e.out)
+        self.assertIn("{show,execute,daemon,completion}", e.out)
         self.assertIn("optional arguments:", e.out)
 
     def test_main_with_option_shows_version(self):
@@ -154,8 +169,1340 @@ class TestShoogle(unittest.TestCase):
     def test_main_execute_with_missing_parameter(self):
         with temporal_file("{}") as request_file:
             e = main(["execute", "tasks:v1.tasks.get", request_file])
+            self.assertEqual(1, e.status)
+            self.assertIn("Invalid request for tasks.tasks.get: task: missing required parameter", e.err)
+
+    def test_main_execute_with_missing_parameter_without_validation(self):
+        with temporal_file("{}") as request_file:
+            e = main(["execute", "--no-validate", "tasks:v1.tasks.get", request_file])
             self.assertEqual(0, e.status)
             self.assertIn('Missing required parameter', e.err)
-        
+
+class TestStartup(unittest.TestCase):
+    def test_main_with_version_does_not_import_google_client_libraries(self):
+        code = "import sys, shoogle; shoogle.main(['-v']); print(' '.join(sys.modules))"
+        root_dir = os.path.join(os.path.dirname(__file__), os.pardir)
+        env = dict(os.environ, PYTHONPATH=root_dir)
+        output = subprocess.check_output([sys.executable, "-c", code], env=env)
+        modules = set(module.split(".")[0] for module in output.decode("utf-8").split())
+
+        self.assertFalse(modules & {"googleapiclient", "oauth2client", "httplib2", "jsmin"})
+
+class TestBrokenPipe(unittest.TestCase):
+    def test_main_exits_quietly_when_the_reader_of_stdout_exits(self):
+        code = "\n".join([
+            "import sys, shoogle",
+            "from shoogle import lib",
+            "def run_command(parser, options):",
+            "    for index in range(100000):",
+            "        lib.write_json({'index': index})",
+            "shoogle.shoogle.run_command = run_command",
+            "sys.exit(shoogle.main(['-v']))",
+        ])
+        root_dir = os.path.join(os.path.dirname(__file__), os.pardir)
+        env = dict(os.environ, PYTHONPATH=root_dir)
+        process = subprocess.Popen([sys.executable, "-c", code], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(b'{"index":0}\n', process.stdout.readline())
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+
+        self.assertEqual(1, process.wait())
+        self.assertEqual(b"", stderr)
+
+class TestLib(unittest.TestCase):
+    def test_load_json_parses_plain_json(self):
+        self.assertEqual({"url": "http://example.com"}, lib.load_json('{"url": "http://example.com"}'))
+
+    def test_load_json_parses_json_with_comments(self):
+        json_string = '{\n  "key": "value", // comment\n  /* other */ "url": "http://x"\n}'
+        self.assertEqual({"key": "value", "url": "http://x"}, lib.load_json(json_string))
+
+    def test_write_json_writes_the_same_json_in_chunks(self):
+        obj = {"items": [{"id": str(idx), "tags": ["a", "b"]} for idx in range(2500)],
+               "empty": [], "kind": "tasks", "nested": {"x": [1, {"y": None}]}}
+        for pretty, expected in [(False, lib.compact_json(obj)), (True, lib.pretty_json(obj))]:
+            fd = StringIO()
+            lib.write_json(obj, pretty=pretty, fd=fd, buffer_size=100)
+            self.assertEqual(expected + "\n", fd.getvalue())
+
+FAKE_SERVICE = {
+    "name": "tasks",
+    "version": "v1",
+    "rootUrl": "https://tasks.example.com/",
+    "servicePath": "tasks/v1/",
+    "documentationLink": "https://developers.google.com/fake",
+    "parameters": {},
+    "schemas": {
+        "Task": {"id": "Task", "type": "object", "properties": {"title": {"type": "string"}}},
+        "Tasks": {"id": "Tasks", "type": "object", "properties": {
+            "items": {"type": "array", "items": {"$ref": "Task"}},
+            "nextPageToken": {"type": "string"},
+        }},
+    },
+    "resources": {
+        "tasks": {
+            "methods": {
+                "get": {
+                    "id": "tasks.tasks.get",
+                    "httpMethod": "GET",
+                    "path": "tasks/{task}",
+                    "description": "Returns the specified task.",
+                    "parameters": {"task": {"type": "string", "required": True}},
+                    "response": {"$ref": "Task"},
+                },
+                "list": {
+                    "id": "tasks.tasks.list",
+                    "httpMethod": "GET",
+                    "path": "tasks",
+                    "description": "Returns all tasks.",
+                    "parameters": {"pageToken": {"type": "string"}},
+                    "response": {"$ref": "Tasks"},
+                },
+            },
+        },
+    },
+}
+
+class FakeRequest(object):
+    method = "GET"
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def execute(self):
+        time.sleep(self.kwargs.get("delay", 0))
+        if self.kwargs["task"] == "refused":
+            raise ConnectionRefusedError(111, "Connection refused")
+        return {"title": "Task " + self.kwargs["task"]}
+
+class FakePageRequest(FakeRequest):
+    pages = {
+        None: {"items": [{"title": "1"}, {"title": "2"}], "nextPageToken": "page2"},
+        "page2": {"items": [{"title": "3"}], "nextPageToken": "page3"},
+        "page3": {"items": []},
+    }
+
+    def execute(self):
+        return self.pages[self.kwargs.get("pageToken")]
+
+class FakeTasksResource(object):
+    get = FakeRequest
+    list = FakePageRequest
+
+class FakeBatchRequest(object):
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        if any(request.kwargs["task"] == "disconnected" for (_, request) in self.requests):
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        for request_id, request in self.requests:
+            self.callback(request_id, request.execute(), None)
+
+class FakeServiceObject(object):
+    def __init__(self):
+        self.batches = []
+
+    def tasks(self):
+        return FakeTasksResource()
+
+    def new_batch_http_request(self, callback):
+        self.batches.append(FakeBatchRequest(callback))
+        return self.batches[-1]
+
+class TestExecuteBatch(unittest.TestCase):
+    def setUp(self):
+        self.service_obj = FakeServiceObject()
+        patchers = [
+            mock.patch("shoogle.common.get_method_service",
+                       return_value=copy.deepcopy(FAKE_SERVICE)),
+            mock.patch("shoogle.commands.execute.build_service", return_value=self.service_obj),
+            mock.patch.object(config, "retries", config.retries),
+        ]
+        self.get_service, self.build_service, _ = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_batch_outputs_one_response_per_request_line(self):
+        with temporal_file('{"task": "1"}\n\n{"task": "2"}\n') as request_file:
+            e = main(["execute", "--batch", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual([{"title": "Task 1"}, {"title": "Task 2"}], responses)
+        self.assertEqual(1, self.get_service.call_count)
+        self.assertEqual(1, self.build_service.call_count)
+
+    def test_batch_outputs_errors_in_place_and_continues(self):
+        with temporal_file('{"task": "1"}\nnot-json\n{"task": "3"}\n') as request_file:
+            e = main(["execute", "--batch", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual(3, len(responses))
+        self.assertIn("error", responses[1])
+        self.assertEqual({"title": "Task 3"}, responses[2])
+
+    def test_batch_options_require_batch_mode(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            e_workers = main(["execute", "--workers", "4", "tasks:v1.tasks.get", request_file])
+            e_max_rate = main(["execute", "--max-rate", "2", "tasks:v1.tasks.get", request_file])
+
+        for e in [e_workers, e_max_rate]:
+            self.assertEqual(1, e.status)
+            self.assertIn("Options --workers and --max-rate require --batch", e.err)
+
+    def test_batch_accepts_only_compact_output(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            for output in ["pretty", "ndjson"]:
+                e = main(["execute", "--batch", "--output", output, "tasks:v1.tasks.get",
+                          request_file])
+
+                self.assertEqual(1, e.status)
+                self.assertIn("Option --output {} cannot be used with --batch".format(output), e.err)
+            e = main(["execute", "--batch", "--output", "compact", "tasks:v1.tasks.get",
+                      request_file])
+
+        self.assertEqual(0, e.status)
+        self.assertEqual('{"title":"Task 1"}\n', e.out)
+
+    def test_batch_rejects_non_positive_max_rate(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            for max_rate in ["0", "-1"]:
+                e = main(["execute", "--batch", "--max-rate", max_rate, "tasks:v1.tasks.get",
+                          request_file])
+
+                self.assertEqual(1, e.status)
+                self.assertIn("Option --max-rate must be a positive number", e.err)
+                self.assertEqual("", e.out)
+
+    def test_batch_outputs_transport_errors_in_place_and_continues(self):
+        with temporal_file('{"task": "1"}\n{"task": "refused"}\n{"task": "3"}\n') as request_file:
+            e = main(["execute", "--batch", "--retries", "0", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status, e.err)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual({"title": "Task 1"}, responses[0])
+        self.assertEqual({"error": {"message": "ConnectionRefusedError: [Errno 111] Connection refused"}},
+                         responses[1])
+        self.assertEqual({"title": "Task 3"}, responses[2])
+
+    def test_batch_outputs_validation_errors_in_place(self):
+        with temporal_file('{"task": "1"}\n{"task": 1.5, "other": 1}\n') as request_file:
+            e = main(["execute", "--batch", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual({"title": "Task 1"}, responses[0])
+        self.assertIn("other: unknown parameter", responses[1]["error"]["message"])
+
+    def test_batch_with_workers_keeps_the_order_of_the_requests(self):
+        lines = ['{{"task": "{}", "delay": {}}}'.format(idx, 0.01 * (idx % 3)) for idx in range(12)]
+        with temporal_file("\n".join(lines)) as request_file:
+            # The delay of the fake requests is not a parameter of the method
+            e = main(["execute", "--batch", "--workers", "4", "--no-validate",
+                      "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status)
+        titles = [json.loads(line)["title"] for line in e.out.splitlines()]
+        self.assertEqual(["Task {}".format(idx) for idx in range(12)], titles)
+
+    def test_batch_with_http_batch_size_groups_requests(self):
+        lines = ['{{"task": "{}"}}'.format(idx) for idx in range(5)] + ['not-json']
+        with temporal_file("\n".join(lines)) as request_file:
+            e = main(["execute", "--batch", "--http-batch-size", "2",
+                      "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual([{"title": "Task {}".format(idx)} for idx in range(5)], responses[:5])
+        self.assertIn("error", responses[5])
+        self.assertEqual([2, 2, 1], [len(batch.requests) for batch in self.service_obj.batches])
+
+    def test_http_batch_transport_errors_are_written_for_each_request(self):
+        lines = ['{"task": "1"}', '{"task": "disconnected"}', '{"task": "3"}']
+        with temporal_file("\n".join(lines)) as request_file:
+            e = main(["execute", "--batch", "--http-batch-size", "2", "--retries", "0",
+                      "tasks:v1.tasks.get", request_file])
+            e_single = main(["execute", "--http-batch-size", "2", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status, e.err)
+        responses = [json.loads(line) for line in e.out.splitlines()]
+        error = {"error": {"message": "RemoteDisconnected: Remote end closed connection without response"}}
+        self.assertEqual([error, error, {"title": "Task 3"}], responses)
+        self.assertEqual(1, e_single.status)
+        self.assertIn("Option --http-batch-size requires --batch", e_single.err)
+
+class TestExecuteAllPages(unittest.TestCase):
+    def setUp(self):
+        patchers = [
+            mock.patch("shoogle.common.get_method_service",
+                       return_value=copy.deepcopy(FAKE_SERVICE)),
+            mock.patch("shoogle.commands.execute.build_service", return_value=FakeServiceObject()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_all_pages_outputs_every_page_as_a_json_line(self):
+        with temporal_file("{}") as request_file:
+            e = main(["execute", "--all-pages", "tasks:v1.tasks.list", request_file])
+
+        self.assertEqual(0, e.status)
+        pages = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual([FakePageRequest.pages[token] for token in [None, "page2", "page3"]], pages)
+
+    def test_all_pages_with_items_and_prefetch_outputs_every_item(self):
+        with temporal_file("{}") as request_file:
+            e = main(["execute", "--all-pages", "--items", "--prefetch",
+                      "tasks:v1.tasks.list", request_file])
+
+        self.assertEqual(0, e.status)
+        items = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual([{"title": "1"}, {"title": "2"}, {"title": "3"}], items)
+
+    def test_all_pages_fails_for_methods_without_pagination(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            e = main(["execute", "--all-pages", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(1, e.status)
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        socket_path = os.path.join(temp_dir.name, "daemon.sock")
+        patchers = [
+            mock.patch.object(config, "daemon_socket_path", socket_path),
+            mock.patch("shoogle.common.get_service", return_value=copy.deepcopy(FAKE_SERVICE)),
+            mock.patch("shoogle.commands.execute.build_service", return_value=FakeServiceObject()),
+        ]
+        self.build_service = [patcher.start() for patcher in patchers][-1]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        server = shoogle.commands.daemon.DaemonServer(socket_path, shoogle.commands.daemon.RequestHandler)
+        self.server = server
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def test_execute_sends_requests_through_the_daemon_which_reuses_services(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            e1 = main(["execute", "tasks:v1.tasks.get", request_file])
+            e2 = main(["execute", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e1.status)
+        self.assertEqual({"title": "Task 1"}, json.loads(e2.out))
+        self.assertEqual(1, self.build_service.call_count)
+
+    def test_execute_sends_the_selection_to_the_daemon(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            e = main(["execute", "--select", "title", "tasks:v1.tasks.get", request_file])
+            e_unknown = main(["execute", "--select", "titel", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(0, e.status, e.err)
+        self.assertEqual({"title": "Task 1"}, json.loads(e.out))
+        self.assertEqual(1, e_unknown.status)
+        self.assertIn("Field not found in the response of tasks.tasks.get: titel", e_unknown.err)
+
+    def test_service_objects_are_rebuilt_when_the_document_is_reloaded(self):
+        with mock.patch.object(config, "discovery_ttl", 0), \
+                temporal_file('{"task": "1"}') as request_file:
+            e1 = main(["execute", "tasks:v1.tasks.get", request_file])
+            e2 = main(["execute", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual([0, 0], [e1.status, e2.status])
+        self.assertEqual(2, self.build_service.call_count)
+
+    def test_requests_with_other_settings_are_sent_by_the_client(self):
+        payload = {"api_path": "tasks:v1.tasks.get", "request": {"task": "1"}, "options": {},
+                   "settings": {"discovery_cache_mode": "offline", "http_timeout": 5}}
+
+        with self.assertRaisesRegex(shoogle.commands.daemon.Unavailable,
+                                    "settings differ: discovery_cache_mode, http_timeout"):
+            self.server.process(payload)
+        self.assertFalse(self.build_service.called)
+
+    def test_execute_reports_errors_of_the_daemon(self):
+        with temporal_file('{"task": "1"}') as request_file:
+            e = main(["execute", "tasks:v1.tasks.unknown", request_file])
+
+        self.assertEqual(1, e.status)
+        self.assertIn("Method not found: unknown", e.err)
+
+class TestRateLimiter(unittest.TestCase):
+    def test_wait_limits_calls_per_second(self):
+        limiter = ratelimit.RateLimiter(100)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+class TestSharedRateLimiter(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.rate_limits_path = os.path.join(temp_dir.name, "ratelimits.json")
+        patchers = [
+            mock.patch.object(config, "rate_limits_path", self.rate_limits_path),
+            mock.patch.object(config, "rate_limits_state_dir",
+                              os.path.join(temp_dir.name, "ratelimits")),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_rate_limits(self, rate_limits):
+        with open(self.rate_limits_path, "w") as fd:
+            json.dump(rate_limits, fd)
+
+    def test_burst_tokens_are_free_then_calls_are_paced(self):
+        limiter = ratelimit.SharedRateLimiter("tasks:v1", rate=10, burst=2)
+        delays = [limiter.take_token() for _ in range(4)]
+
+        self.assertEqual([0.0, 0.0], delays[:2])
+        self.assertAlmostEqual(0.1, delays[2], delta=0.01)
+        self.assertAlmostEqual(0.2, delays[3], delta=0.01)
+
+    def test_state_is_shared_between_processes(self):
+        code = ("from shoogle import config, ratelimit; "
+                "config.rate_limits_state_dir = {!r}; "
+                "ratelimit.SharedRateLimiter('tasks:v1', 1).take_token()"
+                .format(config.rate_limits_state_dir))
+        subprocess.check_call([sys.executable, "-c", code])
+
+        delay = ratelimit.SharedRateLimiter("tasks:v1", 1).take_token()
+        self.assertAlmostEqual(1.0, delay, delta=0.5)
+
+    def test_method_limits_take_precedence_over_service_limits(self):
+        self.write_rate_limits({"tasks:v1": 5, "tasks.tasks.list": {"rate": 2, "burst": 3}})
+
+        limiter = ratelimit.get_limiter("tasks:v1", "tasks.tasks.list")
+        self.assertEqual((2, 3), (limiter.rate, limiter.burst))
+        self.assertEqual(5, ratelimit.get_limiter("tasks:v1", "tasks.tasks.get").rate)
+        self.assertIsNone(ratelimit.get_limiter("drive:v3", "drive.files.list"))
+        self.assertIsInstance(ratelimit.get_limiter("tasks:v1", "tasks.tasks.get", 10),
+                              ratelimit.RateLimiters)
+
+    def test_invalid_limits_raise_exception(self):
+        self.write_rate_limits({"tasks:v1": -1})
+
+        self.assertRaises(common.ShoogleException,
+                          ratelimit.get_limiter, "tasks:v1", "tasks.tasks.get")
+
+class TestExecute(unittest.TestCase):
+    def test_build_service_uses_discovery_document_without_downloading_it(self):
+        with mock.patch("httplib2.Http.request") as http_request:
+            service = shoogle.commands.execute.build_service(copy.deepcopy(FAKE_SERVICE), None)
+            request = service.tasks().get(task="1")
+
+        self.assertFalse(http_request.called)
+        self.assertEqual("https://tasks.example.com/tasks/v1/tasks/1", request.uri.split("?")[0])
+
+    def test_output_formats(self):
+        response = {"kind": "tasks", "items": [{"id": "1"}, {"id": "2"}]}
+        outputs = {}
+        for output in ["pretty", "compact", "ndjson"]:
+            with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+                shoogle.commands.execute.write_response(response, output)
+            outputs[output] = stdout.getvalue()
+
+        self.assertEqual(lib.pretty_json(response) + "\n", outputs["pretty"])
+        self.assertEqual('{"kind":"tasks","items":[{"id":"1"},{"id":"2"}]}\n', outputs["compact"])
+        self.assertEqual('{"id":"1"}\n{"id":"2"}\n', outputs["ndjson"])
+
+class TestValidate(unittest.TestCase):
+    SERVICE = lib.merge(FAKE_SERVICE, {
+        "schemas": {
+            "Task": {"id": "Task", "type": "object", "properties": {
+                "title": {"type": "string", "annotations": {"required": ["tasks.tasks.insert"]}},
+                "status": {"type": "string", "enum": ["open", "done"]},
+                "size": {"type": "string", "format": "int64"},
+                "subtasks": {"type": "array", "items": {"$ref": "Task"}},
+                "labels": {"type": "object", "additionalProperties": {"type": "string"}},
+            }},
+        },
+        "resources": {"tasks": {"methods": {"insert": {
+            "id": "tasks.tasks.insert",
+            "httpMethod": "POST",
+            "path": "lists/{list}/tasks",
+            "parameters": {
+                "list": {"type": "string", "required": True, "pattern": "^[a-z]+$"},
+                "max-results": {"type": "integer"},
+                "order": {"type": "string", "enum": ["asc", "desc"], "repeated": True},
+            },
+            "request": {"$ref": "Task"},
+            "response": {"$ref": "Task"},
+        }}}},
+    })
+
+    def setUp(self):
+        from shoogle import validate
+        self.validate = validate
+        validate.validators.clear()
+        self.addCleanup(validate.validators.clear)
+
+    def get_errors(self, method_options):
+        method = self.SERVICE["resources"]["tasks"]["methods"]["insert"]
+        try:
+            self.validate.validate_request(self.SERVICE, method, method_options)
+        except self.validate.ValidationError as error:
+            self.assertTrue(str(error).startswith("Invalid request for tasks.tasks.insert: "))
+            return error.errors
+        return []
+
+    def test_valid_requests_have_no_errors(self):
+        self.assertEqual([], self.get_errors({
+            "list": "inbox", "max_results": "10", "order": ["asc", "desc"],
+            "body": {"title": "t", "size": 3, "subtasks": [{"title": "s", "status": "done"}],
+                     "labels": {"a": "b"}},
+        }))
+
+    def test_parameters_are_checked(self):
+        self.assertEqual([
+            "list: missing required parameter",
+            "body.title: missing required property",
+            "max_results: expected integer, got string",
+            "order[1]: \"up\" is not one of: asc, desc",
+            "unknown: unknown parameter",
+        ], self.get_errors({"max_results": "ten", "order": ["asc", "up"], "unknown": 1, "body": {}}))
+        self.assertEqual(['list: "Inbox" does not match pattern ^[a-z]+$'],
+                         self.get_errors({"list": "Inbox", "body": {"title": "t"}}))
+
+    def test_body_errors_have_the_path_of_the_value(self):
+        self.assertEqual([
+            "body.labels.a: expected string, got integer",
+            "body.subtasks[1].title: missing required property",
+            "body.subtasks[1].titel: unknown property",
+            "body.subtasks[1].status: \"closed\" is not one of: open, done",
+        ], self.get_errors({"list": "inbox", "body": {
+            "title": "t", "labels": {"a": 1},
+            "subtasks": [{"title": "s"}, {"titel": "s", "status": "closed"}],
+        }}))
+
+    def test_execute_fails_before_requesting_credentials(self):
+        with mock.patch("shoogle.common.get_method_service", return_value=copy.deepcopy(FAKE_SERVICE)), \
+                mock.patch("shoogle.commands.execute.get_credentials") as get_credentials, \
+                temporal_file('{"task": ["1"]}') as request_file:
+            e = main(["execute", "--no-daemon", "tasks:v1.tasks.get", request_file])
+
+        self.assertEqual(1, e.status)
+        self.assertIn("Invalid request for tasks.tasks.get: task: expected string, got array", e.err)
+        self.assertFalse(get_credentials.called)
+
+class TestSelection(unittest.TestCase):
+    def setUp(self):
+        from shoogle import selection
+        self.selection = selection
+        self.service = copy.deepcopy(FAKE_SERVICE)
+        self.method = self.service["resources"]["tasks"]["methods"]["list"]
+
+    def test_selectors_are_converted_to_partial_response_fields(self):
+        tree = self.selection.parse("items.title, items.id,nextPageToken,kind.a,kind")
+
+        self.assertEqual("items(title,id),nextPageToken,kind", self.selection.get_fields(tree))
+        self.assertEqual("items/id", self.selection.get_fields(self.selection.parse("items.id")))
+        self.assertRaises(common.ShoogleException, self.selection.parse, "items..id")
+
+    def test_selectors_are_checked_against_the_response_schema(self):
+        self.selection.check(self.service, self.method, self.selection.parse("items.title,nextPageToken"))
+
+        with self.assertRaisesRegex(common.ShoogleException, r"items\.titel \(fields: title\)"):
+            self.selection.check(self.service, self.method, self.selection.parse("items.titel"))
+        with self.assertRaisesRegex(common.ShoogleException, r"nextPageToken\.a "):
+            self.selection.check(self.service, self.method, self.selection.parse("nextPageToken.a"))
+
+    def test_project_keeps_the_selected_fields_of_every_item(self):
+        response = {"kind": "k", "items": [{"id": "1", "title": "a"}, {"id": "2"}], "nextPageToken": "t"}
+        tree = self.selection.parse("items.title,nextPageToken")
+
+        self.assertEqual({"items": [{"title": "a"}, {}], "nextPageToken": "t"},
+                         self.selection.project(response, tree))
+        self.assertEqual(response, self.selection.project(response, None))
+
+class FakeResponse(dict):
+    def __init__(self, status, headers=None):
+        super(FakeResponse, self).__init__(headers or {})
+        self.status = status
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        import http.server
+        connections = self.connections = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                connections.append(self.client_address)
+                http.server.BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = "http://127.0.0.1:{}/".format(server.server_address[1])
+        patcher = mock.patch.object(config, "http_proxy", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_of_a_thread_reuse_the_connection(self):
+        from shoogle import transport
+        common.fetch(self.url)
+        common.fetch(self.url + "other")
+        transport.get_http().request(self.url)
+
+        self.assertEqual(1, len(self.connections))
+
+    def test_threads_use_their_own_connections(self):
+        thread = threading.Thread(target=common.fetch, args=(self.url,))
+        thread.start()
+        thread.join()
+        common.fetch(self.url)
+
+        self.assertEqual(2, len(self.connections))
+
+    def test_timeout_and_proxy_are_configurable(self):
+        from shoogle import transport
+        with mock.patch.object(config, "http_timeout", 5), \
+                mock.patch.object(config, "http_proxy", "http://proxy.example.com:3128"):
+            http = transport.get_http()
+
+        self.assertEqual(5, http.timeout)
+        self.assertEqual(("proxy.example.com", 3128), (http.proxy_info.proxy_host,
+                                                       http.proxy_info.proxy_port))
+
+class TestTimings(unittest.TestCase):
+    def setUp(self):
+        from shoogle import timings
+        self.timings = timings
+        self.addCleanup(timings.disable)
+
+    def test_nothing_is_recorded_unless_enabled(self):
+        self.timings.enable()
+        self.timings.disable()
+        with self.timings.phase("phase") as transferred:
+            transferred.append(10)
+        self.timings.count("counter")
+
+        self.assertEqual({}, self.timings.phases)
+        self.assertEqual({}, self.timings.counters)
+
+    def test_phases_and_counters_are_recorded(self):
+        self.timings.enable()
+        for size in [10, 20]:
+            with self.timings.phase("download") as transferred:
+                transferred.append(size)
+        self.timings.count("cache.hit")
+        self.timings.count("cache.hit")
+
+        trace = self.timings.get_trace()
+        self.assertEqual((2, 30), (trace["phases"]["download"]["calls"],
+                                   trace["phases"]["download"]["bytes"]))
+        self.assertEqual({"cache.hit": 2}, trace["counters"])
+        self.assertEqual(["download", "download"], [event["name"] for event in trace["traceEvents"]])
+        self.assertIn("cache.hit", "\n".join(self.timings.get_summary()))
+
+    def test_main_writes_timings_and_profile(self):
+        import pstats
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = os.path.join(temp_dir, "trace.json")
+            profile_path = os.path.join(temp_dir, "profile.stats")
+            e = main(["--timings", "--timings-file", trace_path, "--profile", profile_path, "-v"])
+            with open(trace_path) as fd:
+                trace = json.load(fd)
+            stats = pstats.Stats(profile_path)
+
+        self.assertEqual(0, e.status)
+        self.assertIn("command", e.err)
+        self.assertEqual(1, trace["phases"]["command"]["calls"])
+        self.assertTrue(stats.total_calls > 0)
+        self.assertFalse(self.timings.enabled)
+
+class TestFakeApi(unittest.TestCase):
+    def setUp(self):
+        from benchmarks import fakeapi
+        self.server = fakeapi.start_server(items=250)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        patchers = [
+            mock.patch.object(config, "discovery_url", self.server.discovery_url),
+            mock.patch.object(config, "discovery_cache_dir", temp_dir.name),
+            mock.patch.object(config, "search_index_path",
+                              os.path.join(temp_dir.name, "search-index.pickle")),
+            mock.patch.object(config, "completion_index_path",
+                              os.path.join(temp_dir.name, "completion-index.txt")),
+            mock.patch.object(config, "uploads_dir", os.path.join(temp_dir.name, "uploads")),
+            mock.patch.object(config, "rate_limits_path", os.path.join(temp_dir.name, "none")),
+            mock.patch.object(config, "discovery_cache_mode", "default"),
+            mock.patch.object(config, "http_proxy", None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_show_method(self):
+        e = main(["show", "bench:v1.items.get"])
+
+        self.assertEqual(0, e.status, e.err)
+        self.assertIn('"id": "(string) ID of the item - required"', e.out)
+
+    def test_execute_all_pages(self):
+        with temporal_file('{"maxResults": 100}') as request_path:
+            e = main(["execute", "--no-daemon", "--all-pages", "--items",
+                      "bench:v1.items.list", request_path])
+
+        self.assertEqual(0, e.status, e.err)
+        ids = [json.loads(line)["id"] for line in e.out.splitlines()]
+        self.assertEqual([str(index) for index in range(250)], ids)
+
+    def test_execute_http_batch(self):
+        lines = ['{{"id": "{}"}}'.format(index) for index in range(5)]
+        with temporal_file("\n".join(lines)) as request_path:
+            e = main(["execute", "--no-daemon", "--batch", "--http-batch-size", "2",
+                      "bench:v1.items.get", request_path])
+
+        self.assertEqual(0, e.status, e.err)
+        ids = [json.loads(line)["id"] for line in e.out.splitlines()]
+        self.assertEqual([str(index) for index in range(5)], ids)
+
+    def test_execute_select_requests_and_outputs_only_the_selected_fields(self):
+        with temporal_file('{"maxResults": 100}') as request_path:
+            e = main(["execute", "--no-daemon", "--all-pages", "--items", "--select", "items.id",
+                      "bench:v1.items.list", request_path])
+
+        self.assertEqual(0, e.status, e.err)
+        items = [json.loads(line) for line in e.out.splitlines()]
+        self.assertEqual([{"id": str(index)} for index in range(250)], items)
+
+    def test_execute_select_fails_for_fields_not_in_the_response(self):
+        with temporal_file('{"id": "1"}') as request_path:
+            e = main(["execute", "--no-daemon", "--select", "id,titel",
+                      "bench:v1.items.get", request_path])
+
+        self.assertEqual(1, e.status)
+        self.assertIn("Field not found in the response of bench.items.get: titel", e.err)
+
+    def test_execute_resumable_upload(self):
+        media_path = os.path.join(self.temp_dir, "media.bin")
+        with open(media_path, "wb") as fd:
+            fd.write(b"x" * (3 * 256 * 1024 + 10))
+        with temporal_file('{"body": {"title": "test"}}') as request_path:
+            e = main(["execute", "--no-daemon", "--chunk-size", "256K", "-f", media_path,
+                      "bench:v1.items.insert", request_path])
+
+        self.assertEqual(0, e.status, e.err)
+        self.assertEqual(str(3 * 256 * 1024 + 10), json.loads(e.out)["size"])
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_func(self, *results):
+        def func():
+            result = next(results_iter)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        results_iter = iter(results)
+        return func
+
+    def error(self, status, reason=None):
+        content = json.dumps({"error": {"errors": [{"reason": reason}]}} if reason else {})
+        return common.ServerError(status, content.encode("utf-8"))
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        from shoogle import retry
+        func = self.get_func(self.error(503), self.error(429), ConnectionResetError(), "ok")
+
+        with mock.patch.object(config, "retry_base_delay", 1.0):
+            self.assertEqual("ok", retry.call(func, 3))
+        delays = [call[0][0] for call in self.sleep.call_args_list]
+        self.assertEqual(3, len(delays))
+        for attempt, delay in enumerate(delays):
+            self.assertTrue(2 ** attempt / 2 <= delay <= 2 ** attempt)
+
+    def test_errors_are_classified_by_status_and_reason(self):
+        from shoogle import retry
+        func = self.get_func(self.error(403, "userRateLimitExceeded"), "ok")
+        self.assertEqual("ok", retry.call(func, 1))
+
+        for error in [self.error(403, "forbidden"), self.error(404), ValueError()]:
+            self.assertRaises(type(error), retry.call, self.get_func(error, "ok"), 5)
+
+    def test_non_idempotent_requests_are_retried_only_if_not_processed(self):
+        from shoogle import retry
+        func = self.get_func(self.error(429), ConnectionRefusedError(), "ok")
+        self.assertEqual("ok", retry.call(func, 5, idempotent=False))
+
+        for error in [self.error(503), ConnectionResetError()]:
+            self.assertRaises(type(error), retry.call, self.get_func(error, "ok"), 5, idempotent=False)
+            with mock.patch.object(config, "retry_all_methods", True):
+                self.assertEqual("ok", retry.call(self.get_func(error, "ok"), 5,
+                                                  idempotent=retry.is_idempotent("POST")))
+
+    def test_retries_are_logged_with_log_level_warning(self):
+        with mock.patch("shoogle.common.get_method_service", return_value=copy.deepcopy(FAKE_SERVICE)), \
+                mock.patch("shoogle.commands.execute.build_service", return_value=FakeServiceObject()), \
+                mock.patch.object(config, "retries", config.retries), \
+                temporal_file('{"task": "refused"}') as request_file:
+            e = main(["--log-level", "warning", "execute", "--batch", "--retries", "1",
+                      "tasks:v1.tasks.get", request_file])
+            e_quiet = main(["execute", "--batch", "--retries", "1", "tasks:v1.tasks.get", request_file])
+
+        self.assertIn("[WARNING] Retry 1/1 of request", e.err)
+        self.assertIn("[WARNING] Giving up request after 1 retries", e.err)
+        self.assertEqual("", e_quiet.err)
+
+    def test_retries_are_limited(self):
+        from shoogle import retry
+        func = self.get_func(self.error(500), self.error(500), "ok")
+
+        self.assertRaises(common.ServerError, retry.call, func, 1)
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_retry_after_header_sets_the_delay(self):
+        from shoogle import retry
+        error = self.error(429)
+        error.resp["retry-after"] = "7"
+
+        self.assertEqual("ok", retry.call(self.get_func(error, "ok"), 1))
+        self.sleep.assert_called_once_with(7.0)
+
+    def test_fetch_retries_server_errors(self):
+        import httplib2
+        responses = [(httplib2.Response({"status": 503}), b""),
+                     (httplib2.Response({"status": 200}), b"{}")]
+        http = mock.Mock(request=mock.Mock(side_effect=responses))
+
+        with mock.patch("shoogle.transport.get_http", return_value=http):
+            self.assertEqual(b"{}", common.fetch("https://example.com")[1])
+        self.assertEqual(2, http.request.call_count)
+
+class TestDiscoveryCache(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patchers = [
+            mock.patch.object(config, "discovery_cache_dir", cache_dir.name),
+            mock.patch.object(config, "discovery_cache_mode", "default"),
+            mock.patch.object(config, "discovery_ttl", 60),
+            mock.patch("shoogle.common.fetch"),
+        ]
+        self.fetch = [patcher.start() for patcher in patchers][-1]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.fetch.return_value = (FakeResponse(200, {"etag": "v1"}), b'{"version": 1}')
+
+    def test_fresh_documents_are_read_from_the_cache(self):
+        self.assertEqual({"version": 1}, common.get_discovery_document("doc", lambda: "url"))
+        self.assertEqual({"version": 1}, common.get_discovery_document("doc", lambda: "url"))
+        self.assertEqual(1, self.fetch.call_count)
+
+    def test_expired_documents_are_revalidated_with_etag(self):
+        common.get_discovery_document("doc", lambda: "url")
+        config.discovery_ttl = 0
+        self.fetch.return_value = (FakeResponse(304), b'')
+
+        self.assertEqual({"version": 1}, common.get_discovery_document("doc", lambda: "url"))
+        self.fetch.assert_called_with("url", {"If-None-Match": "v1"})
+
+    def test_refresh_mode_downloads_cached_documents(self):
+        common.get_discovery_document("doc", lambda: "url")
+        config.discovery_cache_mode = "refresh"
+        self.fetch.return_value = (FakeResponse(200), b'{"version": 2}')
+
+        self.assertEqual({"version": 2}, common.get_discovery_document("doc", lambda: "url"))
+        self.fetch.assert_called_with("url", {})
+
+    def test_offline_mode_uses_expired_documents_and_fails_if_missing(self):
+        common.get_discovery_document("doc", lambda: "url")
+        config.discovery_ttl = 0
+        config.discovery_cache_mode = "offline"
+
+        self.assertEqual({"version": 1}, common.get_discovery_document("doc", lambda: "url"))
+        self.assertRaises(common.ShoogleException,
+                          common.get_discovery_document, "other", lambda: "url")
+        self.assertEqual(1, self.fetch.call_count)
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        from shoogle import store
+        self.store = store
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patchers = [
+            mock.patch.object(config, "discovery_cache_dir", cache_dir.name),
+            mock.patch.object(config, "discovery_cache_mode", "offline"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        service = copy.deepcopy(FAKE_SERVICE)
+        service["schemas"]["Unused"] = {"id": "Unused", "type": "object"}
+        store.save("tasks:v1", service, etag="v1")
+
+    def test_stored_documents_are_loaded_whole_or_by_parts(self):
+        entry = self.store.load("tasks:v1")
+        document = entry.data
+
+        self.assertEqual("v1", entry.etag)
+        self.assertEqual(["tasks"], document.get_resource_names())
+        self.assertEqual("tasks/v1/", document.get_document()["servicePath"])
+        self.assertNotIn("schemas", document.get_document())
+        self.assertIsNone(document.get_resource("other"))
+        self.assertEqual(["Task", "Tasks", "Unused"], sorted(document.load()["schemas"]))
+
+    def test_get_method_service_loads_only_the_method_and_its_schemas(self):
+        service = common.get_method_service("tasks:v1", "tasks", "list")
+
+        self.assertEqual(["list"], list(service["resources"]["tasks"]["methods"]))
+        self.assertEqual(["Task", "Tasks"], sorted(service["schemas"]))
+        self.assertEqual("https://tasks.example.com/", service["rootUrl"])
+        self.assertRaises(common.ShoogleException,
+                          common.get_method_service, "tasks:v1", "tasks", "delete")
+
+    def test_memory_documents_have_the_same_interface(self):
+        document = self.store.MemoryDocument(FAKE_SERVICE)
+        method = FAKE_SERVICE["resources"]["tasks"]["methods"]["list"]
+
+        self.assertEqual(self.store.load("tasks:v1").data.get_referenced_schemas(method),
+                         document.get_referenced_schemas(method))
+
+    def test_revalidate_updates_the_timestamp(self):
+        entry = self.store.load("tasks:v1")
+        with mock.patch("time.time", return_value=entry.timestamp + 100):
+            self.store.revalidate("tasks:v1", entry)
+
+        self.assertEqual(entry.timestamp + 100, self.store.load("tasks:v1").timestamp)
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patchers = [
+            mock.patch.object(config, "discovery_cache_dir", cache_dir.name),
+            mock.patch.object(config, "search_index_path",
+                              os.path.join(cache_dir.name, "search-index.pickle")),
+            mock.patch.object(config, "completion_index_path",
+                              os.path.join(cache_dir.name, "completion-index.txt")),
+            mock.patch.object(config, "discovery_cache_mode", "offline"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        from shoogle import cache, store
+        cache.save("apis", {"items": [
+            {"id": "tasks:v1", "title": "Tasks API", "description": "Manages your tasks"},
+            {"id": "youtube:v3", "title": "YouTube Data API", "description": "Upload videos"},
+        ]})
+        store.save("tasks:v1", FAKE_SERVICE)
+
+    def test_search_finds_methods_of_cached_services(self):
+        from shoogle import index
+        results = index.search(index.update(), "returns task")
+
+        self.assertEqual(["tasks:v1.tasks.get", "tasks:v1.tasks.list"],
+                         [api_path for (api_path, method_id, description) in results])
+
+    def test_search_puts_id_prefix_matches_first(self):
+        from shoogle import index
+        results = index.search(index.update(), "tasks.tasks.l")
+
+        self.assertEqual([("tasks:v1.tasks.list", "tasks.tasks.list", "Returns all tasks.")],
+                         results)
+        self.assertEqual("youtube:v3", index.search(index.update(), "upload video")[0][0])
+
+    def test_update_reads_only_changed_documents(self):
+        from shoogle import index, store
+        index.update()
+        with mock.patch("shoogle.store.load", wraps=store.load) as load:
+            index.update()
+            self.assertNotIn(mock.call("tasks:v1"), load.call_args_list)
+            os.utime(store.get_path("tasks:v1"), (0, 0))
+            index.update()
+            self.assertIn(mock.call("tasks:v1"), load.call_args_list)
+
+    def test_show_search(self):
+        e = main(["show", "--search", "tasks.tasks.g"])
+
+        self.assertEqual(0, e.status)
+        self.assertEqual("tasks:v1.tasks.get - Returns the specified task.\n", e.out)
+
+    def test_update_writes_completion_index(self):
+        from shoogle import index
+        index.update()
+
+        with open(config.completion_index_path) as fd:
+            self.assertEqual([
+                "0\ttasks:v1\t",
+                "1\ttasks:v1.tasks\t",
+                "2\ttasks:v1.tasks.get\ttask",
+                "2\ttasks:v1.tasks.list\tpageToken",
+                "0\tyoutube:v3\t",
+            ], fd.read().splitlines())
+
+class TestCompletion(unittest.TestCase):
+    def get_script(self, shell):
+        from shoogle.commands import completion
+        parser = shoogle.shoogle.get_parser("")
+        return completion.get_script(shell, completion.get_command_options(parser))
+
+    def test_bash_script_completes_options_and_reads_the_index(self):
+        script = self.get_script("bash")
+
+        self.assertIn(shlex.quote(config.completion_index_path), script)
+        self.assertIn("--media-file", script)
+        self.assertIsNone(re.search("@[A-Z_]+@", script))
+        process = subprocess.run(["bash", "-n"], input=script.encode("utf-8"))
+        self.assertEqual(0, process.returncode)
+
+    def test_index_paths_with_quotes_are_escaped(self):
+        from shoogle.commands import completion
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path = os.path.join(temp_dir, "it's a dir", "index.txt")
+            os.mkdir(os.path.dirname(index_path))
+            with open(index_path, "w") as fd:
+                fd.write("0\ttasks:v1\t\n")
+            with mock.patch.object(config, "completion_index_path", index_path):
+                script = self.get_script("bash")
+                fish_quoted = completion.quote("fish", config.completion_index_path)
+            process = subprocess.run(["bash", "-c", script + "\n_shoogle_paths tas"],
+                                     stdout=subprocess.PIPE)
+
+        self.assertEqual(b"tasks:v1.\n", process.stdout)
+        self.assertEqual("'{}'".format(index_path.replace("'", "\\'")), fish_quoted)
+
+    def test_fish_script_completes_options(self):
+        script = self.get_script("fish")
+
+        self.assertIn("complete -c shoogle -n '__fish_seen_subcommand_from execute' "
+                      "-s f -l media-file -r -F", script)
+        self.assertIn('"$argv[1]"', script)
+
+class TestCredentialsIndex(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        patcher = mock.patch.object(config, "credentials_base_dir", temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.credentials_dir = os.path.join(temp_dir.name, "default")
+        os.mkdir(self.credentials_dir)
+        self.write_credentials("a.json", ["s1", "s2", "s3"])
+        self.write_credentials("b.json", ["s1", "s2"])
+
+    def write_credentials(self, filename, scopes):
+        with open(os.path.join(self.credentials_dir, filename), "w") as fd:
+            json.dump({"scopes": scopes}, fd)
+
+    def get_filename(self, scopes, minimal=False):
+        return os.path.basename(common.get_credentials_path(scopes, "default", minimal))
+
+    def test_get_credentials_path_prefers_exact_scopes_then_first_or_minimal_superset(self):
+        self.assertEqual("b.json", self.get_filename(["s2", "s1"]))
+        self.assertEqual("a.json", self.get_filename(["s1"]))
+        self.assertEqual("b.json", self.get_filename(["s1"], minimal=True))
+        self.assertTrue(os.path.exists(os.path.join(self.credentials_dir, "index.json")))
+
+    def test_get_credentials_path_rebuilds_index_on_missing_files(self):
+        self.assertEqual("a.json", self.get_filename(["s3"]))
+        os.remove(os.path.join(self.credentials_dir, "a.json"))
+        self.write_credentials("c.json", ["s3"])
+
+        self.assertEqual("c.json", self.get_filename(["s3"]))
+        self.assertTrue(self.get_filename(["s4"]).startswith("credentials-"))
+
+    def test_add_to_credentials_index_makes_new_credentials_available(self):
+        self.get_filename(["s1"])
+        self.write_credentials("d.json", ["s4"])
+        common.add_to_credentials_index(os.path.join(self.credentials_dir, "d.json"), ["s4"])
+
+        with mock.patch("glob.glob") as glob:
+            self.assertEqual("d.json", self.get_filename(["s4"]))
+        self.assertFalse(glob.called)
+
+class TestTokenRefresh(unittest.TestCase):
+    def setUp(self):
+        import oauth2client.client
+        from oauth2client.file import Storage
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "credentials.json")
+        self.storage = Storage(self.path)
+
+        def get_credentials(access_token, expires_in):
+            expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+            return oauth2client.client.OAuth2Credentials(
+                access_token, "client-id", "client-secret", "refresh-token", expiry,
+                "https://oauth2.example.com/token", "shoogle-test")
+        self.get_credentials = get_credentials
+
+    def test_refresh_credentials_does_nothing_if_token_is_not_expiring(self):
+        credentials = self.get_credentials("token1", 3600)
+        with mock.patch.object(credentials, "refresh") as refresh:
+            auth.refresh_credentials(credentials, self.path, 300)
+        self.assertFalse(refresh.called)
+
+    def test_refresh_credentials_refreshes_expiring_token(self):
+        credentials = self.get_credentials("token1", 60)
+        self.storage.put(credentials)
+        with mock.patch.object(credentials, "refresh") as refresh:
+            auth.refresh_credentials(credentials, self.path, 300)
+        self.assertEqual(1, refresh.call_count)
+
+    def test_refresh_credentials_reuses_token_refreshed_by_other_process(self):
+        credentials = self.get_credentials("token1", 60)
+        self.storage.put(self.get_credentials("token2", 3600))
+        with mock.patch.object(credentials, "refresh") as refresh:
+            auth.refresh_credentials(credentials, self.path, 300)
+        self.assertFalse(refresh.called)
+        self.assertEqual("token2", credentials.access_token)
+
+class FakeUploadRequest(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self.session_paths_exist = []
+
+    def next_chunk(self, num_retries=0):
+        self.resumable_uri = self.resumable_uri or "https://upload.example.com/session1"
+        self.session_paths_exist.append(os.path.exists(self.session_path))
+        status, response = self.chunks.pop(0)
+        return (status, response)
+
+class FakeUploadHandler(http.server.BaseHTTPRequestHandler):
+    """Resumable upload session that acknowledges at most max_ack bytes of each chunk."""
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for key, value in dict(headers or {}, **{"Content-Length": str(len(body))}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.received = b""
+        self.send(200, {"Location": "http://{}:{}/session".format(*self.server.server_address)})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        start, total = re.match(r"bytes (\d+)-\d+/(\d+|\*)", self.headers["Content-Range"]).groups()
+        if int(start) == len(self.server.received):
+            self.server.received += body[:self.server.max_ack]
+        if total != "*" and len(self.server.received) == int(total):
+            self.send(200, {"Content-Type": "application/json"},
+                      json.dumps({"size": len(self.server.received)}).encode("utf-8"))
+        else:
+            # Incomplete upload: 308 without Location
+            self.send(308, {"Range": "bytes=0-{}".format(len(self.server.received) - 1)})
+
+class TestMedia(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.session_path = os.path.join(temp_dir.name, "uploads", "session.json")
+
+    def test_stream_upload_reads_sequentially_and_repeats_current_chunk(self):
+        from shoogle import media
+        upload = media.StreamUpload(io.BytesIO(b"0123456789"), 4)
+
+        self.assertEqual(None, upload.size())
+        self.assertEqual(b"0123", upload.getbytes(0, 4))
+        self.assertEqual(b"0123", upload.getbytes(0, 4))
+        self.assertEqual(b"4567", upload.getbytes(4, 4))
+        self.assertEqual(b"89", upload.getbytes(8, 4))
+        self.assertRaises(IOError, upload.getbytes, 0, 4)
+
+    def test_stream_upload_resends_the_bytes_not_acknowledged(self):
+        from shoogle import media
+        upload = media.StreamUpload(io.BytesIO(b"0123456789"), 4)
+
+        self.assertEqual(b"0123", upload.getbytes(0, 4))
+        self.assertEqual(b"2345", upload.getbytes(2, 4))
+        self.assertEqual(b"5678", upload.getbytes(5, 4))
+        self.assertRaises(IOError, upload.getbytes, 4, 4)
+
+    def upload(self, media_body, max_ack, progress=False):
+        from googleapiclient.http import HttpRequest
+        from googleapiclient.model import JsonModel
+        from shoogle import media
+        from shoogle import transport
+        server = http.server.HTTPServer(("127.0.0.1", 0), FakeUploadHandler)
+        server.max_ack = max_ack
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "http://{}:{}/upload".format(*server.server_address)
+        with mock.patch.object(config, "http_proxy", None):
+            request = HttpRequest(transport.get_http(), JsonModel(False).response, url,
+                                  method="POST", headers={}, resumable=media_body)
+            return media.execute_upload(request, progress=progress), server.received
+
+    def test_execute_upload_sends_chunks_over_http(self):
+        from googleapiclient.http import MediaIoBaseUpload
+        data = os.urandom(3 * 256 * 1024 + 10)
+        media_body = MediaIoBaseUpload(io.BytesIO(data), "application/octet-stream",
+                                       chunksize=256 * 1024, resumable=True)
+
+        response, received = self.upload(media_body, max_ack=len(data))
+        self.assertEqual({"size": len(data)}, response)
+        self.assertEqual(data, received)
+
+    def test_execute_upload_of_stream_resumes_partially_acknowledged_chunks(self):
+        from shoogle import media
+        data = os.urandom(3 * 256 * 1024 + 10)
+        media_body = media.StreamUpload(io.BytesIO(data), 256 * 1024)
+
+        response, received = self.upload(media_body, max_ack=100 * 1024)
+        self.assertEqual({"size": len(data)}, response)
+        self.assertEqual(data, received)
+
+    def test_execute_upload_reports_completed_progress(self):
+        from googleapiclient.http import MediaIoBaseUpload
+        from shoogle import media
+        data = os.urandom(3 * 256 * 1024 + 10)
+        uploads = [
+            MediaIoBaseUpload(io.BytesIO(data), "application/octet-stream",
+                              chunksize=256 * 1024, resumable=True),
+            media.StreamUpload(io.BytesIO(data), 256 * 1024),
+        ]
+
+        for media_body in uploads:
+            with mock.patch("sys.stderr", new=io.StringIO()) as stderr:
+                self.upload(media_body, max_ack=len(data), progress=True)
+            lines = stderr.getvalue().split("\r")
+            self.assertRegex(lines[-1], r"^Uploaded 0.8 MiB / 0.8 MiB \(100%\) at [\d.]+ MiB/s \n$")
+            self.assertNotRegex(lines[1], r" at 0.0 MiB/s")
+
+    def test_chunk_size_unit_applies_only_to_uploads(self):
+        from shoogle.commands import execute
+        options = argparse.Namespace(media_file=None, json_request="request.json", resume=False,
+                                     download="media.bin", chunk_size=100 * 1024)
+
+        execute.check_media_options(options)
+        options.media_file, options.download = "media.bin", None
+        self.assertRaises(common.ShoogleException, execute.check_media_options, options)
+
+    def test_chunk_size_must_be_positive(self):
+        from shoogle.commands import execute
+        for media_file, download in [("media.bin", None), (None, "media.bin")]:
+            for chunk_size in [0, -256 * 1024]:
+                options = argparse.Namespace(media_file=media_file, json_request="request.json",
+                                             resume=False, download=download, chunk_size=chunk_size)
+                self.assertRaises(common.ShoogleException, execute.check_media_options, options)
+
+    def test_execute_upload_persists_session_until_completed(self):
+        from shoogle import media
+        from googleapiclient.http import MediaUploadProgress
+        chunks = [(MediaUploadProgress(4, 10), None), (MediaUploadProgress(8, 10), None),
+                  (None, {"id": "1"})]
+        request = FakeUploadRequest(chunks)
+        request.session_path = self.session_path
+
+        self.assertEqual({"id": "1"}, media.execute_upload(request, self.session_path))
+        self.assertEqual([False, True, True], request.session_paths_exist)
+        self.assertFalse(os.path.exists(self.session_path))
+
+    def test_execute_upload_resumes_stored_session(self):
+        from shoogle import media
+        media.save_session_uri(self.session_path, "https://upload.example.com/session0")
+        request = FakeUploadRequest([(None, {"id": "1"})])
+        request.session_path = self.session_path
+
+        media.execute_upload(request, self.session_path)
+        self.assertEqual("https://upload.example.com/session0", request.resumable_uri)
+        self.assertTrue(request._in_error_state)
+
+class FakeRangeHttp(object):
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        import httplib2
+        start, end = map(int, headers["range"].split("=")[1].split("-"))
+        self.ranges.append((start, end))
+        content = self.data[start:end + 1]
+        content_range = "bytes {}-{}/{}".format(start, start + len(content) - 1, len(self.data))
+        return httplib2.Response({"status": 206, "content-range": content_range}), content
+
+class TestMediaDownload(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "media.bin")
+        self.http = FakeRangeHttp(b"0123456789")
+        self.request = mock.Mock(uri="https://example.com/media", headers={}, http=self.http)
+
+    def test_execute_download_writes_chunks_to_file(self):
+        from shoogle import media
+        media.execute_download(self.request, self.path, 4)
+
+        with open(self.path, "rb") as fd:
+            self.assertEqual(b"0123456789", fd.read())
+        self.assertEqual([(0, 3), (4, 7), (8, 11)], self.http.ranges)
+
+    def test_execute_download_with_resume_completes_partial_file(self):
+        from shoogle import media
+        with open(self.path, "wb") as fd:
+            fd.write(b"012345")
+        media.execute_download(self.request, self.path, 4, resume=True)
+
+        with open(self.path, "rb") as fd:
+            self.assertEqual(b"0123456789", fd.read())
+        self.assertEqual([(6, 9)], self.http.ranges)
+
+class TestReplaceSchemas(unittest.TestCase):
+    schemas = {
+        "Node": {"properties": {
+            "name": {"type": "string"},
+            "children": {"type": "array", "items": {"$ref": "Node"}},
+        }},
+        "Tree": {"properties": {"root": {"$ref": "Node"}, "size": {"type": "integer"}}},
+    }
+
+    def test_recursive_schema_is_cut_and_marked(self):
+        output = common.replace_schemas(self.schemas, {"$ref": "Tree"})
+
+        self.assertEqual({"$ref": "Node", "$recursive": True},
+                         output["root"]["children"]["items"])
+        self.assertEqual({"type": "integer"}, output["size"])
+
+    def test_levels_limit_the_expansion(self):
+        output = common.replace_schemas(self.schemas, {"$ref": "Tree"}, max_level=3)
+
+        self.assertEqual({"children": {"items": {"$ref": "Node"}, "type": "array"},
+                          "name": {"type": "string"}}, output["root"])
+
+    def test_shared_expansions_are_equal(self):
+        output = common.replace_schemas(self.schemas, {"a": {"$ref": "Tree"}, "b": {"$ref": "Tree"}})
+
+        self.assertEqual(output["a"], output["b"])
+
 if __name__ == '__main__':
     sys.exit(unittest.main())